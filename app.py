@@ -2,26 +2,48 @@
 import os
 import io
 from datetime import datetime, timedelta
-import pandas as pd
 from sqlalchemy.exc import IntegrityError
 
-from sqlalchemy import func, case  
+from sqlalchemy import func, case, and_, or_
+from collections import namedtuple
 
 # ==================== FLASK ====================
 from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
 from flask_apscheduler import APScheduler
 # ==================== MIKROTIK HELPER ====================
-from mikrotik_helper import block_ip, unblock_ip, get_mikrotik_connection
+from mikrotik_helper import (
+    router_session, invalidate_router, pool as router_pool,
+)
+from router_health import publish_router_health, load_router_health, router_retry_in, PUBLISH_SECONDS
+from enforcement import (
+    reconcile_router, enforce_transitions,
+    enqueue_enforcement, enqueue_router_job, drain_router_jobs, outbox_stats,
+    scan_drift,
+)
+from leader import lease, leader_only, HEARTBEAT_SECONDS
 
 
 # ==================== THIRD-PARTY ====================
 #from werkzeug.security import generate_password_hash, check_password_hash
-from openpyxl import Workbook
+# pandas / openpyxl are imported inside the import / export routes only
 from sqlalchemy.orm import joinedload
 
 # ==================== LOCAL MODULES ====================
-from connections import SessionLocal
-from models import User, Customer, CustomerNetwork, Branch, Router,Payment
+from connections import SessionLocal, get_db
+from models import User, Customer, CustomerNetwork, Branch, Router,Payment, RouterDrift
+from customer_stream import iter_customers, iter_customer_chunks
+from scheduler_runs import recorded_run, prune_runs, recent_runs, slowest_routers
+from portal_cache import invalidate_portal
+from portal_markers import marker_buffer
+from portal import portal
+from customer_import import (
+    ImportAborted, ImportFileError, import_customers_file, spooled_upload, summarize_errors,
+    to_str, to_float, to_datetime,
+)
+from billing_state import (
+    MANUAL_STATUSES, CYCLE_DAYS, GRACE_WINDOW_DAYS,
+    next_transition_for, schedule_transition, status_case, billing_outlook,
+)
 
 # ==================== FLASK APP ====================
 app = Flask(__name__)
@@ -37,8 +59,14 @@ scheduler = APScheduler()
 app.config["SCHEDULER_API_ENABLED"] = False
 app.config["SCHEDULER_TIMEZONE"] = "Africa/Nairobi"
 
+# Drift scan: fix router/database mismatches automatically?
+app.config["DRIFT_AUTO_REPAIR"] = False
+
 scheduler.init_app(app)
 
+# ✅ captive portal (wifi_access / activate_grace); also runs alone via portal.create_portal_app()
+app.register_blueprint(portal)
+
 # ==================== LOGIN / LOGOUT ====================
 from functools import wraps
 #======          ==============   =====================
@@ -82,19 +110,6 @@ def roles_required(*roles):
             return f(*args, **kwargs)
         return decorated_function
     return decorator
-#================get db context manager=========================
-from contextlib import contextmanager
-
-@contextmanager
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def popup_due(last_shown, today):
-    return (last_shown is None) or (last_shown != today)
 
 @app.route('/')
 def home():
@@ -276,12 +291,21 @@ def logout():
 def admin_dashboard():
     db = SessionLocal()
     try:
-        # Customer stats
-        total_users = db.query(Customer).count()
-        active_users = db.query(Customer).filter_by(status="active").count()
-        grace_users = db.query(Customer).filter_by(status="grace").count()
-        suspended_users = db.query(Customer).filter_by(status="suspended").count()
-        pending_router_users = db.query(Customer).filter_by(status="pending_router").count()  # ✅ NEW
+        # Customer stats + billing outlook: aggregate queries, no rows read
+        billing = billing_outlook(db)
+        by_status = billing["by_status"]
+        total_users = billing["total"]
+        active_users = by_status.get("active", 0)
+        grace_users = by_status.get("grace", 0)
+        suspended_users = by_status.get("suspended", 0)
+        pending_router_users = by_status.get("pending_router", 0)  # ✅ NEW
+
+        # MikroTik outbox queue
+        router_queue = outbox_stats(db)
+
+        # Scheduler telemetry
+        scheduler_runs = recent_runs(db, limit=8)
+        slow_routers = slowest_routers(db)
 
         # Get all branches and routers for dropdowns
         branches = db.query(Branch).all()
@@ -296,6 +320,10 @@ def admin_dashboard():
             grace_users=grace_users,
             suspended_users=suspended_users,
             pending_router_users=pending_router_users,  # ✅ NEW
+            router_queue=router_queue,
+            billing=billing,
+            scheduler_runs=scheduler_runs,
+            slow_routers=slow_routers,
             branches=branches,
             routers=routers,
             datetime=datetime
@@ -509,7 +537,8 @@ def add_router():
 def list_routers():
     with get_db() as db:
         routers = db.query(Router).options(joinedload(Router.branch)).all()
-    return render_template("admin/list_routers.html", routers=routers)
+        health = load_router_health(db)
+    return render_template("admin/list_routers.html", routers=routers, health=health)
 
 #---------------------list branch 
 @app.route("/branch/<int:branch_id>/customers")
@@ -561,6 +590,9 @@ def edit_router(router_id):
             router.password = request.form.get("password", "").strip()
             router.port = int(request.form.get("port") or 8728)
             db.commit()
+
+            # ✅ drop pooled sessions so the next call logs in with the new settings
+            invalidate_router(router.id)
             flash("Router updated successfully", "success")
             return redirect(url_for("list_routers"))
 
@@ -577,11 +609,89 @@ def delete_router(router_id):
         if router:
             db.delete(router)
             db.commit()
+            invalidate_router(router_id)
             flash("Router deleted successfully", "success")
         else:
             flash("Router not found", "danger")
     return redirect(url_for("list_routers"))
 
+# ------------------ RESYNC ROUTER ------------------
+@app.route("/resync_router/<int:router_id>", methods=["POST"])
+@login_required
+@roles_required("admin", "super_admin")
+def resync_router(router_id):
+    """Push the full blocked_users state from the database to one router."""
+    with get_db() as db:
+        router = db.query(Router).filter_by(id=router_id).first()
+        if not router:
+            flash("Router not found", "danger")
+            return redirect(url_for("list_routers"))
+
+        try:
+            result = reconcile_router(db, router)
+        except Exception as e:
+            flash(f"❌ Resync failed for {router.ip_address}: {e}", "danger")
+            return redirect(url_for("list_routers"))
+        finally:
+            publish_router_health()
+
+        if result is None:
+            flash(f"❌ Failed to connect to router {router.ip_address}.", "danger")
+        else:
+            flash(
+                f"✅ Router {router.ip_address} resynced: "
+                f"{len(result['added'])} blocked, {len(result['removed'])} unblocked.",
+                "success"
+            )
+
+    return redirect(url_for("list_routers"))
+
+# ------------------ ROUTER DRIFT ------------------
+@app.route("/routers/drift")
+@login_required
+@roles_required("admin", "super_admin")
+def router_drift():
+    with get_db() as db:
+        drift = (
+            db.query(RouterDrift)
+            .options(joinedload(RouterDrift.router), joinedload(RouterDrift.customer))
+            .order_by(RouterDrift.router_id.asc(), RouterDrift.kind.asc(), RouterDrift.ip_address.asc())
+            .all()
+        )
+    return render_template("admin/router_drift.html", drift=drift)
+
+
+@app.route("/routers/drift/scan", methods=["POST"])
+@login_required
+@roles_required("admin", "super_admin")
+def router_drift_scan():
+    auto_repair = request.form.get("auto_repair") == "1"
+    repair_unknown = request.form.get("repair_unknown") == "1"
+
+    with get_db() as db:
+        summary = scan_drift(db, auto_repair=auto_repair, repair_unknown=repair_unknown)
+    publish_router_health()
+
+    failed = [s["router"] for s in summary.values() if not s["ok"]]
+    totals = {k: sum(s[k] for s in summary.values()) for k in ("missing", "extra", "unknown")}
+    flash(
+        f"🧭 Scanned {len(summary)} router(s): {totals['missing']} missing, "
+        f"{totals['extra']} extra, {totals['unknown']} unknown.",
+        "info"
+    )
+    if failed:
+        flash(f"⚠️ Could not read: {', '.join(failed)}", "warning")
+    return redirect(url_for("router_drift"))
+
+# ------------------ ROUTER JOB QUEUE ------------------
+@app.route("/router_jobs/stats")
+@login_required
+@roles_required("admin", "super_admin")
+def router_jobs_stats():
+    """Outbox depth and age of the oldest pending job, as JSON."""
+    with get_db() as db:
+        return jsonify(outbox_stats(db))
+
 # ================== FETCH ROUTER IP BY BRANCH ==================
 from flask import jsonify
 
@@ -619,13 +729,25 @@ def test_router(router_id):
             flash("Router not found.", "danger")
             return redirect(url_for("list_routers"))
 
-        api = get_mikrotik_connection(router.ip_address, router.username, router.password, router.port)
-        if not api:
-            flash(f"❌ Failed to connect to router {router.ip_address}. Check credentials or API service.", "danger")
+        # ✅ don't wait on a router that keeps failing (this process's breaker,
+        # else the state the worker published)
+        retry_in = router_retry_in(db, router.id)
+        if retry_in:
+            flash(
+                f"⛔ Router {router.ip_address} is marked down after repeated failures. "
+                f"Next attempt allowed in {retry_in}s.",
+                "warning"
+            )
             return redirect(url_for("list_routers"))
 
-        # ✅ Try a simple MikroTik command
-        interfaces = list(api(cmd="/interface/print"))
+        with router_session(router) as api:
+            if not api:
+                flash(f"❌ Failed to connect to router {router.ip_address}. Check credentials or API service.", "danger")
+                return redirect(url_for("list_routers"))
+
+            # ✅ Try a simple MikroTik command
+            interfaces = list(api(cmd="/interface/print"))
+
         if interfaces:
             flash(f"✅ Connected successfully to router {router.ip_address}. Found {len(interfaces)} interfaces.", "success")
         else:
@@ -635,153 +757,46 @@ def test_router(router_id):
         flash(f"❌ Error testing router: {e}", "danger")
     finally:
         db.close()
+        publish_router_health()
 
     return redirect(url_for("list_routers"))
 
 
-def to_str(val):
-    """Convert value to string or None if empty."""
-    if val is None or (isinstance(val, float) and pd.isna(val)) or str(val).strip() == "":
-        return None
-    return str(val).strip()
-
-def to_float(val):
-    """Convert value to float or None if empty."""
-    if val is None or (isinstance(val, float) and pd.isna(val)) or str(val).strip() == "":
-        return None
-    try:
-        return float(val)
-    except ValueError:
-        return None
-
 @app.route("/import_customers", methods=["POST"])
 @login_required
 @roles_required("admin", "super_admin","staff")
 def import_customers():
     file = request.files.get("excel_file")
-    if not file:
-        flash("No Excel file uploaded", "danger")
-        return redirect(url_for("admin_dashboard"))
-
-    df = pd.read_excel(file)
-
-    df.columns = (
-        df.columns
-        .str.strip()
-        .str.lower()
-        .str.replace(" ", "_")
-    )
-
-    required_columns = [
-        "account_no", "customer_name", "phone", "ip_address",
-        "billing_amount", "start_date", "branch_name", "router_ip"
-    ]
-
-    missing_cols = [c for c in required_columns if c not in df.columns]
-    if missing_cols:
-        flash(f"Missing columns: {', '.join(missing_cols)}", "danger")
+    if not file or not file.filename:
+        flash("No Excel/CSV file uploaded", "danger")
         return redirect(url_for("admin_dashboard"))
 
     db = SessionLocal()
-    success = 0
-    errors = []
 
     try:
-        for index, row in df.iterrows():
-            row_no = index + 2  # Excel row number
+        # ✅ spooled to disk + streamed in chunks (bounded memory)
+        with spooled_upload(file) as (path, kind):
+            result = import_customers_file(db, path, kind)
 
-            if row.isnull().all():
-                continue
+        skipped = f", {result['skipped']} rows skipped" if result["skipped"] else ""
+        flash(f"{result['imported']} customers imported successfully{skipped}", "success")
 
-            # ----------------- Branch -----------------
-            branch_name = to_str(row.get("branch_name"))
-            if not branch_name:
-                errors.append(f"Row {row_no}: Missing branch_name")
-                continue
-
-            branch = db.query(Branch).filter(Branch.name.ilike(branch_name)).first()
-            if not branch:
-                branch = Branch(name=branch_name)
-                db.add(branch)
-                db.flush()
-
-            # ----------------- Router (OPTIONAL) -----------------
-            router_ip = to_str(row.get("router_ip"))
-            router = None
-
-            if router_ip:
-                router = db.query(Router).filter_by(ip_address=router_ip).first()
-                if not router:
-                    # Do NOT create router here
-                    errors.append(
-                        f"Row {row_no}: Router '{router_ip}' not found. Customer imported WITHOUT router (assign later)."
-                    )
-                    router = None
-                else:
-                    # Optional: if router exists but belongs to different branch, warn and ignore router
-                    if router.branch_id != branch.id:
-                        errors.append(
-                            f"Row {row_no}: Router '{router_ip}' is not under branch '{branch_name}'. "
-                            f"Customer imported WITHOUT router (fix router branch or Excel)."
-                        )
-                        router = None
-
-            # ----------------- Customer IP (recommended required) -----------------
-            customer_ip = to_str(row.get("ip_address"))
-            if not customer_ip:
-                errors.append(f"Row {row_no}: Missing customer ip_address")
-                continue
-
-            # ----------------- Create Customer -----------------
-            customer = Customer(
-                account_no=to_str(row.get("account_no")),
-                name=to_str(row.get("customer_name")),
-                phone=to_str(row.get("phone")),
-                fat_id=to_str(row.get("fat_id")),
-                ip_address=customer_ip,
-                location=to_str(row.get("location")),
-                billing_amount=to_float(row.get("billing_amount")),
-                start_date=to_datetime(row.get("start_date")),
-                contract_date=to_datetime(row.get("contract_date")),
-                # If router is missing, mark as pending_router (you can rename if you want)
-                status="active" if router else "pending_router",
-                router_id=router.id if router else None
-            )
-
-            db.add(customer)
-            db.flush()
+        if result["errors"]:
+            flash("Some rows had issues: " + summarize_errors(result["errors"]), "warning")
 
-            # ----------------- Customer Network (optional) -----------------
-            network = CustomerNetwork(
-                customer_id=customer.id,
-                cable_no=to_str(row.get("cable_no")),
-                cable_type=to_str(row.get("cable_type")),
-                splitter=to_str(row.get("splitter")),
-                tube_no=to_str(row.get("tube_no")),
-                core_used=to_str(row.get("core_used")),
-                loop_no=to_str(row.get("loop_no")),
-                power_level=to_str(row.get("power_level")),
-                final_coordinates=to_str(row.get("final_coordinates")),
-                coordinates=to_str(row.get("coordinates"))
-            )
-            db.add(network)
+    except ImportFileError as e:
+        flash(str(e), "danger")
 
-            success += 1
-
-        db.commit()
-        flash(f"{success} customers imported successfully", "success")
-
-        if errors:
-            # Avoid too long flash; but keep it for now
-            flash("Some rows had issues: " + " | ".join(errors), "warning")
-
-    except IntegrityError:
-        db.rollback()
-        flash("Database error: possible duplicate Account No", "danger")
+    except ImportAborted as e:
+        if isinstance(e.error, IntegrityError):
+            flash("Database error: possible duplicate Account No or IP on the same router"
+                  + e.progress_note(), "danger")
+        else:
+            flash(f"Error importing file: {str(e)}" + e.progress_note(), "danger")
 
     except Exception as e:
         db.rollback()
-        flash(f"Error importing Excel: {str(e)}", "danger")
+        flash(f"Error importing file: {str(e)}", "danger")
 
     finally:
         db.close()
@@ -790,25 +805,6 @@ def import_customers():
 
 
 
-def to_datetime(val, fmt="%Y-%m-%d"):
-    """Convert a string or pandas datetime to Python datetime or None if empty."""
-    if val is None:
-        return None
-    if isinstance(val, float) and pd.isna(val):
-        return None
-    val_str = str(val).strip()
-    if val_str == "":
-        return None
-    if isinstance(val, datetime):
-        return val
-    # Try to parse string to datetime
-    try:
-        return datetime.strptime(val_str, fmt)
-    except ValueError:
-        return None
-
-
-
 
 
 
@@ -843,9 +839,15 @@ def add_customer():
                 status="active",
                 router_id=router_id
             )
+            schedule_transition(customer)
 
             db.add(customer)
-            db.commit()
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                flash("❌ Account No already exists, or this IP is already used on the selected router", "danger")
+                return redirect(url_for("add_customer"))
             db.refresh(customer)
 
             network = CustomerNetwork(
@@ -1038,13 +1040,20 @@ def assign_router(customer_id):
             flash("Customer not found", "danger")
             return redirect(url_for("list_customers"))
 
+        old_router_id = customer.router_id
         customer.router_id = router_id
 
         # ✅ optional: if was pending_router, activate once router assigned
         if router_id and customer.status == "pending_router":
             customer.status = "active"
+            schedule_transition(customer)
+
+        if old_router_id != router_id:
+            enqueue_router_job(db, old_router_id, customer.ip_address, "unblock")
+            enqueue_enforcement(db, customer)
 
         db.commit()
+        invalidate_portal(customer.ip_address)
 
     flash("✅ Router assigned", "success")
     return redirect(url_for("list_customers"))
@@ -1081,8 +1090,9 @@ def edit_customer(customer_id):
             routers = db.query(Router).filter(Router.branch_id == selected_branch_id).all()
 
         if request.method == "POST":
-            # Keep old router id for comparison
+            # Keep old router/IP for comparison
             old_router_id = customer.router_id
+            old_ip_address = customer.ip_address
 
             # ----------------- Customer fields -----------------
             customer.account_no = to_str(request.form.get("account_no"))
@@ -1114,24 +1124,21 @@ def edit_customer(customer_id):
             network.coordinates = request.form.get("coordinates")
             customer.network = network
 
-            db.add(customer)
-            db.commit()
-
-            # ✅ Apply MikroTik immediately (only if router exists + IP exists)
-            # IMPORTANT: Don't rely on customer.router after changing router_id; query it fresh
-            router = db.query(Router).filter_by(id=customer.router_id).first() if customer.router_id else None
+            # ✅ Queue MikroTik change with the same commit (worker applies it)
+            # moved to another router / IP -> release the old address first
+            if old_router_id and (old_router_id != customer.router_id or old_ip_address != customer.ip_address):
+                enqueue_router_job(db, old_router_id, old_ip_address, "unblock")
+            enqueue_enforcement(db, customer)
+            schedule_transition(customer)
 
-            if router and customer.ip_address:
-                try:
-                    # If customer is in any blocked-like state -> block
-                    if customer.status in ["suspended", "manually_suspended", "on_hold"]:
-                        block_ip(customer.ip_address, router)
-                    else:
-                        # active/grace/pending_router/anything else -> unblock to ensure access
-                        unblock_ip(customer.ip_address, router)
-
-                except Exception as e:
-                    flash(f"⚠️ Customer saved but MikroTik action failed: {e}", "warning")
+            db.add(customer)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                flash("❌ Account No already exists, or this IP is already used on the selected router", "danger")
+                return redirect(url_for("edit_customer", customer_id=customer_id))
+            invalidate_portal(old_ip_address, customer.ip_address)
 
             # Optional info message if router not assigned
             if customer.router_id is None:
@@ -1160,8 +1167,11 @@ def delete_customer(customer_id):
     with get_db() as db:
         customer = db.query(Customer).filter_by(id=customer_id).first()
         if customer:
+            ip_address = customer.ip_address
+            marker_buffer.discard(customer.id)
             db.delete(customer)
             db.commit()
+            invalidate_portal(ip_address)
             flash("✅ Customer deleted successfully!", "success")
         else:
             flash("❌ Customer not found", "danger")
@@ -1185,13 +1195,7 @@ def grace_popup(ip_address):
         if not customer:
             return "Customer not found", 404
 
-        router = customer.router
         today = datetime.utcnow().date()
-        start_date = customer.start_date.date() if customer.start_date else today
-        subscription_end = start_date + timedelta(days=30)
-        if not customer.grace_days or customer.grace_days < 1:
-            customer.grace_days = 1
-        grace_end = subscription_end + timedelta(days=customer.grace_days)
 
         if request.method == "POST":
             selected_days = request.form.get("grace_days")
@@ -1200,202 +1204,23 @@ def grace_popup(ip_address):
                 selected_days = min(selected_days, 5)
                 customer.grace_days = selected_days
                 customer.popup_shown = True
+                customer.grace_pass_date = today
                 customer.status = "grace"
+                enqueue_enforcement(db, customer)
+                schedule_transition(customer)
                 db.commit()
-
-                # ✅ Unblock IP if router exists
-                if router:
-                    unblock_ip(customer.ip_address, router)
+                invalidate_portal(ip_address)
 
                 flash(f"Grace period of {selected_days} day(s) activated.", "success")
-                return redirect(url_for("wifi_access", ip_address=ip_address))
+                return redirect(url_for("portal.wifi_access", ip_address=ip_address))
             except Exception as e:
                 db.rollback()
                 flash(f"Error: {e}", "danger")
                 return redirect(url_for("grace_popup", ip_address=ip_address))
 
-        # Auto-increment grace days if popup not shown
-        if not customer.popup_shown:
-            customer.grace_days = min((customer.grace_days or 1) + 1, 5)
-            db.commit()
-
+        # ✅ GET is read-only; the grace days are stored by the POST above
         return render_template("customer/grace_popup.html", customer=customer)
 
-from flask import Response
-
-@app.route("/activate_grace/<ip_address>", methods=["GET", "POST"])
-def activate_grace(ip_address):
-    next_url = request.args.get("next") or "https://google.com"
-
-    with get_db() as db:
-        customer = (
-            db.query(Customer)
-            .options(joinedload(Customer.router))
-            .filter_by(ip_address=ip_address)
-            .first()
-        )
-        if not customer:
-            return "Customer not found", 404
-
-        today = datetime.utcnow().date()
-        start_date = customer.start_date.date() if customer.start_date else today
-        days_used = (today - start_date).days + 1
-
-        # ✅ Only allow grace Day 31–33
-        if not (31 <= days_used <= 33):
-            customer.status = "suspended"
-            db.commit()
-        else:
-            customer.grace_pass_date = today
-            customer.status = "grace"
-            db.commit()
-
-            # ✅ Unblock on MikroTik (optional)
-            router = customer.router
-            if router:
-                try:
-                    unblock_ip(customer.ip_address, router)
-                except Exception as e:
-                    print(f"⚠️ MikroTik unblock failed: {e}")
-
-    # ✅ IMPORTANT: captive portals sometimes ignore 302 redirects
-    # So we return a small HTML page that forces redirect.
-    html = f"""
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8">
-      <meta http-equiv="refresh" content="0;url={next_url}">
-      <script>window.location.replace("{next_url}");</script>
-    </head>
-    <body>
-      Redirecting...
-      <a href="{next_url}">Continue</a>
-    </body>
-    </html>
-    """
-    return Response(html, mimetype="text/html")
-
-
-@app.route("/wifi_access/<ip_address>")
-def wifi_access(ip_address):
-    # ✅ must be INSIDE the route
-    next_url = request.args.get("next") or "https://google.com"
-
-    with get_db() as db:
-        customer = (
-            db.query(Customer)
-            .options(joinedload(Customer.router))
-            .filter_by(ip_address=ip_address)
-            .first()
-        )
-        if not customer:
-            return "Customer not found", 404
-
-        router = customer.router
-        today = datetime.utcnow().date()
-
-        start_date = customer.start_date.date() if customer.start_date else today
-        subscription_end = start_date + timedelta(days=30)
-
-        days_used = (today - start_date).days + 1
-        days_left = max((subscription_end - today).days, 0)
-
-        old_status = customer.status
-
-        # popup vars
-        show_popup = False
-        popup_type = None
-        popup_message = None
-
-        # ✅ show active card once per billing cycle
-        show_active_card = False
-
-        short_message = ""
-        detailed_message = None
-
-        # ==================== DAY 1–30 (ACTIVE) ====================
-        if days_used <= 30:
-            customer.status = "active"
-            short_message = f"Your subscription runs from {start_date} to {subscription_end}."
-
-            # ✅ show ACTIVE card only once per cycle
-            if customer.active_card_cycle_start != start_date:
-                show_active_card = True
-                customer.active_card_cycle_start = start_date
-
-            # ✅ day 25–30 popup once per day
-            if 25 <= days_used <= 30 and popup_due(customer.pre_expiry_popup_last_shown, today):
-                show_popup = True
-                popup_type = "pre_expiry"
-                popup_message = (
-                    f"Your subscription will expire on <strong>{subscription_end}</strong> "
-                    f"({days_left} day(s) left). Please make payment to continue uninterrupted service."
-                )
-                customer.pre_expiry_popup_last_shown = today
-
-        # ==================== DAY 31–33 (GRACE OFFER) ====================
-        elif 31 <= days_used <= 33:
-            if customer.grace_pass_date == today:
-                customer.status = "grace"
-                short_message = "Grace activated for today. Please make payment to restore monthly service."
-            else:
-                customer.status = "suspended"
-                short_message = "Your subscription has expired."
-
-                # ✅ show grace button popup once per day
-                if popup_due(customer.grace_offer_popup_last_shown, today):
-                    show_popup = True
-                    popup_type = "grace_offer"
-                    popup_message = (
-                        "Your subscription has expired.<br>"
-                        "Click <strong>GRACE</strong> to continue browsing for today."
-                    )
-                    customer.grace_offer_popup_last_shown = today
-
-        # ==================== DAY 34+ (SUSPENDED) ====================
-        else:
-            customer.status = "suspended"
-            short_message = "You have utilised all your grace for the month. Please pay to continue enjoying the internet."
-            detailed_message = f"Hi {customer.name}, your account is suspended. Contact support for help."
-
-        db.commit()
-
-        # ✅ MikroTik only when status changes
-        if router and customer.status != old_status:
-            try:
-                if customer.status == "suspended":
-                    block_ip(customer.ip_address, router)
-                else:
-                    unblock_ip(customer.ip_address, router)
-            except Exception as e:
-                print(f"⚠️ MikroTik action failed: {e}")
-
-        # ✅ IMPORTANT CHANGE:
-        # If ACTIVE/GRACE and NO popup and NO active-card -> redirect to next_url (google)
-        if customer.status in ("active", "grace") and (not show_popup) and (not show_active_card):
-            # ✅ avoid loop if next_url mistakenly points back to wifi_access
-            if next_url and "wifi_access" not in next_url:
-                return redirect(next_url)
-            return "", 204
-
-        return render_template(
-            "customer/wifi_home.html",
-            customer=customer,
-            status=customer.status,
-            short_message=short_message,
-            detailed_message=detailed_message,
-            show_popup=show_popup,
-            popup_type=popup_type,
-            popup_message=popup_message,
-            show_active_card=show_active_card,
-            start_date=start_date,
-            subscription_end=subscription_end,
-            days_left=days_left,
-            next_url=next_url,
-            current_year=datetime.utcnow().year,
-        )
-
 @app.route("/suspended_customers")
 @login_required
 @roles_required("admin", "super_admin","staff")
@@ -1425,8 +1250,6 @@ def mark_paid(customer_id):
             flash("Customer not found.", "danger")
             return redirect(url_for("list_customers"))
 
-        router = customer.router
-
         # ===================== ✅ 1) RECORD PAYMENT =====================
         # Default amount = customer billing_amount (you can change later to manual entry)
         amount = float(customer.billing_amount or 0)
@@ -1476,21 +1299,38 @@ def mark_paid(customer_id):
         if hasattr(customer, "suspended_popup_last_shown"):
             customer.suspended_popup_last_shown = None
 
+        marker_buffer.discard(customer.id)  # ✅ unwritten popup markers belong to the old cycle
+
+        # ===================== ✅ 3) UNBLOCK ON MIKROTIK (queued) =====================
+        job = enqueue_enforcement(db, customer)
+        schedule_transition(customer)  # next look: day 31 of the new cycle
+
         db.commit()
+        invalidate_portal(customer.ip_address)  # ✅ active card for the new cycle
 
-        # ===================== ✅ 3) UNBLOCK ON MIKROTIK =====================
-        if router and customer.ip_address:
-            try:
-                unblock_ip(customer.ip_address, router)
-                flash(f"✅ Payment saved (KES {amount}). {customer.name} is active.", "success")
-            except Exception as e:
-                flash(f"✅ Payment saved, but MikroTik unblock failed: {e}", "warning")
+        if job:
+            flash(f"✅ Payment saved (KES {amount}). {customer.name} is active.", "success")
         else:
             flash(f"✅ Payment saved (KES {amount}). No router assigned.", "info")
 
     return redirect(url_for("list_customers"))
 
 # ==================== EXPORT TO EXCEL ====================
+# columns/joins shared by the customer exports (one flat row per customer)
+EXPORT_COLUMNS = (
+    Customer.account_no, Customer.name, Customer.phone, Customer.fat_id,
+    Customer.location, Customer.ip_address, Customer.billing_amount,
+    Customer.start_date, Customer.mikrotik_password, Customer.status,
+    Branch.name.label("branch_name"),
+    CustomerNetwork.cable_no, CustomerNetwork.loop_no, CustomerNetwork.power_level,
+    CustomerNetwork.final_coordinates, CustomerNetwork.coordinates,
+)
+EXPORT_JOINS = (
+    (Router, Customer.router_id == Router.id),
+    (Branch, Router.branch_id == Branch.id),
+    (CustomerNetwork, CustomerNetwork.customer_id == Customer.id),
+)
+
 @app.route("/customers/export", methods=["GET"])
 @login_required
 @roles_required("admin", "super_admin")
@@ -1499,20 +1339,18 @@ def export_customers():
     search_term = request.args.get("search", "").strip()
     db = SessionLocal()
     try:
-        query = db.query(Customer).options(
-            joinedload(Customer.router).joinedload(Router.branch),
-            joinedload(Customer.network)
-        )
+        criteria = []
         if search_term:
-            query = query.filter(
+            criteria.append(
                 (Customer.account_no.like(f"%{search_term}%")) |
                 (Customer.name.like(f"%{search_term}%")) |
                 (Customer.ip_address.like(f"%{search_term}%"))
             )
-        customers = query.all()
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Customers"
+
+        # ✅ write-only workbook + streamed tuple rows: memory stays flat
+        from openpyxl import Workbook  # heavy; only exports need it
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title="Customers")
 
         headers = [
             "Account No", "Name", "Phone", "FAT/ID", "Location", "IP Address", "Branch",
@@ -1521,14 +1359,14 @@ def export_customers():
         ]
         ws.append(headers)
 
-        for c in customers:
+        for c in iter_customers(db, EXPORT_COLUMNS, *criteria, joins=EXPORT_JOINS):
             ws.append([
                 c.account_no, c.name, c.phone, c.fat_id, c.location, c.ip_address,
-                c.router.branch.name if c.router and c.router.branch else "",
-                c.billing_amount, c.network.cable_no if c.network else "",
-                c.network.loop_no if c.network else "", c.network.power_level if c.network else "",
-                c.network.final_coordinates if c.network else "",
-                c.network.coordinates if c.network else "",
+                c.branch_name or "",
+                c.billing_amount, c.cable_no or "",
+                c.loop_no or "", c.power_level or "",
+                c.final_coordinates or "",
+                c.coordinates or "",
                 c.start_date.strftime("%Y-%m-%d %H:%M:%S") if c.start_date else "",
                 c.mikrotik_password or "", c.status
             ])
@@ -1559,20 +1397,9 @@ def export_customers_by_branch(branch_id):
             flash("Branch not found", "danger")
             return redirect(url_for("list_branches"))
 
-        customers = (
-            db.query(Customer)
-            .join(Customer.router)
-            .filter(Router.branch_id == branch_id)
-            .options(
-                joinedload(Customer.network),
-                joinedload(Customer.router).joinedload(Router.branch)
-            )
-            .all()
-        )
-
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"{branch.name} Customers"
+        from openpyxl import Workbook  # heavy; only exports need it
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=f"{branch.name} Customers")
 
         headers = [
             "Account No", "Name", "Phone", "Email", "Location",
@@ -1583,7 +1410,7 @@ def export_customers_by_branch(branch_id):
         ]
         ws.append(headers)
 
-        for c in customers:
+        for c in iter_customers(db, EXPORT_COLUMNS, Router.branch_id == branch_id, joins=EXPORT_JOINS):
             ws.append([
                 c.account_no,
                 c.name,
@@ -1593,11 +1420,11 @@ def export_customers_by_branch(branch_id):
                 c.ip_address,
                 branch.name,
                 c.billing_amount,
-                c.network.cable_no if c.network else "",
-                c.network.loop_no if c.network else "",
-                c.network.power_level if c.network else "",
-                c.network.final_coordinates if c.network else "",
-                c.network.coordinates if c.network else "",
+                c.cable_no or "",
+                c.loop_no or "",
+                c.power_level or "",
+                c.final_coordinates or "",
+                c.coordinates or "",
                 c.start_date.strftime("%Y-%m-%d %H:%M:%S") if c.start_date else "",
                 c.status
             ])
@@ -1622,23 +1449,21 @@ def toggle_suspend(customer_id):
         customer = db.query(Customer).filter_by(id=customer_id).first()
 
         if customer:
-            router = customer.router
             if customer.manually_suspended:
                 # Unsuspend manually
                 customer.manually_suspended = False
                 customer.status = "active"
-                if router:
-                    unblock_ip(customer.ip_address, router)  # ✅ Use helper
                 flash(f"{customer.name} has been unsuspended manually.", "success")
             else:
                 # Suspend manually
                 customer.manually_suspended = True
                 customer.status = "manually_suspended"
-                if router:
-                    block_ip(customer.ip_address, router)  # ✅ Use helper
                 flash(f"{customer.name} has been manually suspended.", "warning")
 
+            enqueue_enforcement(db, customer)  # ✅ applied by the router worker
+            schedule_transition(customer)
             db.commit()
+            invalidate_portal(customer.ip_address)
 
     return redirect(url_for('manual_suspension'))
 
@@ -1651,24 +1476,22 @@ def toggle_hold(customer_id):
         customer = db.query(Customer).filter_by(id=customer_id).first()
 
         if customer:
-            router = customer.router
             if customer.hold_status:
                 # Unhold (activate)
                 customer.hold_status = False
                 customer.status = "active"
                 customer.activated_on = datetime.utcnow()
-                if router:
-                    unblock_ip(customer.ip_address, router)
                 flash(f"{customer.name} has been unheld and activated.", "success")
             else:
                 # Put on hold
                 customer.hold_status = True
                 customer.status = "on_hold"
-                if router:
-                    block_ip(customer.ip_address, router)
                 flash(f"{customer.name} has been put on hold.", "warning")
 
+            enqueue_enforcement(db, customer)
+            schedule_transition(customer)
             db.commit()
+            invalidate_portal(customer.ip_address)
 
     return redirect(url_for('manual_suspension'))
 
@@ -1686,10 +1509,10 @@ def hold_customer(customer_id):
             customer.hold_status = True
             customer.hold_until = hold_until
             customer.status = "on_hold"
-            router = customer.router
-            if router:
-                block_ip(customer.ip_address, router)
+            enqueue_enforcement(db, customer)
+            schedule_transition(customer)  # auto-release at hold_until
             db.commit()
+            invalidate_portal(customer.ip_address)
             flash(f"{customer.name} has been put on hold until {hold_until.strftime('%Y-%m-%d')}.", "warning")
 
     return redirect(url_for('manual_hold'))
@@ -1708,10 +1531,10 @@ def unhold_customer(customer_id):
             if not customer.activated_on:
                 customer.activated_on = datetime.utcnow()
             customer.status = "active"
-            router = customer.router
-            if router:
-                unblock_ip(customer.ip_address, router)
+            enqueue_enforcement(db, customer)
+            schedule_transition(customer)
             db.commit()
+            invalidate_portal(customer.ip_address)
             flash(f"{customer.name} has been reactivated successfully.", "success")
 
     return redirect(url_for('manual_hold'))
@@ -1732,9 +1555,133 @@ def manual_manage_customers():
 def grace_customers():
     return redirect(url_for("list_customers", status="grace"))
 
-def daily_status_check(db=None):
-    """Check all customers and update WiFi status automatically (efficient)."""
-    today = datetime.utcnow().date()
+StatusChange = namedtuple("StatusChange", "id ip_address router_id old_status new_status")
+
+
+def _id_chunks(ids, size=1000):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def apply_status_transitions(db, today=None, only=None):
+    """
+    Apply the active / grace / suspended rules with set-based UPDATEs
+    (no ORM objects are loaded). Manual states are left alone.
+    `only` is an extra filter (e.g. due customers).
+    Candidates are found without locks; only the rows that change are then
+    locked by primary key, re-checked and updated in id chunks, so the daily
+    full pass never locks the whole customers table.
+    Returns the changed rows as StatusChange tuples; the caller commits.
+    """
+    today = today or datetime.utcnow().date()
+    new_status, in_active_window = status_case(today)
+    automatic = or_(Customer.status.is_(None), Customer.status.notin_(MANUAL_STATUSES))
+    if only is not None:
+        automatic = and_(automatic, only)
+    changing = and_(automatic, or_(Customer.status.is_(None), Customer.status != new_status))
+
+    candidate_ids = [row.id for row in db.query(Customer.id).filter(changing)]
+
+    changes = []
+    for ids in _id_chunks(candidate_ids):
+        # ✅ lock by id + re-check (a payment may have landed meanwhile)
+        locked = [
+            StatusChange(*row)
+            for row in db.query(
+                Customer.id, Customer.ip_address, Customer.router_id,
+                Customer.status, new_status,
+            )
+            .filter(Customer.id.in_(ids), changing)
+            .with_for_update()
+            .all()
+        ]
+        if locked:
+            db.query(Customer).filter(Customer.id.in_([change.id for change in locked])).update(
+                {Customer.status: new_status}, synchronize_session=False
+            )
+        changes += locked
+
+    # ✅ clear grace click when active again (by id as well)
+    clear_grace = and_(automatic, in_active_window, Customer.grace_pass_date.isnot(None))
+    grace_ids = [row.id for row in db.query(Customer.id).filter(clear_grace)]
+    for ids in _id_chunks(grace_ids):
+        db.query(Customer).filter(Customer.id.in_(ids), clear_grace).update(
+            {Customer.grace_pass_date: None}, synchronize_session=False
+        )
+
+    return changes
+
+
+def release_expired_holds(db, now=None, only=None):
+    """Timed holds past hold_until are released the same way as unhold_customer."""
+    now = now or datetime.utcnow()
+    expired = and_(Customer.status == "on_hold", Customer.hold_until <= now)
+    if only is not None:
+        expired = and_(expired, only)
+    rows = (
+        db.query(Customer.id, Customer.ip_address, Customer.router_id, Customer.status)
+        .filter(expired)
+        .with_for_update()
+        .all()
+    )
+    for ids in _id_chunks([row.id for row in rows]):
+        db.query(Customer).filter(Customer.id.in_(ids)).update({
+            Customer.status: "active",
+            Customer.hold_status: False,
+            Customer.hold_until: None,
+            Customer.activated_on: func.coalesce(Customer.activated_on, now),
+        }, synchronize_session=False)
+    return [StatusChange(*row, "active") for row in rows]
+
+
+def reschedule_transitions(db, criteria, now=None):
+    """
+    Recompute next_transition_at for the customers matching `criteria`.
+    Streams keyset chunks and commits each one (also commits pending work).
+    """
+    total = 0
+    for rows in iter_customer_chunks(
+        db,
+        (Customer.status, Customer.start_date, Customer.grace_pass_date, Customer.hold_until),
+        criteria,
+    ):
+        db.bulk_update_mappings(Customer, [
+            {"id": row.id, "next_transition_at": next_transition_for(*row[1:], now=now)}
+            for row in rows
+        ])
+        db.commit()
+        total += len(rows)
+    return total
+
+
+def _merge_changes(*groups):
+    """One StatusChange per customer (first old -> last new), real changes only."""
+    merged = {}
+    for group in groups:
+        for change in group:
+            first = merged.get(change.id)
+            merged[change.id] = change._replace(old_status=first.old_status) if first else change
+    return [change for change in merged.values() if change.old_status != change.new_status]
+
+
+def _enforce_changes(db, changes):
+    # single-process deployments run the scheduler here; web workers see it within the TTL
+    invalidate_portal(*(change.ip_address for change in changes))
+    results = enforce_transitions(db, changes)
+    for outcome in results.values():
+        if not outcome["ok"]:
+            print(f"⚠️ Scheduler MikroTik error for router {outcome['router']}: {outcome['error']}")
+    return results
+
+
+def process_due_transitions(db=None, now=None):
+    """
+    Minute job: only customers whose next_transition_at has passed
+    (indexed lookup). Releases expired holds, applies the status rules,
+    reschedules the rows, then pushes the changed IPs to the routers.
+    Returns {"changes": [StatusChange, ...], "routers": {router_id: {...}}}.
+    """
+    now = now or datetime.utcnow()
     close_session = False
 
     if db is None:
@@ -1742,50 +1689,63 @@ def daily_status_check(db=None):
         close_session = True
 
     try:
-        customers = db.query(Customer).options(joinedload(Customer.router)).all()
+        with recorded_run("process_due_transitions") as run:
+            due = Customer.next_transition_at <= now
+            run["rows_scanned"] = db.query(func.count(Customer.id)).filter(due).scalar() or 0
+            if not run["rows_scanned"]:
+                run["skip"] = True  # nothing due: no telemetry row every minute
+                return {"changes": [], "routers": {}}
+
+            released = release_expired_holds(db, now, only=due)
+            run["changes"] = _merge_changes(released, apply_status_transitions(db, now.date(), only=due))
+            db.commit()
+            reschedule_transitions(db, due, now)
 
-        for customer in customers:
-            router = customer.router
-            old_status = customer.status
+            run["routers"] = _enforce_changes(db, run["changes"])
+            return {"changes": run["changes"], "routers": run["routers"]}
 
-            # ✅ Do NOT override manual states
-            if old_status in ["manually_suspended", "on_hold"]:
-                continue
+    finally:
+        if close_session:
+            db.close()
 
-            start_date = customer.start_date.date() if customer.start_date else today
-            days_used = (today - start_date).days + 1
 
-            # ================= NEW STATUS LOGIC =================
-            if days_used <= 30:
-                new_status = "active"
+def daily_status_check(db=None):
+    """
+    Check all customers and update WiFi status automatically.
+    Daily safety net for process_due_transitions; also fills
+    next_transition_at for customers that have none yet.
+    Returns {"changes": [StatusChange, ...], "routers": {router_id: {...}}}.
+    """
+    now = datetime.utcnow()
+    close_session = False
+
+    if db is None:
+        db = SessionLocal()
+        close_session = True
 
-            elif 31 <= days_used <= 33:
-                # user must click grace every day
-                new_status = "grace" if customer.grace_pass_date == today else "suspended"
+    try:
+        with recorded_run("daily_status_check") as run:
+            run["rows_scanned"] = db.query(func.count(Customer.id)).scalar() or 0
 
-            else:
-                new_status = "suspended"
-
-            # ✅ Step 6B: clear grace click when active again
-            if new_status == "active":
-                customer.grace_pass_date = None
-
-            # ================= APPLY STATUS =================
-            customer.status = new_status
-
-            # ✅ MikroTik only if status changed
-            if router and customer.ip_address and new_status != old_status:
-                try:
-                    if new_status == "suspended":
-                        block_ip(customer.ip_address, router)
-                        print(f"🔒 Scheduler blocked {customer.ip_address} on {router.ip_address}")
-                    else:
-                        unblock_ip(customer.ip_address, router)
-                        print(f"✅ Scheduler unblocked {customer.ip_address} on {router.ip_address}")
-                except Exception as e:
-                    print(f"⚠️ Scheduler MikroTik error for {customer.ip_address}: {e}")
+            # ✅ stage 1: decide transitions in the database
+            changes = _merge_changes(release_expired_holds(db, now), apply_status_transitions(db, now.date()))
+            run["changes"] = changes
+            db.commit()
 
-        db.commit()
+            for ids in _id_chunks([change.id for change in changes]):
+                reschedule_transitions(db, Customer.id.in_(ids), now)
+            # customers created before next_transition_at existed (or missed by a route)
+            cycle_window = datetime(now.year, now.month, now.day) - timedelta(days=CYCLE_DAYS + GRACE_WINDOW_DAYS)
+            reschedule_transitions(db, and_(
+                Customer.next_transition_at.is_(None),
+                or_(Customer.start_date >= cycle_window, Customer.hold_until.isnot(None)),
+            ), now)
+
+            # ✅ stage 2: push only the changed IPs, one session per router, all routers in parallel
+            run["routers"] = _enforce_changes(db, changes)
+
+        prune_runs(db)
+        return {"changes": changes, "routers": run["routers"]}
 
     finally:
         if close_session:
@@ -1976,27 +1936,95 @@ def yearly_report():
     )
 
 # ==================== SCHEDULER SETUP ====================
-# # For testing: run every 5 minutes
-scheduler.add_job(
-    id="daily_status_check_test",
-    func=daily_status_check,
-    trigger="interval",
-    minutes=2,
-    replace_existing=True
- )
-
-# For production: uncomment this line to run once daily at midnight UTC
-# scheduler.add_job(
-#     id="daily_status_check_daily",
-#     func=daily_status_check,
-#     trigger="cron",
-#     hour=0,
-#     minute=0,
-#     replace_existing=True
-# )
+# ⚠️ Web workers do NOT start the scheduler. It runs in worker.py (or in
+# `python app.py` / run.py); if several are started, the scheduler_lease
+# row makes sure only one of them (the leader) actually runs the jobs.
+def start_scheduler():
+    """Register background jobs and start APScheduler in this process."""
+    # ✅ leader lease heartbeat (every process with a scheduler competes)
+    scheduler.add_job(
+        id="scheduler_lease_heartbeat",
+        func=lease.heartbeat,
+        trigger="interval",
+        seconds=HEARTBEAT_SECONDS,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+    # ✅ every minute: only customers whose next_transition_at is due
+    scheduler.add_job(
+        id="due_transitions",
+        func=leader_only(process_due_transitions),
+        trigger="interval",
+        minutes=1,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+    # ✅ once a day (00:05 UTC): full pass as a safety net + next_transition_at backfill
+    scheduler.add_job(
+        id="daily_status_check_daily",
+        func=leader_only(daily_status_check),
+        trigger="cron",
+        hour=0,
+        minute=5,
+        timezone="UTC",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+    # ✅ apply queued MikroTik changes (router_jobs outbox)
+    scheduler.add_job(
+        id="router_jobs_drain",
+        func=leader_only(drain_router_jobs),
+        trigger="interval",
+        seconds=5,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+    # ✅ hourly audit of router address lists vs the database
+    scheduler.add_job(
+        id="router_drift_scan",
+        func=leader_only(scan_drift),
+        kwargs={"auto_repair": app.config["DRIFT_AUTO_REPAIR"]},
+        trigger="interval",
+        hours=1,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+    # ✅ publish this process's circuit-breaker state for the routers page
+    scheduler.add_job(
+        id="router_health_publish",
+        func=publish_router_health,
+        trigger="interval",
+        seconds=PUBLISH_SECONDS,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+    # ✅ close RouterOS API sessions that have been idle too long (per process)
+    scheduler.add_job(
+        id="router_pool_evict",
+        func=router_pool.evict_stale,
+        trigger="interval",
+        minutes=1,
+        replace_existing=True
+    )
+
+    lease.heartbeat()  # claim leadership now instead of after the first interval
+    scheduler.start()
 
 
 # ==================== RUN APP ====================
 
 if __name__ == "__main__":
+    start_scheduler()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,181 @@
+"""
+Load test: sync portal (gunicorn, threads) vs async portal (uvicorn).
+
+    python bench_portal.py [--requests 5000] [--concurrency 200] [--workers 1]
+    python bench_portal.py --database-url mysql+pymysql://user:pw@host/wif_staging
+
+Without --database-url a throwaway SQLite database is created, migrated and
+seeded with --customers customers spread over the whole billing cycle.
+With one, the IPs of existing customers are used (nothing is seeded); point
+it at a staging copy, since probes do write status changes.
+
+Each server is started fresh (cold portal cache) with the same number of
+worker processes. Probes pick random customer IPs. Reports throughput and
+latency percentiles per server.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def seed_database(customers):
+    """Migrate + seed in this process (DATABASE_URL is already set)."""
+    import migrate
+    from connections import SessionLocal
+    from models import Branch, Customer, Router
+
+    migrate.migrate()
+    db = SessionLocal()
+    try:
+        branch = Branch(name="bench")
+        db.add(branch)
+        db.flush()
+        router = Router(ip_address="10.255.255.1", password="bench", branch_id=branch.id)
+        db.add(router)
+        db.flush()
+        now = datetime.utcnow()
+        db.bulk_insert_mappings(Customer, [
+            {
+                "name": f"bench {i}",
+                "account_no": f"BENCH{i}",
+                "ip_address": f"10.{100 + i // 65536}.{i // 256 % 256}.{i % 256}",
+                "router_id": router.id,
+                "status": "active",
+                "start_date": now - timedelta(days=i % 40),   # days 1..40 of the cycle
+            }
+            for i in range(customers)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def customer_ips(limit):
+    from connections import SessionLocal
+    from models import Customer
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Customer.ip_address).filter(Customer.ip_address.isnot(None)).limit(limit).all()
+        return [ip for (ip,) in rows]
+    finally:
+        db.close()
+
+
+SERVERS = {
+    "sync (gunicorn gthread)": lambda port, workers, threads: [
+        sys.executable, "-m", "gunicorn", "portal:create_portal_app()",
+        "-b", f"127.0.0.1:{port}", "-w", str(workers), "-k", "gthread", "--threads", str(threads),
+        "--log-level", "warning",
+    ],
+    "async (uvicorn)": lambda port, workers, threads: [
+        sys.executable, "-m", "uvicorn", "portal_async:app",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ],
+}
+
+
+async def _load(port, ips, requests, concurrency):
+    import httpx
+
+    latencies, errors = [], 0
+    queue = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        async def user():
+            nonlocal errors
+            for _ in queue:
+                ip = random.choice(ips)
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f"/wifi_access/{ip}", params={"next": "https://example.com"})
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+        "mean": statistics.mean(latencies) * 1000,
+        "errors": errors,
+    }
+
+
+def run_benchmark(requests=5000, concurrency=200, workers=1, threads=32, customers=2000, database_url=None):
+    tmpdir = None
+    if database_url is None:
+        tmpdir = tempfile.mkdtemp(prefix="wif_bench_")
+        database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite')}"
+        os.environ["DATABASE_URL"] = database_url
+        seed_database(customers)
+    else:
+        os.environ["DATABASE_URL"] = database_url
+
+    ips = customer_ips(customers)
+    if not ips:
+        raise SystemExit("no customers with an IP address in that database")
+
+    print(f"{requests} probes, concurrency {concurrency}, {workers} worker(s), {len(ips)} customer IPs")
+    print(f"{'server':<26} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    results = {}
+    for name, command in SERVERS.items():
+        port = _free_port()
+        server = subprocess.Popen(command(port, workers, threads), cwd=HERE, env=dict(os.environ))
+        try:
+            _wait_for_port(port, server)
+            result = results[name] = asyncio.run(_load(port, ips, requests, concurrency))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        print(f"{name:<26} {result['rps']:>8.0f} {result['p50']:>8.1f} {result['p95']:>8.1f} "
+              f"{result['p99']:>8.1f} {result['errors']:>7}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync vs async captive-portal load test")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1, help="processes per server")
+    parser.add_argument("--threads", type=int, default=32, help="threads per sync worker")
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    run_benchmark(args.requests, args.concurrency, args.workers, args.threads, args.customers, args.database_url)
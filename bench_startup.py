@@ -0,0 +1,73 @@
+"""
+Cold-start benchmark for the web entry points.
+
+    python bench_startup.py [--runs 5]
+
+Each target is imported in a fresh interpreter (like a new gunicorn worker);
+we report the median wall time to a ready Flask app and the worker's peak
+RSS. No database connection is made (the engine connects lazily).
+
+    portal        portal.create_portal_app()   captive-portal workers
+    admin         app.app                      admin workers (heavy libs lazy)
+    admin+eager   pandas + openpyxl, then app  what every worker used to load
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+TARGETS = {
+    "portal": "import portal; portal.create_portal_app()",
+    "admin": "import app",
+    "admin+eager": "import pandas, openpyxl; import app",
+}
+
+_CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec({code!r})
+seconds = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on Linux
+heavy = [name for name in ("pandas", "openpyxl", "numpy", "flask_apscheduler") if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_kb / 1024, "modules": len(sys.modules), "heavy": heavy}}))
+"""
+
+
+def measure(code, runs):
+    samples = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD.format(code=code)],
+            cwd=here, capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "seconds": statistics.median(s["seconds"] for s in samples),
+        "rss_mb": statistics.median(s["rss_mb"] for s in samples),
+        "modules": samples[-1]["modules"],
+        "heavy": samples[-1]["heavy"],
+    }
+
+
+def run_benchmark(runs=5):
+    print(f"{'target':<14} {'start (ms)':>10} {'RSS (MB)':>9} {'modules':>8}  heavy libs loaded")
+    results = {}
+    for name, code in TARGETS.items():
+        result = results[name] = measure(code, runs)
+        print(f"{name:<14} {result['seconds'] * 1000:>10.0f} {result['rss_mb']:>9.1f} "
+              f"{result['modules']:>8}  {', '.join(result['heavy']) or '-'}")
+
+    base, portal = results["admin+eager"], results["portal"]
+    print(f"\nportal vs old worker: {base['seconds'] / portal['seconds']:.1f}x faster start, "
+          f"{base['rss_mb'] - portal['rss_mb']:.0f} MB less RSS per worker")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start time / RSS of the Flask entry points")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(runs=args.runs)
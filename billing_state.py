@@ -0,0 +1,249 @@
+"""
+Subscription state rules, in one place.
+
+    day 1–30   active
+    day 31–33  grace window: "grace" on a day the customer clicked GRACE,
+               otherwise "suspended"
+    day 34+    suspended
+    manual states (manually_suspended, on_hold) always win
+
+Days are counted in UTC from start_date (day 1 = the start day; no start
+date = starts today). The same rules come in three shapes:
+
+- subscription_state(): one customer (portal and admin routes)
+- classify(): NumPy-vectorized over whole batches (reports)
+- status_case(): a SQL CASE for set-based UPDATEs (scheduler);
+  billing_outlook() counts the cycle phases in SQL for the dashboard
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, func, or_
+
+from models import Customer
+
+CYCLE_DAYS = 30             # days 1..30 active
+GRACE_WINDOW_DAYS = 3       # days 31..33 grace offer
+PRE_EXPIRY_FROM_DAY = 25    # days 25..30 pre-expiry popup
+
+MANUAL_STATUSES = ("manually_suspended", "on_hold")
+
+# phases of the billing cycle (independent of manual states / grace clicks)
+PHASE_ACTIVE = "active"
+PHASE_GRACE_WINDOW = "grace_window"
+PHASE_EXPIRED = "expired"
+
+# status codes returned by classify(): STATUS_CODES[code] -> status
+STATUS_CODES = ("active", "grace", "suspended", "manually_suspended", "on_hold")
+ACTIVE, GRACE, SUSPENDED, MANUALLY_SUSPENDED, ON_HOLD = range(len(STATUS_CODES))
+
+SubscriptionState = namedtuple(
+    "SubscriptionState",
+    "status phase days_used days_left start_date subscription_end pre_expiry",
+)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def subscription_state(start_date, grace_pass_date, today=None, status=None):
+    """
+    State of one customer on `today`. Pass the current `status` to keep
+    manual states; without it the result is what the rules alone give.
+    """
+    today = today or datetime.utcnow().date()
+    start_day = _as_date(start_date) or today
+    subscription_end = start_day + timedelta(days=CYCLE_DAYS)
+
+    days_used = (today - start_day).days + 1
+    days_left = max((subscription_end - today).days, 0)
+
+    if days_used <= CYCLE_DAYS:
+        phase, rule = PHASE_ACTIVE, "active"
+    elif days_used <= CYCLE_DAYS + GRACE_WINDOW_DAYS:
+        # user must click grace every day
+        phase = PHASE_GRACE_WINDOW
+        rule = "grace" if grace_pass_date == today else "suspended"
+    else:
+        phase, rule = PHASE_EXPIRED, "suspended"
+
+    return SubscriptionState(
+        status=status if status in MANUAL_STATUSES else rule,
+        phase=phase,
+        days_used=days_used,
+        days_left=days_left,
+        start_date=start_day,
+        subscription_end=subscription_end,
+        pre_expiry=PRE_EXPIRY_FROM_DAY <= days_used <= CYCLE_DAYS,
+    )
+
+
+def rule_status(start_date, grace_pass_date, today=None):
+    """Status the rules give on `today` (manual states not considered)."""
+    return subscription_state(start_date, grace_pass_date, today).status
+
+
+def next_transition_for(status, start_date, grace_pass_date, hold_until, now=None):
+    """
+    Next moment the scheduler must look at a customer:
+    day 31 and day 34 of the cycle, the end of today's grace pass, or
+    hold_until for a timed hold. None = nothing can change on its own.
+    """
+    now = now or datetime.utcnow()
+
+    if status == "on_hold":
+        return hold_until
+    if status in MANUAL_STATUSES:
+        return None
+
+    # status out of line with the rules (e.g. start_date edited) -> due now
+    if status != rule_status(start_date, grace_pass_date, now.date()):
+        return now
+
+    moments = []
+    if start_date:
+        cycle_start = datetime(start_date.year, start_date.month, start_date.day)
+        moments += [
+            cycle_start + timedelta(days=CYCLE_DAYS),
+            cycle_start + timedelta(days=CYCLE_DAYS + GRACE_WINDOW_DAYS),
+        ]
+    if grace_pass_date:
+        moments.append(datetime(grace_pass_date.year, grace_pass_date.month, grace_pass_date.day) + timedelta(days=1))
+
+    upcoming = [moment for moment in moments if moment > now]
+    return min(upcoming) if upcoming else None
+
+
+def schedule_transition(customer, now=None):
+    """Recompute customer.next_transition_at after changing its status or dates."""
+    customer.next_transition_at = next_transition_for(
+        customer.status, customer.start_date, customer.grace_pass_date, customer.hold_until, now
+    )
+    return customer.next_transition_at
+
+
+# ==================== VECTORIZED ====================
+_MISSING_DAY = -1
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def _day_numbers(values):
+    """
+    Day ordinals (int32) for dates/datetimes; None / NaT -> _MISSING_DAY.
+    toordinal() per value is ~20x faster than NumPy's datetime64 conversion
+    of Python objects.
+    """
+    import numpy as np
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+        days = values.astype("datetime64[D]")
+        numbers = days.astype(np.int64) + _EPOCH_ORDINAL
+        return np.where(np.isnat(days), _MISSING_DAY, numbers).astype(np.int32)
+    values = list(values)
+    return np.fromiter(
+        (value.toordinal() if value is not None else _MISSING_DAY for value in values),
+        dtype=np.int32, count=len(values),
+    )
+
+
+def classify(start_dates, grace_pass_dates, statuses=None, today=None):
+    """
+    subscription_state() for whole batches.
+    start_dates / grace_pass_dates: sequences of date/datetime/None or
+    datetime64 arrays (NaT = missing). statuses: optional current statuses;
+    manual states are kept, like subscription_state(status=...).
+    Returns (status_codes int8, days_used int32, days_left int32) arrays;
+    STATUS_CODES[code] gives the status name.
+    """
+    import numpy as np  # only batch callers pay for NumPy
+
+    today = (today or datetime.utcnow().date()).toordinal()
+    start = _day_numbers(start_dates)
+    start = np.where(start == _MISSING_DAY, today, start)
+    grace = _day_numbers(grace_pass_dates)
+
+    days_used = (today - start).astype(np.int32) + 1
+    days_left = np.maximum(CYCLE_DAYS + 1 - days_used, 0).astype(np.int32)
+
+    codes = np.full(days_used.shape, SUSPENDED, dtype=np.int8)
+    codes[days_used <= CYCLE_DAYS] = ACTIVE
+    in_window = (days_used > CYCLE_DAYS) & (days_used <= CYCLE_DAYS + GRACE_WINDOW_DAYS)
+    codes[in_window & (grace == today)] = GRACE
+
+    if statuses is not None:
+        statuses = np.asarray(list(statuses), dtype=object)
+        codes[statuses == "manually_suspended"] = MANUALLY_SUSPENDED
+        codes[statuses == "on_hold"] = ON_HOLD
+
+    return codes, days_used, days_left
+
+
+# ==================== SQL ====================
+def status_case(today):
+    """
+    The rules as SQL for set-based UPDATEs on the customers table.
+    Returns (new_status CASE expression, in_active_window condition).
+    """
+    day_start = datetime(today.year, today.month, today.day)
+    active_from = day_start - timedelta(days=CYCLE_DAYS - 1)                     # days_used <= 30
+    grace_from = day_start - timedelta(days=CYCLE_DAYS + GRACE_WINDOW_DAYS - 1)  # days_used 31..33
+
+    in_active_window = or_(Customer.start_date.is_(None), Customer.start_date >= active_from)
+    new_status = case(
+        (in_active_window, "active"),
+        (and_(Customer.start_date >= grace_from, Customer.grace_pass_date == today), "grace"),
+        else_="suspended",
+    )
+    return new_status, in_active_window
+
+
+def _cycle_day_start(day_start, day):
+    """Earliest start_date for which `day_start` is `day` (or less) of the cycle."""
+    return day_start - timedelta(days=day - 1)
+
+
+def billing_outlook(db, today=None, now=None, soon_days=5):
+    """
+    Dashboard counts from two aggregate queries instead of reading every
+    customer: one GROUP BY status pass with the cycle phases as start_date
+    range buckets, and a range count on the indexed next_transition_at for
+    customers the scheduler has not caught up with yet.
+    Returns {"by_status": {status: count}, "total", "expiring_soon",
+    "grace_window", "expired", "out_of_sync"}.
+    """
+    now = now or datetime.utcnow()
+    today = today or now.date()
+    day_start = datetime(today.year, today.month, today.day)
+
+    def started_by(day):        # days_used >= day
+        return Customer.start_date < _cycle_day_start(day_start, day - 1)
+
+    def started_within(day):    # days_used <= day (no start date = day 1)
+        return or_(Customer.start_date.is_(None), Customer.start_date >= _cycle_day_start(day_start, day))
+
+    automatic = or_(Customer.status.is_(None), Customer.status.notin_(MANUAL_STATUSES))
+
+    def bucket(*conditions):
+        return func.coalesce(func.sum(case((and_(automatic, *conditions), 1), else_=0)), 0)
+
+    rows = db.query(
+        Customer.status,
+        func.count(Customer.id),
+        bucket(started_within(CYCLE_DAYS), started_by(CYCLE_DAYS + 1 - soon_days)),
+        bucket(started_by(CYCLE_DAYS + 1), started_within(CYCLE_DAYS + GRACE_WINDOW_DAYS)),
+        bucket(started_by(CYCLE_DAYS + GRACE_WINDOW_DAYS + 1)),
+    ).group_by(Customer.status).all()
+
+    outlook = {"by_status": {}, "total": 0, "expiring_soon": 0, "grace_window": 0, "expired": 0}
+    for status, count, expiring_soon, grace_window, expired in rows:
+        outlook["by_status"][status] = count
+        outlook["total"] += count
+        outlook["expiring_soon"] += int(expiring_soon)
+        outlook["grace_window"] += int(grace_window)
+        outlook["expired"] += int(expired)
+
+    # status out of line with the rules -> next_transition_at is due (see next_transition_for)
+    outlook["out_of_sync"] = db.query(func.count(Customer.id)).filter(Customer.next_transition_at <= now).scalar()
+    return outlook
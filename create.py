@@ -1,8 +1,5 @@
-from connections import Base, engine
-from models import *
+from migrate import migrate
 
-# ⚠️ Drops all existing tables and recreates them
-Base.metadata.drop_all(bind=engine)
-Base.metadata.create_all(bind=engine)
-
-print("Tables recreated with latest columns")
\ No newline at end of file
+# ✅ Brings the schema up to date without dropping data
+# (versioned steps live in migrate.py)
+migrate()
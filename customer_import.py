@@ -0,0 +1,423 @@
+"""
+Streaming customer import from .xlsx or .csv uploads.
+
+The upload is spooled to a temp file on disk, then read row by row:
+openpyxl read_only mode for Excel, csv.reader for CSV. Rows are handled in
+chunks of IMPORT_CHUNK_SIZE with one commit per chunk, so memory stays flat
+however large the onboarding sheet is (pandas read_excel + iterrows loaded
+and copied the whole sheet).
+
+Branches and routers are loaded into dicts once (ImportLookups); each chunk
+then costs one INSERT for new branches, one for customers and one for their
+network rows, instead of 4+ round trips per row. UniquenessIndex catches
+duplicate Account Nos / IPs before the insert, and each chunk's insert runs
+under a savepoint, so bad rows are skipped and reported while good rows land.
+
+    with spooled_upload(request.files["excel_file"]) as (path, kind):
+        result = import_customers_file(db, path, kind)
+"""
+import contextlib
+import csv
+import math
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy.exc import IntegrityError
+
+from billing_state import next_transition_for
+from models import Branch, Customer, CustomerNetwork, Router
+
+IMPORT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 20    # flash messages live in the session cookie
+
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+CSV_EXTENSIONS = (".csv",)
+
+REQUIRED_COLUMNS = [
+    "account_no", "customer_name", "phone", "ip_address",
+    "billing_amount", "start_date", "branch_name", "router_ip"
+]
+
+
+class ImportFileError(ValueError):
+    """Upload cannot be imported at all (wrong type, missing columns)."""
+
+
+class ImportAborted(Exception):
+    """A chunk failed to commit; earlier chunks are already saved."""
+
+    def __init__(self, error, imported, row_no):
+        super().__init__(str(error))
+        self.error = error
+        self.imported = imported
+        self.row_no = row_no
+
+    def progress_note(self):
+        return (f" (stopped at the chunk starting on row {self.row_no}; "
+                f"{self.imported} earlier customers were saved)")
+
+
+# ==================== VALUE CONVERTERS ====================
+def to_str(val):
+    """Convert value to string or None if empty."""
+    if val is None or (isinstance(val, float) and math.isnan(val)) or str(val).strip() == "":
+        return None
+    if isinstance(val, float) and val.is_integer():
+        val = int(val)  # 1001.0 from a numeric cell -> "1001"
+    return str(val).strip()
+
+
+def to_float(val):
+    """Convert value to float or None if empty."""
+    if val is None or (isinstance(val, float) and math.isnan(val)) or str(val).strip() == "":
+        return None
+    try:
+        return float(val)
+    except ValueError:
+        return None
+
+
+def to_datetime(val, fmt="%Y-%m-%d"):
+    """Convert a string or Excel datetime to Python datetime or None if empty."""
+    if val is None:
+        return None
+    if isinstance(val, float) and math.isnan(val):
+        return None
+    val_str = str(val).strip()
+    if val_str == "":
+        return None
+    if isinstance(val, datetime):
+        return val
+    # Try to parse string to datetime
+    try:
+        return datetime.strptime(val_str, fmt)
+    except ValueError:
+        return None
+
+
+# ==================== READING ====================
+@contextlib.contextmanager
+def spooled_upload(file_storage):
+    """
+    Copy an uploaded file to a temp file on disk; yields (path, kind) with
+    kind "xlsx" or "csv". The temp file is removed afterwards.
+    """
+    extension = os.path.splitext(file_storage.filename or "")[1].lower()
+    if extension in EXCEL_EXTENSIONS:
+        kind = "xlsx"
+    elif extension in CSV_EXTENSIONS:
+        kind = "csv"
+    else:
+        raise ImportFileError("Upload a .xlsx or .csv file")
+
+    fd, path = tempfile.mkstemp(suffix=extension, prefix="wif_import_")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            shutil.copyfileobj(file_storage.stream, spool, length=1024 * 1024)
+        yield path, kind
+    finally:
+        os.remove(path)
+
+
+def _column_name(value):
+    return str(value or "").strip().lower().replace(" ", "_")
+
+
+def _raw_rows(path, kind):
+    if kind == "xlsx":
+        from openpyxl import load_workbook  # heavy; only imports need it
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.reader(f)
+
+
+def iter_import_rows(path, kind):
+    """
+    Yields (row_no, {column: value}) for every non-empty data row; row_no is
+    the sheet row number (header = row 1). Raises ImportFileError when
+    required columns are missing.
+    """
+    rows = _raw_rows(path, kind)
+    header = [_column_name(value) for value in next(rows, ())]
+
+    missing_cols = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing_cols:
+        rows.close()
+        raise ImportFileError(f"Missing columns: {', '.join(missing_cols)}")
+
+    for row_no, values in enumerate(rows, start=2):
+        if all(value is None or str(value).strip() == "" for value in values):
+            continue
+        yield row_no, dict(zip(header, values))
+
+
+def chunked(rows, size=IMPORT_CHUNK_SIZE):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ==================== IMPORT ====================
+NETWORK_COLUMNS = (
+    "cable_no", "cable_type", "splitter", "tube_no", "core_used",
+    "loop_no", "power_level", "final_coordinates", "coordinates",
+)
+
+
+class ImportLookups:
+    """
+    Branches and routers loaded once per import, so rows are resolved from
+    dicts instead of two queries each. Branch names match case-insensitively
+    (the old Branch.name.ilike lookup).
+    """
+
+    def __init__(self, db):
+        self.branches = {name.lower(): branch_id for branch_id, name in db.query(Branch.id, Branch.name)}
+        self.routers = {
+            ip: (router_id, branch_id)
+            for router_id, ip, branch_id in db.query(Router.id, Router.ip_address, Router.branch_id)
+        }
+
+    def ensure_branches(self, db, names):
+        """Create every branch in names that does not exist yet, in one INSERT."""
+        missing = {}
+        for name in names:
+            if name.lower() not in self.branches:
+                missing.setdefault(name.lower(), name)
+        if not missing:
+            return
+
+        db.execute(Branch.__table__.insert(), [{"name": name} for name in missing.values()])
+        created = db.query(Branch.id, Branch.name).filter(Branch.name.in_(list(missing.values())))
+        for branch_id, name in created:
+            self.branches[name.lower()] = branch_id
+        print(f"🏢 Import created {len(missing)} branch(es): {', '.join(missing.values())}")
+
+
+class UniquenessIndex:
+    """
+    Hash sets of account_no, (ip_address, router) and phone for every
+    existing customer, from one query, extended with each accepted row.
+    Duplicates inside the sheet or against the database are caught here,
+    before the insert, instead of failing the whole chunk with an
+    IntegrityError. Keys are lower-cased (MySQL compares them
+    case-insensitively).
+
+    Account No and IP-per-router are unique in the schema, so such rows are
+    skipped. Phone is not; a repeated phone is only reported.
+    """
+
+    def __init__(self, db):
+        self.account_nos, self.ips, self.phones = {}, {}, {}
+        for account_no, ip, router_id, phone in db.query(
+                Customer.account_no, Customer.ip_address, Customer.router_id, Customer.phone):
+            if account_no:
+                self.account_nos[account_no.lower()] = None
+            if ip and router_id:
+                self.ips[(ip.lower(), router_id)] = None
+            if phone:
+                self.phones[phone] = None
+
+    @staticmethod
+    def _where(row_no):
+        return f"row {row_no}" if row_no else "an existing customer"
+
+    def claim(self, row_no, customer, errors):
+        """Record the row's keys; False (with a reason in errors) if it must be skipped."""
+        account_no, phone = customer["account_no"], customer["phone"]
+        account_key = account_no.lower() if account_no else None
+        ip_key = (customer["ip_address"].lower(), customer["router_id"]) if customer["router_id"] else None
+
+        if account_key in self.account_nos:
+            errors.append(f"Row {row_no}: Account No '{account_no}' already used by "
+                          f"{self._where(self.account_nos[account_key])}, skipped")
+            return False
+        if ip_key in self.ips:
+            errors.append(f"Row {row_no}: IP '{customer['ip_address']}' already used on this router by "
+                          f"{self._where(self.ips[ip_key])}, skipped")
+            return False
+        if phone and phone in self.phones:
+            errors.append(f"Row {row_no}: Phone '{phone}' also used by "
+                          f"{self._where(self.phones[phone])} (imported anyway)")
+
+        if account_key:
+            self.account_nos[account_key] = row_no
+        if ip_key:
+            self.ips[ip_key] = row_no
+        if phone:
+            self.phones.setdefault(phone, row_no)
+        return True
+
+
+def _build_row(lookups, row_no, row, errors, now):
+    """Row -> (customer values, network values), or None when it is skipped."""
+    # ----------------- Branch -----------------
+    branch_name = to_str(row.get("branch_name"))
+    if not branch_name:
+        errors.append(f"Row {row_no}: Missing branch_name")
+        return None
+    branch_id = lookups.branches[branch_name.lower()]
+
+    # ----------------- Router (OPTIONAL) -----------------
+    router_ip = to_str(row.get("router_ip"))
+    router_id = None
+
+    if router_ip:
+        router = lookups.routers.get(router_ip)
+        if not router:
+            # Do NOT create router here
+            errors.append(
+                f"Row {row_no}: Router '{router_ip}' not found. Customer imported WITHOUT router (assign later)."
+            )
+        elif router[1] != branch_id:
+            # router exists but belongs to different branch: warn and ignore router
+            errors.append(
+                f"Row {row_no}: Router '{router_ip}' is not under branch '{branch_name}'. "
+                f"Customer imported WITHOUT router (fix router branch or Excel)."
+            )
+        else:
+            router_id = router[0]
+
+    # ----------------- Customer IP (recommended required) -----------------
+    customer_ip = to_str(row.get("ip_address"))
+    if not customer_ip:
+        errors.append(f"Row {row_no}: Missing customer ip_address")
+        return None
+
+    # If router is missing, mark as pending_router
+    status = "active" if router_id else "pending_router"
+    start_date = to_datetime(row.get("start_date"))
+    customer = {
+        "account_no": to_str(row.get("account_no")),
+        "name": to_str(row.get("customer_name")),
+        "phone": to_str(row.get("phone")),
+        "fat_id": to_str(row.get("fat_id")),
+        "ip_address": customer_ip,
+        "location": to_str(row.get("location")),
+        "billing_amount": to_float(row.get("billing_amount")),
+        "start_date": start_date,
+        "contract_date": to_datetime(row.get("contract_date")),
+        "status": status,
+        "router_id": router_id,
+        "next_transition_at": next_transition_for(status, start_date, None, None, now),
+    }
+    network = {column: to_str(row.get(column)) for column in NETWORK_COLUMNS}
+    return customer, network
+
+
+def _insert_customers(db, customers):
+    """
+    Bulk INSERT customers; returns their new ids in the same order.
+    With executemany RETURNING (SQLite, PostgreSQL, MariaDB) that is one
+    batched statement. MySQL has no RETURNING, so ids are read back by the
+    unique account_no; the few rows without one are inserted singly.
+    """
+    table = Customer.__table__
+    if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        stmt = table.insert().returning(table.c.id, sort_by_parameter_order=True)
+        return list(db.execute(stmt, customers).scalars())
+
+    keyed = [customer for customer in customers if customer["account_no"]]
+    ids_by_account = {}
+    if keyed:
+        db.execute(table.insert(), keyed)
+        ids_by_account = dict(
+            db.query(Customer.account_no, Customer.id)
+            .filter(Customer.account_no.in_([customer["account_no"] for customer in keyed]))
+        )
+
+    ids = []
+    for customer in customers:
+        if customer["account_no"]:
+            ids.append(ids_by_account[customer["account_no"]])
+        else:
+            ids.append(db.execute(table.insert(), customer).inserted_primary_key[0])
+    return ids
+
+
+def _insert_rows(db, built):
+    customer_ids = _insert_customers(db, [customer for _, customer, _ in built])
+    networks = [dict(network, customer_id=customer_id) for (_, _, network), customer_id in zip(built, customer_ids)]
+    db.execute(CustomerNetwork.__table__.insert(), networks)
+
+
+def _import_chunk(db, lookups, uniques, chunk, errors):
+    """
+    Validate and insert one chunk: one branch batch, then customers and
+    networks in bulk under a savepoint. If the database still rejects the
+    batch (e.g. a customer added meanwhile), the savepoint is rolled back and
+    the chunk is retried row by row, skipping only the rows it rejects.
+    """
+    now = datetime.utcnow()
+    # first spelling in the sheet wins, as with the old row-by-row import
+    lookups.ensure_branches(db, [name for name in (to_str(row.get("branch_name")) for _, row in chunk) if name])
+
+    built = []
+    for row_no, row in chunk:
+        pair = _build_row(lookups, row_no, row, errors, now)
+        if pair and uniques.claim(row_no, pair[0], errors):
+            built.append((row_no,) + pair)
+    if not built:
+        return 0
+
+    try:
+        with db.begin_nested():
+            _insert_rows(db, built)
+        return len(built)
+    except IntegrityError:
+        pass
+
+    imported = 0
+    for row in built:
+        try:
+            with db.begin_nested():
+                _insert_rows(db, [row])
+            imported += 1
+        except IntegrityError:
+            errors.append(f"Row {row[0]}: skipped, rejected by the database "
+                          f"(duplicate Account No or IP on the same router)")
+    return imported
+
+
+def import_customers_file(db, path, kind, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Import every row of a spooled upload, committing once per chunk.
+    Returns {"imported", "skipped", "chunks", "errors"}. Invalid and duplicate
+    rows are skipped and listed in errors; the rest still land. Any other
+    database error rolls back the current chunk and raises ImportAborted;
+    earlier chunks stay committed.
+    """
+    result = {"imported": 0, "skipped": 0, "chunks": 0, "errors": []}
+    lookups = ImportLookups(db)
+    uniques = UniquenessIndex(db)
+
+    for chunk in chunked(iter_import_rows(path, kind), chunk_size):
+        try:
+            imported = _import_chunk(db, lookups, uniques, chunk, result["errors"])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise ImportAborted(e, result["imported"], chunk[0][0]) from e
+        result["chunks"] += 1
+        result["imported"] += imported
+        result["skipped"] += len(chunk) - imported
+
+    return result
+
+
+def summarize_errors(errors, limit=MAX_REPORTED_ERRORS):
+    shown = " | ".join(errors[:limit])
+    if len(errors) > limit:
+        shown += f" | … and {len(errors) - limit} more"
+    return shown
@@ -0,0 +1,45 @@
+"""
+Streaming reads over the customers table for bulk jobs
+(status scheduling, exports, router drift / reconcile).
+
+Rows come back in keyset chunks (WHERE id > last_id ORDER BY id LIMIT n)
+as SQLAlchemy Row tuples holding only the requested columns, so no ORM
+objects or identity map build up. Every chunk is its own short query:
+callers may commit between chunks and memory stays flat.
+"""
+from models import Customer
+
+CHUNK_SIZE = 2000
+
+
+def iter_customer_chunks(db, columns, *criteria, joins=(), chunk_size=CHUNK_SIZE):
+    """
+    Yield lists of rows (Customer.id first, then `columns`) in id order.
+    `joins` are (target, onclause) pairs added as LEFT OUTER JOINs.
+    """
+    last_id = 0
+    while True:
+        query = db.query(Customer.id, *columns)
+        for target, onclause in joins:
+            query = query.outerjoin(target, onclause)
+
+        rows = (
+            query.filter(Customer.id > last_id, *criteria)
+            .order_by(Customer.id.asc())
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+
+        yield rows
+
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_customers(db, columns, *criteria, joins=(), chunk_size=CHUNK_SIZE):
+    """Row-by-row view of iter_customer_chunks."""
+    for rows in iter_customer_chunks(db, columns, *criteria, joins=joins, chunk_size=chunk_size):
+        yield from rows
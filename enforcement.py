@@ -0,0 +1,465 @@
+"""
+Database -> MikroTik enforcement.
+mikrotik_helper talks to the routers; this module works out what each
+router should be enforcing from the Customer table.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from connections import SessionLocal
+from customer_stream import iter_customers
+from models import Customer, Router, RouterJob, RouterDrift
+from mikrotik_helper import (
+    sync_blocked_list, apply_address_list_changes, read_blocked_list, router_is_down, pool,
+)
+
+# Customer states with no internet access
+BLOCKED_STATUSES = ("suspended", "manually_suspended", "on_hold")
+
+# States kept in the router's blocked_users list. Grace customers stay listed:
+# their access comes from a grace_allowed entry that expires on the router at
+# the end of the day, so nothing has to re-block them afterwards.
+LISTED_STATUSES = BLOCKED_STATUSES + ("grace",)
+
+MAX_ROUTER_WORKERS = 16      # routers handled at the same time
+ROUTER_RUN_DEADLINE = 90     # seconds for a whole fan-out run
+
+# Outbox retry policy
+OUTBOX_BATCH_SIZE = 1000
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 5        # seconds, doubled on every failed attempt
+OUTBOX_BACKOFF_MAX = 600
+
+# Plain copy of a Router row, safe to hand to worker threads
+RouterTarget = namedtuple("RouterTarget", "id ip_address username password port")
+
+
+def router_target(router):
+    return RouterTarget(
+        router.id,
+        router.ip_address,
+        router.username,
+        router.password,
+        router.port or 8728,
+    )
+
+
+def desired_router_state(db, router_id, today=None):
+    """
+    (listed_ips, grace_ips) for one router:
+    listed_ips -> must be in blocked_users
+    grace_ips  -> also need today's grace_allowed entry
+    """
+    today = today or datetime.utcnow().date()
+    rows = iter_customers(
+        db,
+        (Customer.ip_address, Customer.status, Customer.grace_pass_date),
+        Customer.router_id == router_id,
+        Customer.status.in_(LISTED_STATUSES),
+        Customer.ip_address.isnot(None),
+    )
+    listed, grace = set(), set()
+    for _, ip_address, status, grace_pass_date in rows:
+        ip_address = (ip_address or "").strip()
+        if not ip_address:
+            continue
+        listed.add(ip_address)
+        if status == "grace" and grace_pass_date == today:
+            grace.add(ip_address)
+    return listed, grace
+
+
+def _sync_router(target, payload):
+    listed_ips, grace_ips = payload
+    return sync_blocked_list(target, listed_ips, grace_ips)
+
+
+def reconcile_router(db, router):
+    """
+    Bring one router's blocked_users / grace_allowed lists in line with the database.
+    Returns the sync result ({"added", "removed", ...}) or None if unreachable.
+    """
+    result = _sync_router(router, desired_router_state(db, router.id))
+    if result is None:
+        print(f"⚠️ Resync skipped, router {router.ip_address} unreachable")
+    return result
+
+
+# ==================== FAN-OUT ACROSS ROUTERS ====================
+def _timed_call(func, target, payload):
+    started = time.monotonic()
+    try:
+        result = func(target, payload)
+        error = None if result is not None else "unreachable"
+    except Exception as e:
+        result, error = None, str(e)
+    return {
+        "router": target.ip_address,
+        "ok": error is None,
+        "result": result,
+        "error": error,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def fan_out(work, func, deadline=ROUTER_RUN_DEADLINE, max_workers=MAX_ROUTER_WORKERS):
+    """
+    Run func(target, payload) for every (RouterTarget, payload) in `work`,
+    one worker per router, all bounded by one overall deadline.
+    Returns {router_id: {"router", "ok", "result", "error", "seconds"}}.
+    Routers with an open circuit are skipped without a connection attempt
+    ("skipped": True); routers still running at the deadline are reported
+    as timed out.
+    """
+    results = {}
+    live = []
+    for target, payload in work:
+        if router_is_down(target.id):
+            results[target.id] = {
+                "router": target.ip_address,
+                "ok": False,
+                "skipped": True,
+                "result": None,
+                "error": "circuit open",
+                "seconds": 0,
+            }
+        else:
+            live.append((target, payload))
+    work = live
+
+    if not work:
+        return results
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(max_workers, len(work)),
+        thread_name_prefix="router"
+    )
+    futures = {
+        executor.submit(_timed_call, func, target, payload): target
+        for target, payload in work
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    # don't wait for stragglers; their sockets time out on their own
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        results[futures[future].id] = future.result()
+    for future in not_done:
+        target = futures[future]
+        results[target.id] = {
+            "router": target.ip_address,
+            "ok": False,
+            "result": None,
+            "error": f"deadline of {deadline}s exceeded",
+            "seconds": deadline,
+        }
+    return results
+
+
+def reconcile_routers(db, routers, deadline=ROUTER_RUN_DEADLINE):
+    """
+    Reconcile many routers concurrently.
+    Desired sets are read here (one query per router) so workers only do router I/O.
+    """
+    work = [
+        (router_target(router), desired_router_state(db, router.id))
+        for router in routers
+    ]
+    return fan_out(work, _sync_router, deadline=deadline)
+
+
+# ==================== ROUTER JOB OUTBOX ====================
+def desired_action(status):
+    if status == "grace":
+        return "grace"
+    return "block" if status in BLOCKED_STATUSES else "unblock"
+
+
+def enqueue_router_job(db, router_id, ip_address, action):
+    """Add an outbox row; it is committed together with the caller's changes."""
+    ip_address = (ip_address or "").strip()
+    if not router_id or not ip_address:
+        return None
+    job = RouterJob(router_id=router_id, ip_address=ip_address, action=action)
+    db.add(job)
+    return job
+
+
+def enqueue_enforcement(db, customer):
+    """Queue the router change matching the customer's current status."""
+    return enqueue_router_job(
+        db, customer.router_id, customer.ip_address, desired_action(customer.status)
+    )
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX))
+
+
+def _apply_router_jobs(target, payload):
+    block_ips, unblock_ips, grace_ips = payload
+    return apply_address_list_changes(target, block_ips, unblock_ips, grace_ips)
+
+
+def enforce_transitions(db, changes, deadline=ROUTER_RUN_DEADLINE):
+    """
+    Push status changes ((id, ip_address, router_id, old_status, new_status)
+    rows) to their routers: one session per router, all routers in parallel.
+    """
+    by_router = {}
+    for change in changes:
+        ip_address = (change.ip_address or "").strip()
+        if not change.router_id or not ip_address:
+            continue
+        block_ips, unblock_ips, grace_ips = by_router.setdefault(change.router_id, (set(), set(), set()))
+        action = desired_action(change.new_status)
+        {"block": block_ips, "unblock": unblock_ips, "grace": grace_ips}[action].add(ip_address)
+
+    if not by_router:
+        return {}
+
+    routers = db.query(Router).filter(Router.id.in_(by_router.keys())).all()
+    work = [(router_target(router), by_router[router.id]) for router in routers]
+    return fan_out(work, _apply_router_jobs, deadline=deadline)
+
+
+def drain_router_jobs(db=None, deadline=ROUTER_RUN_DEADLINE):
+    """
+    Apply pending router jobs.
+    - only the newest job per (router, ip) is applied; older ones are superseded
+    - each router gets one session, all routers in parallel
+    - failures (whole router or a single IP's command) are retried with
+      exponential backoff, then marked failed
+    Returns per-router results.
+    """
+    close_session = False
+    if db is None:
+        db = SessionLocal()
+        close_session = True
+
+    try:
+        now = datetime.utcnow()
+        pending = (
+            db.query(RouterJob)
+            .filter(RouterJob.status == "pending")
+            .order_by(RouterJob.id.asc())
+            .limit(OUTBOX_BATCH_SIZE)
+            .all()
+        )
+
+        # ✅ collapse to the latest desired state per IP
+        latest = {}
+        for job in pending:
+            key = (job.router_id, job.ip_address)
+            older = latest.get(key)
+            if older is not None:
+                older.status = "superseded"
+                older.finished_at = now
+            latest[key] = job
+
+        due = {}
+        for job in latest.values():
+            if job.next_attempt_at <= now:
+                due.setdefault(job.router_id, []).append(job)
+
+        if not due:
+            db.commit()
+            return {}
+
+        routers = db.query(Router).filter(Router.id.in_(due.keys())).all()
+        work = []
+        for router in routers:
+            jobs = due[router.id]
+            block_ips = {j.ip_address for j in jobs if j.action == "block"}
+            unblock_ips = {j.ip_address for j in jobs if j.action == "unblock"}
+            grace_ips = {j.ip_address for j in jobs if j.action == "grace"}
+            work.append((router_target(router), (block_ips, unblock_ips, grace_ips)))
+
+        results = fan_out(work, _apply_router_jobs, deadline=deadline)
+
+        finished_at = datetime.utcnow()
+        for router_id, jobs in due.items():
+            outcome = results.get(router_id) or {"ok": False, "error": "router not found"}
+            item_errors = (outcome.get("result") or {}).get("errors") or {}
+            for job in jobs:
+                if outcome.get("skipped"):
+                    # router known to be down: wait for the circuit, keep the attempt budget
+                    job.next_attempt_at = finished_at + timedelta(
+                        seconds=max(pool.breaker.retry_in(router_id), OUTBOX_BACKOFF_BASE)
+                    )
+                    continue
+                job.attempts = (job.attempts or 0) + 1
+                # the router session can succeed while this one IP's command trapped
+                if not outcome["ok"]:
+                    error = outcome["error"] or "router call failed"
+                else:
+                    error = item_errors.get(job.ip_address)
+                if error is None:
+                    job.status = "done"
+                    job.last_error = None
+                    job.finished_at = finished_at
+                elif job.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    job.status = "failed"
+                    job.last_error = (error or "")[:255]
+                    job.finished_at = finished_at
+                else:
+                    job.last_error = (error or "")[:255]
+                    job.next_attempt_at = finished_at + _backoff(job.attempts)
+
+        db.commit()
+
+        for outcome in results.values():
+            if not outcome["ok"]:
+                print(f"⚠️ Router job error on {outcome['router']}: {outcome['error']}")
+        return results
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if close_session:
+            db.close()
+
+
+def outbox_stats(db):
+    """Queue depth and age of the oldest pending job (seconds)."""
+    pending, oldest = (
+        db.query(func.count(RouterJob.id), func.min(RouterJob.created_at))
+        .filter(RouterJob.status == "pending")
+        .one()
+    )
+    failed = db.query(func.count(RouterJob.id)).filter(RouterJob.status == "failed").scalar()
+    return {
+        "pending": int(pending or 0),
+        "failed": int(failed or 0),
+        "oldest_pending_age": (
+            int((datetime.utcnow() - oldest).total_seconds()) if oldest else None
+        ),
+    }
+
+
+# ==================== DRIFT DETECTION ====================
+def _read_list(target, payload):
+    return read_blocked_list(target)
+
+
+def _customers_by_router(db, router_ids):
+    """{router_id: {ip: (customer_id, status)}}, streamed in keyset chunks."""
+    index = {router_id: {} for router_id in router_ids}
+    rows = iter_customers(
+        db,
+        (Customer.router_id, Customer.ip_address, Customer.status),
+        Customer.router_id.in_(router_ids),
+        Customer.ip_address.isnot(None),
+    )
+    for customer_id, router_id, ip_address, status in rows:
+        ip_address = ip_address.strip()
+        if ip_address:
+            index[router_id][ip_address] = (customer_id, status)
+    return index
+
+
+def compare_blocked_list(on_router, customers):
+    """
+    Compare one router's blocked addresses with its customers.
+    Returns [(kind, ip_address, customer_id)] with kind missing / extra / unknown.
+    """
+    mismatches = []
+    for ip_address, (customer_id, status) in customers.items():
+        should_block = status in LISTED_STATUSES
+        if should_block and ip_address not in on_router:
+            mismatches.append(("missing", ip_address, customer_id))
+        elif not should_block and ip_address in on_router:
+            mismatches.append(("extra", ip_address, customer_id))
+    for ip_address in on_router - customers.keys():
+        mismatches.append(("unknown", ip_address, None))
+    return sorted(mismatches, key=lambda m: (m[0], m[1]))
+
+
+def scan_drift(db=None, auto_repair=False, repair_unknown=False, deadline=ROUTER_RUN_DEADLINE):
+    """
+    Audit every router's blocked_users list against the database.
+    Lists are read concurrently (one print per router) and compared in memory.
+    Mismatches replace the router's previous rows in router_drift.
+    With auto_repair, missing IPs are blocked (or re-listed with their grace
+    pass, for grace customers holding today's) and extra IPs unblocked
+    (unknown IPs only with repair_unknown).
+    Returns {router_id: {"router", "ok", "error", "missing", "extra", "unknown", "repaired"}}.
+    """
+    close_session = False
+    if db is None:
+        db = SessionLocal()
+        close_session = True
+
+    try:
+        routers = db.query(Router).all()
+        targets = {router.id: router_target(router) for router in routers}
+
+        reads = fan_out([(t, None) for t in targets.values()], _read_list, deadline=deadline)
+        customers = _customers_by_router(db, list(targets))
+
+        now = datetime.utcnow()
+        summary = {}
+        repairs = []
+        for router_id, outcome in reads.items():
+            summary[router_id] = {
+                "router": outcome["router"], "ok": outcome["ok"], "error": outcome["error"],
+                "missing": 0, "extra": 0, "unknown": 0, "repaired": False,
+            }
+            if not outcome["ok"]:
+                continue
+
+            mismatches = compare_blocked_list(outcome["result"], customers[router_id])
+            db.query(RouterDrift).filter(RouterDrift.router_id == router_id).delete(synchronize_session=False)
+            for kind, ip_address, customer_id in mismatches:
+                summary[router_id][kind] += 1
+                db.add(RouterDrift(
+                    router_id=router_id, customer_id=customer_id,
+                    ip_address=ip_address, kind=kind, detected_at=now,
+                ))
+
+            missing_ips = {ip for kind, ip, _ in mismatches if kind == "missing"}
+            unblock_ips = {
+                ip for kind, ip, _ in mismatches
+                if kind == "extra" or (repair_unknown and kind == "unknown")
+            }
+            if auto_repair and (missing_ips or unblock_ips):
+                # ✅ customers holding today's grace pass are re-listed with their
+                # grace_allowed entry kept, not blocked outright
+                _, grace_ips = desired_router_state(db, router_id) if missing_ips else (set(), set())
+                grace_ips &= missing_ips
+                repairs.append((targets[router_id], (missing_ips - grace_ips, unblock_ips, grace_ips)))
+
+        db.commit()
+
+        if repairs:
+            repaired = fan_out(repairs, _apply_router_jobs, deadline=deadline)
+            for router_id, outcome in repaired.items():
+                summary[router_id]["repaired"] = outcome["ok"]
+                if outcome["ok"]:
+                    fixed = set(outcome["result"]["added"]) | set(outcome["result"]["removed"])
+                    if fixed:
+                        db.query(RouterDrift).filter(
+                            RouterDrift.router_id == router_id,
+                            RouterDrift.ip_address.in_(fixed),
+                        ).update({RouterDrift.repaired: True}, synchronize_session=False)
+            db.commit()
+
+        for item in summary.values():
+            if item["ok"] and (item["missing"] or item["extra"] or item["unknown"]):
+                print(
+                    f"🧭 Drift on {item['router']}: {item['missing']} missing, "
+                    f"{item['extra']} extra, {item['unknown']} unknown"
+                )
+        return summary
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if close_session:
+            db.close()
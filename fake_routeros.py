@@ -0,0 +1,455 @@
+"""
+Local stand-in for a MikroTik RouterOS API service.
+
+Speaks enough of the RouterOS API protocol for librouteros to log in and run:
+  /ip/firewall/address-list  print / add / remove / set (with ?queries, timeout=)
+  /ip/hotspot/active         print / remove
+  /ip/dhcp-server/lease      print / remove
+  /interface                 print
+  /system/identity           print
+
+Knobs for tests and benchmarks:
+  latency          seconds added before each reply (float, or {cmd: seconds, "default": s})
+  fail_commands    {cmd: "trap message"} -> that command always returns !trap
+  fail_rate        0..1 chance that any command returns !trap
+  max_connections  extra connections get !fatal and are closed
+  disabled         set of services to pretend are missing ("hotspot", "dhcp")
+
+Replies are delayed without blocking the next command on the same
+connection, so tagged (pipelined) commands overlap like they do over a WAN.
+
+Usage:
+    with FakeRouterOS(latency=0.05) as fake:
+        router = fake.router()
+        block_ip("10.0.0.5", router)
+
+Benchmark (both MikroTik helpers):
+    python fake_routeros.py --ips 500 --latency 0.02
+"""
+import argparse
+import contextlib
+import heapq
+import importlib.util
+import io
+import os
+import random
+import socketserver
+import threading
+import time
+from types import SimpleNamespace
+
+from librouteros.protocol import Encoder, Decoder
+
+TABLES = {
+    "/ip/firewall/address-list": None,
+    "/ip/hotspot/active": "hotspot",
+    "/ip/dhcp-server/lease": "dhcp",
+    "/interface": None,
+    "/system/identity": None,
+}
+
+
+class _Wire(Encoder, Decoder):
+    encoding = "ASCII"
+
+
+_wire = _Wire()
+
+
+def _read_exact(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError("client closed")
+        data += chunk
+    return bytes(data)
+
+
+def _read_sentence(sock):
+    words = []
+    while True:
+        first = _read_exact(sock, 1)
+        if first == b"\x00":
+            return words
+        extra = _wire.determineLength(first)
+        length = _wire.decodeLength(first + _read_exact(sock, extra))
+        words.append(_read_exact(sock, length).decode("ascii", errors="ignore"))
+
+
+def _parse_duration(value):
+    """RouterOS time: '1h2m3s', '1d', '00:10:00' or plain seconds."""
+    if ":" in value:
+        seconds = 0
+        for part in value.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    total, number = 0, ""
+    units = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+    for char in value:
+        if char.isdigit():
+            number += char
+        elif char in units and number:
+            total += int(number) * units[char]
+            number = ""
+    return total + (int(number) if number else 0)
+
+
+_BOOLEANS = {"yes": "true", "no": "false"}
+
+
+def _same_value(current, value):
+    """RouterOS prints booleans as true/false but accepts yes/no in queries."""
+    return _BOOLEANS.get(str(current), str(current)) == _BOOLEANS.get(value, value)
+
+
+def _match_query(row, query_words):
+    """Evaluate RouterOS ?query words (stack based, implicit AND at the end)."""
+    stack = []
+    for word in query_words:
+        body = word[1:]
+        if body == "#!":
+            stack.append(not stack.pop())
+        elif body in ("#&", "#|"):
+            right, left = stack.pop(), stack.pop()
+            stack.append(left and right if body == "#&" else left or right)
+        elif body.startswith("="):  # ?=key=value
+            key, _, value = body[1:].partition("=")
+            stack.append(_same_value(row.get(key, ""), value))
+        elif body.startswith(("<", ">")):
+            key, _, value = body[1:].partition("=")
+            try:
+                current, value = float(row.get(key, "")), float(value)
+            except ValueError:
+                stack.append(False)
+                continue
+            stack.append(current < value if body[0] == "<" else current > value)
+        elif "=" in body:  # ?key=value
+            key, _, value = body.partition("=")
+            stack.append(_same_value(row.get(key, ""), value))
+        else:  # ?key -> has property
+            stack.append(body in row)
+    return all(stack)
+
+
+class FakeRouterOS:
+    def __init__(self, username="admin", password="admin", host="127.0.0.1", port=0,
+                 latency=0.0, fail_commands=None, fail_rate=0.0,
+                 max_connections=None, disabled=(), interfaces=("ether1", "ether2", "bridge")):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.fail_commands = dict(fail_commands or {})
+        self.fail_rate = fail_rate
+        self.max_connections = max_connections
+        self.disabled = set(disabled)
+
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._expires = {}  # .id -> monotonic time for entries added with timeout=
+        self.tables = {path: [] for path in TABLES}
+        self.tables["/system/identity"] = [{"name": "FakeRouterOS"}]
+        for name in interfaces:
+            self._insert("/interface", {"name": name, "type": "ether", "running": "true"})
+
+        self.stats = {"connections": 0, "active_connections": 0, "rejected_connections": 0, "commands": {}}
+
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                fake._serve(self.request)
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    # ==================== LIFECYCLE ====================
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def router(self, id=1):
+        """Router-like object accepted by mikrotik_helper."""
+        return SimpleNamespace(
+            id=id, ip_address=self.host, port=self.port,
+            username=self.username, password=self.password,
+        )
+
+    # ==================== DATA HELPERS ====================
+    def _insert(self, path, row):
+        with self._lock:
+            row = {k: str(v) for k, v in row.items()}
+            row[".id"] = f"*{self._next_id:X}"
+            self._next_id += 1
+            if row.get("timeout"):
+                row["dynamic"] = "true"
+                self._expires[row[".id"]] = time.monotonic() + _parse_duration(row["timeout"])
+            self.tables[path].append(row)
+            return row[".id"]
+
+    def _purge_expired(self):
+        """Drop timed-out entries (call with the lock held)."""
+        if not self._expires:
+            return
+        now = time.monotonic()
+        gone = {entry_id for entry_id, due in self._expires.items() if due <= now}
+        if gone:
+            for entry_id in gone:
+                del self._expires[entry_id]
+            for path, rows in self.tables.items():
+                self.tables[path] = [row for row in rows if row.get(".id") not in gone]
+
+    def add_rows(self, path, rows):
+        """Seed a table, e.g. add_rows("/ip/hotspot/active", [{"address": "10.0.0.5"}])."""
+        return [self._insert(path, row) for row in rows]
+
+    def addresses(self, list_name="blocked_users"):
+        with self._lock:
+            self._purge_expired()
+            return {
+                row["address"]
+                for row in self.tables["/ip/firewall/address-list"]
+                if row.get("list") == list_name
+            }
+
+    def command_count(self, cmd=None):
+        with self._lock:
+            if cmd is None:
+                return sum(self.stats["commands"].values())
+            return self.stats["commands"].get(cmd, 0)
+
+    # ==================== CONNECTION ====================
+    def _delay_for(self, cmd):
+        if isinstance(self.latency, dict):
+            return self.latency.get(cmd, self.latency.get("default", 0.0))
+        return self.latency
+
+    def _serve(self, sock):
+        with self._lock:
+            if self.max_connections is not None and self.stats["active_connections"] >= self.max_connections:
+                self.stats["rejected_connections"] += 1
+                reject = True
+            else:
+                self.stats["connections"] += 1
+                self.stats["active_connections"] += 1
+                reject = False
+        if reject:
+            try:
+                sock.sendall(_wire.encodeSentence("!fatal", "too many connections"))
+            finally:
+                sock.close()
+            return
+
+        outbox = []  # heap of (due, seq, bytes)
+        cond = threading.Condition()
+        state = {"closed": False, "logged_in": False}
+
+        def writer():
+            while True:
+                with cond:
+                    while not outbox and not state["closed"]:
+                        cond.wait()
+                    if not outbox and state["closed"]:
+                        return
+                    due, _, data = outbox[0]
+                    wait_for = due - time.monotonic()
+                    if wait_for > 0:
+                        cond.wait(wait_for)
+                        continue
+                    heapq.heappop(outbox)
+                try:
+                    sock.sendall(data)
+                except OSError:
+                    return
+
+        writer_thread = threading.Thread(target=writer, daemon=True)
+        writer_thread.start()
+        seq = 0
+        try:
+            while True:
+                sentence = _read_sentence(sock)
+                if not sentence:
+                    continue
+                received = time.monotonic()
+                replies = self._dispatch(sentence, state)
+                data = b"".join(_wire.encodeSentence(*reply) for reply in replies)
+                with cond:
+                    seq += 1
+                    heapq.heappush(outbox, (received + self._delay_for(sentence[0]), seq, data))
+                    cond.notify()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with cond:
+                state["closed"] = True
+                cond.notify()
+            writer_thread.join(timeout=5)
+            with self._lock:
+                self.stats["active_connections"] -= 1
+            sock.close()
+
+    # ==================== COMMANDS ====================
+    def _dispatch(self, sentence, state):
+        cmd, words = sentence[0], sentence[1:]
+        attrs, query, tag = {}, [], None
+        for word in words:
+            if word.startswith(".tag="):
+                tag = word[5:]
+            elif word.startswith("?"):
+                query.append(word)
+            elif word.startswith("="):
+                key, _, value = word[1:].partition("=")
+                attrs[key] = value
+
+        with self._lock:
+            self.stats["commands"][cmd] = self.stats["commands"].get(cmd, 0) + 1
+            self._purge_expired()
+
+        def tagged(*reply):
+            return reply + ((f".tag={tag}",) if tag is not None else ())
+
+        def trap(message):
+            return [tagged("!trap", f"=message={message}"), tagged("!done")]
+
+        if cmd == "/login":
+            if attrs.get("name") == self.username and attrs.get("password") == self.password:
+                state["logged_in"] = True
+                return [tagged("!done")]
+            return trap("invalid user name or password (6)")
+
+        if not state["logged_in"]:
+            return trap("not logged in")
+
+        if cmd in self.fail_commands:
+            return trap(self.fail_commands[cmd])
+        if self.fail_rate and random.random() < self.fail_rate:
+            return trap("injected failure")
+
+        path, _, action = cmd.rpartition("/")
+        if path not in TABLES or TABLES[path] in self.disabled:
+            return trap("no such command prefix")
+
+        if action == "print":
+            proplist = attrs.get(".proplist")
+            with self._lock:
+                rows = [dict(row) for row in self.tables[path] if _match_query(row, query)]
+            if proplist:
+                keep = proplist.split(",")
+                rows = [{k: v for k, v in row.items() if k in keep} for row in rows]
+            replies = [
+                tagged("!re", *[f"={k}={v}" for k, v in row.items()])
+                for row in rows
+            ]
+            return replies + [tagged("!done")]
+
+        if action == "add":
+            if path == "/ip/firewall/address-list":
+                with self._lock:
+                    exists = any(
+                        row.get("list") == attrs.get("list") and row.get("address") == attrs.get("address")
+                        for row in self.tables[path]
+                    )
+                if exists:
+                    return trap("failure: already have such entry")
+            new_id = self._insert(path, attrs)
+            return [tagged("!done", f"=ret={new_id}")]
+
+        if action == "remove":
+            ids = [i for i in attrs.get(".id", "").split(",") if i]
+            with self._lock:
+                known = {row[".id"] for row in self.tables[path]}
+                missing = [i for i in ids if i not in known]
+                if missing or not ids:
+                    return trap("no such item")
+                self.tables[path] = [row for row in self.tables[path] if row[".id"] not in ids]
+            return [tagged("!done")]
+
+        if action == "set":
+            with self._lock:
+                for row in self.tables[path]:
+                    if row[".id"] == attrs.get(".id"):
+                        row.update({k: v for k, v in attrs.items() if k != ".id"})
+                        return [tagged("!done")]
+            return trap("no such item")
+
+        return trap("no such command")
+
+
+# ==================== BENCHMARK ====================
+def _load_template_helper():
+    """templates/microtik_helper.py is not a package module; load it by path."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "microtik_helper.py")
+    spec = importlib.util.spec_from_file_location("templates_microtik_helper", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _timed(label, count, func):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # helpers print one line per IP
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<42} {count:>6} ops  {elapsed:8.3f}s  {count / elapsed if elapsed else 0:10.1f} ops/s")
+    return elapsed
+
+
+def run_benchmark(ips=200, latency=0.0):
+    import mikrotik_helper
+
+    addresses = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(1, ips + 1)]
+    print(f"RouterOS fake: {ips} IPs, {latency * 1000:.0f} ms per reply")
+
+    with FakeRouterOS(latency=latency) as fake:
+        router = fake.router(id=9001)
+
+        _timed("mikrotik_helper.block_ip (per IP)", ips,
+               lambda: [mikrotik_helper.block_ip(ip, router) for ip in addresses])
+        assert fake.addresses() == set(addresses)
+        _timed("mikrotik_helper.unblock_ip (per IP)", ips,
+               lambda: [mikrotik_helper.unblock_ip(ip, router) for ip in addresses])
+        assert not fake.addresses()
+
+        _timed("apply_address_list_changes (bulk block)", ips,
+               lambda: mikrotik_helper.apply_address_list_changes(router, block_ips=addresses))
+        assert fake.addresses() == set(addresses)
+        _timed("apply_address_list_changes (bulk unblock)", ips,
+               lambda: mikrotik_helper.apply_address_list_changes(router, unblock_ips=addresses))
+        assert not fake.addresses()
+        mikrotik_helper.invalidate_router(router.id)
+
+    with FakeRouterOS(latency=latency) as fake:
+        router = fake.router(id=9002)
+        helper = _load_template_helper()
+
+        _timed("templates/microtik_helper.block_ip", ips,
+               lambda: [helper.block_ip(ip, router) for ip in addresses])
+        assert fake.addresses() == set(addresses)
+        _timed("templates/microtik_helper.unblock_ip", ips,
+               lambda: [helper.unblock_ip(ip, router) for ip in addresses])
+        assert not fake.addresses()
+        print(f"{'connections opened by templates helper':<42} {fake.stats['connections']:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MikroTik helpers against a fake RouterOS")
+    parser.add_argument("--ips", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per reply")
+    args = parser.parse_args()
+    run_benchmark(ips=args.ips, latency=args.latency)
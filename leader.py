@@ -0,0 +1,132 @@
+"""
+Scheduler leader election through a lease row (scheduler_lease table).
+
+Every process that starts the scheduler heartbeats the lease; the one
+holding it runs the jobs, the others skip them. A leader that dies stops
+renewing and another process takes over once the lease expires.
+"""
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+
+from sqlalchemy import case, or_
+from sqlalchemy.exc import IntegrityError
+
+from connections import SessionLocal
+from models import SchedulerLease
+
+LEASE_NAME = "scheduler"
+LEASE_TTL = 30          # seconds the lease stays valid without a heartbeat
+HEARTBEAT_SECONDS = 10  # renew well before the lease runs out
+
+
+class LeaderLease:
+    def __init__(self, name=LEASE_NAME, ttl=LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0   # local monotonic deadline, never later than the DB lease
+        self._lock = threading.Lock()
+
+    def is_leader(self):
+        return time.monotonic() < self._valid_until
+
+    def heartbeat(self):
+        """Acquire or renew the lease. Returns True while this process is the leader."""
+        started = time.monotonic()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        was_leader = self.is_leader()
+
+        db = SessionLocal()
+        try:
+            won = db.query(SchedulerLease).filter(
+                SchedulerLease.name == self.name,
+                or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now),
+            ).update({
+                SchedulerLease.acquired_at: case(
+                    (SchedulerLease.holder == self.holder, SchedulerLease.acquired_at), else_=now
+                ),
+                SchedulerLease.holder: self.holder,
+                SchedulerLease.heartbeat_at: now,
+                SchedulerLease.expires_at: expires_at,
+            }, synchronize_session=False) > 0
+
+            if not won and not db.query(SchedulerLease.name).filter_by(name=self.name).first():
+                db.add(SchedulerLease(
+                    name=self.name, holder=self.holder,
+                    acquired_at=now, heartbeat_at=now, expires_at=expires_at,
+                ))
+                won = True
+            db.commit()
+
+        except IntegrityError:
+            db.rollback()   # another process inserted the row first
+            won = False
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Scheduler lease heartbeat failed: {e}")
+            # keep the current deadline: leadership lapses together with the lease
+            return self.is_leader()
+        finally:
+            db.close()
+
+        with self._lock:
+            self._valid_until = started + self.ttl if won else 0.0
+
+        if won and not was_leader:
+            print(f"👑 Scheduler leader: {self.holder}")
+        elif was_leader and not won:
+            print(f"⚠️ Scheduler lease lost by {self.holder}")
+        return won
+
+    def release(self):
+        """Give the lease up (clean shutdown) so another process can take over at once."""
+        if not self.is_leader():
+            return
+        self._valid_until = 0.0
+        db = SessionLocal()
+        try:
+            db.query(SchedulerLease).filter_by(name=self.name, holder=self.holder).update(
+                {SchedulerLease.expires_at: datetime.utcnow()}, synchronize_session=False
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+    def snapshot(self):
+        db = SessionLocal()
+        try:
+            row = db.query(SchedulerLease).filter_by(name=self.name).first()
+            if not row:
+                return None
+            return {
+                "holder": row.holder,
+                "acquired_at": row.acquired_at,
+                "heartbeat_at": row.heartbeat_at,
+                "expires_at": row.expires_at,
+                "me": row.holder == self.holder,
+            }
+        finally:
+            db.close()
+
+
+lease = LeaderLease()
+atexit.register(lease.release)
+
+
+def leader_only(func):
+    """Scheduler job wrapper: run only in the process holding the lease."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not lease.is_leader():
+            return None
+        return func(*args, **kwargs)
+    return wrapper
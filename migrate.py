@@ -0,0 +1,167 @@
+"""
+Versioned schema migrations (replaces create.py's drop_all/create_all).
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied / pending migrations
+
+Applied versions are recorded in schema_migrations and each one runs once.
+Every step checks the live schema first, so a fresh database, one built by
+the old create.py and one that already has some of the changes all end up
+with the same schema. Existing rows are never dropped.
+
+New schema change = add a function below and append it to MIGRATIONS.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, select, text
+
+from connections import Base, engine
+from models import *  # noqa: F401,F403 - every model must be registered on Base
+
+
+# ==================== SCHEMA HELPERS ====================
+def _has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+
+def _has_column(conn, table, column):
+    return any(col["name"] == column for col in inspect(conn).get_columns(table))
+
+
+def _has_index(conn, table, name):
+    inspector = inspect(conn)
+    names = {ix["name"] for ix in inspector.get_indexes(table)}
+    names |= {uq["name"] for uq in inspector.get_unique_constraints(table)}
+    return name in names
+
+
+def add_column(conn, model, column):
+    """ALTER TABLE ... ADD COLUMN from the model's column definition."""
+    table = model.__table__
+    if _has_column(conn, table.name, column):
+        return False
+    col = table.c[column]
+    ddl = col.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl} NULL"))
+    print(f"   + column {table.name}.{column}")
+    return True
+
+
+def create_index(conn, model, name):
+    """CREATE INDEX from an Index declared on the model (index=True or __table_args__)."""
+    table = model.__table__
+    index = next(ix for ix in table.indexes if ix.name == name)
+    if _has_index(conn, table.name, name):
+        return False
+    index.create(conn)
+    print(f"   + index {name} on {table.name}({', '.join(col.name for col in index.columns)})")
+    return True
+
+
+# ==================== MIGRATIONS ====================
+def create_missing_tables(conn):
+    # fresh database: everything; older ones: tables added since
+    # (router_jobs, router_drift, scheduler_lease, scheduler_runs, ...)
+    missing = [table for table in Base.metadata.sorted_tables if not _has_table(conn, table.name)]
+    Base.metadata.create_all(conn, tables=missing)
+    for table in missing:
+        print(f"   + table {table.name}")
+
+
+def customer_next_transition(conn):
+    add_column(conn, Customer, "next_transition_at")
+    create_index(conn, Customer, "ix_customers_next_transition_at")
+
+
+def hot_lookup_indexes(conn):
+    create_index(conn, Customer, "ix_customers_status_router")  # also serves status alone
+    create_index(conn, Customer, "ix_customers_router_id")
+    create_index(conn, Customer, "ix_customers_start_date")
+    create_index(conn, Payment, "ix_payments_paid_at_method")   # also serves paid_at alone
+
+
+def unique_ip_per_router(conn):
+    duplicates = conn.execute(
+        text(
+            "SELECT ip_address, router_id, COUNT(*) FROM customers "
+            "WHERE ip_address IS NOT NULL AND router_id IS NOT NULL "
+            "GROUP BY ip_address, router_id HAVING COUNT(*) > 1"
+        )
+    ).fetchall()
+    if duplicates:
+        listed = ", ".join(f"{ip} (router {router_id}, {count}x)" for ip, router_id, count in duplicates[:20])
+        raise RuntimeError(
+            f"{len(duplicates)} IP address(es) are used more than once on the same router: {listed}. "
+            "Fix these customers and run the migration again."
+        )
+    # the unique index leads with ip_address, so it also serves lookups by IP alone
+    create_index(conn, Customer, "uq_customers_ip_router")
+
+
+def router_health_table(conn):
+    # databases migrated before router_health existed (version 1 already ran)
+    if not _has_table(conn, RouterHealthState.__tablename__):
+        RouterHealthState.__table__.create(conn)
+        print(f"   + table {RouterHealthState.__tablename__}")
+
+
+MIGRATIONS = [
+    (1, "create missing tables", create_missing_tables),
+    (2, "customers.next_transition_at", customer_next_transition),
+    (3, "hot lookup indexes", hot_lookup_indexes),
+    (4, "unique ip_address per router", unique_ip_per_router),
+    (5, "router_health table", router_health_table),
+]
+
+
+# ==================== RUNNER ====================
+def applied_versions(conn):
+    if not _has_table(conn, SchemaMigration.__tablename__):
+        return set()
+    return set(conn.execute(select(SchemaMigration.version)).scalars())
+
+
+def migrate():
+    """Apply pending migrations in order. Returns the versions applied."""
+    with engine.begin() as conn:
+        SchemaMigration.__table__.create(conn, checkfirst=True)
+        done = applied_versions(conn)
+
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"⏫ Migration {version:03d}: {name}")
+        # one transaction per migration (MySQL commits DDL implicitly,
+        # which is why every step checks the live schema first)
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(
+                SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow())
+            )
+        applied.append(version)
+
+    if applied:
+        print(f"✅ Applied {len(applied)} migration(s)")
+    else:
+        print("✅ Schema is up to date")
+    return applied
+
+
+def status():
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    for version, name, _ in MIGRATIONS:
+        print(f"{'applied' if version in done else 'pending'}  {version:03d}  {name}")
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv[1:]:
+        status()
+    else:
+        try:
+            migrate()
+        except RuntimeError as e:
+            print(f"❌ Migration stopped: {e}")
+            sys.exit(1)
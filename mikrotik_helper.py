@@ -1,5 +1,39 @@
-# 
+import atexit
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
 from librouteros import connect
+from librouteros.exceptions import LibRouterosError, TrapError, MultiTrapError
+from librouteros.protocol import compose_word
+from librouteros.query import Key
+
+BLOCKED_LIST = "blocked_users"
+
+# Daily grace passes: a grace_allowed entry with a RouterOS timeout.
+# Needs an accept rule placed BEFORE the blocked_users drop rule, e.g.
+#   /ip firewall filter add chain=forward src-address-list=grace_allowed action=accept place-before=0
+GRACE_LIST = "grace_allowed"
+
+# ==================== CONNECTION POOL SETTINGS ====================
+MAX_SESSIONS_PER_ROUTER = 2     # concurrent API sessions we open on one router
+IDLE_HEALTHCHECK_AFTER = 30     # seconds idle before a connection is pinged on checkout
+MAX_IDLE_SECONDS = 300          # idle connections older than this are closed
+ACQUIRE_TIMEOUT = 15            # seconds to wait for a free session slot
+
+# ==================== SESSION KICK SETTINGS ====================
+KICK_ON_BLOCK = False           # opt-in: drop hotspot sessions / dynamic DHCP leases of newly blocked IPs
+MISSING_SERVICE_TTL = 3600      # seconds before re-probing a router that had no hotspot/DHCP
+
+# ==================== PIPELINE SETTINGS ====================
+PIPELINE_WINDOW = 128           # tagged commands in flight before we wait for replies
+
+# ==================== CIRCUIT BREAKER SETTINGS ====================
+BREAKER_FAILURE_THRESHOLD = 3   # consecutive failures before the circuit opens
+BREAKER_OPEN_SECONDS = 60       # fail fast this long, then allow one probe
+
 
 def get_mikrotik_connection(host, user, password, port=8728, timeout=10):
     try:
@@ -15,49 +49,693 @@ def get_mikrotik_connection(host, user, password, port=8728, timeout=10):
         return None
 
 
-def block_ip(ip_address, router):
-    api = get_mikrotik_connection(
+def _close_quietly(api):
+    try:
+        api.close()
+    except Exception:
+        pass
+
+
+# ==================== ROUTER HEALTH / CIRCUIT BREAKER ====================
+class RouterHealth:
+    """Health counters for one router."""
+
+    def __init__(self):
+        self.state = "closed"          # closed / open / half_open
+        self.consecutive_failures = 0
+        self.last_success_at = None    # datetime (UTC)
+        self.last_failure_at = None
+        self.last_error = None
+        self.avg_latency_ms = None     # moving average of connect / ping time
+        self.opened_at = 0.0           # monotonic; open / probe start time
+        self.changed_at = None         # datetime (UTC) of the last update; router_health.py publishes on change
+
+
+class CircuitBreaker:
+    """
+    Per-router circuit breaker (kept in this process; router_health.py
+    publishes it to the router_health table for the other processes).
+    - `threshold` consecutive failures open the circuit: calls fail fast
+    - after `open_seconds` one probe call is let through (half-open)
+    - a successful probe closes the circuit, a failed one re-opens it
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, open_seconds=BREAKER_OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._health = {}  # router_id -> RouterHealth
+
+    def _get(self, router_id):
+        health = self._health.get(router_id)
+        if health is None:
+            health = self._health[router_id] = RouterHealth()
+        return health
+
+    def is_open(self, router_id):
+        """True while the router should be skipped (no probe is due yet)."""
+        with self._lock:
+            health = self._health.get(router_id)
+            if health is None or health.state == "closed":
+                return False
+            return time.monotonic() - health.opened_at < self.open_seconds
+
+    def retry_in(self, router_id):
+        """Seconds until the next probe is allowed (0 if not open)."""
+        with self._lock:
+            health = self._health.get(router_id)
+            if health is None or health.state == "closed":
+                return 0
+            return max(0, int(self.open_seconds - (time.monotonic() - health.opened_at)))
+
+    def allow(self, router_id):
+        """
+        Reserve a call. Once the open period is over a single probe gets
+        through (half-open); a probe that never reports back is replaced
+        after another open period.
+        """
+        with self._lock:
+            health = self._get(router_id)
+            if health.state == "closed":
+                return True
+            now = time.monotonic()
+            if now - health.opened_at >= self.open_seconds:
+                health.state = "half_open"
+                health.opened_at = now
+                health.changed_at = datetime.utcnow()
+                return True
+            return False
+
+    def record_latency(self, router_id, seconds):
+        with self._lock:
+            health = self._get(router_id)
+            ms = seconds * 1000.0
+            if health.avg_latency_ms is None:
+                health.avg_latency_ms = ms
+            else:
+                health.avg_latency_ms = 0.7 * health.avg_latency_ms + 0.3 * ms
+            health.changed_at = datetime.utcnow()
+
+    def record_success(self, router_id):
+        with self._lock:
+            health = self._get(router_id)
+            health.state = "closed"
+            health.consecutive_failures = 0
+            health.last_success_at = health.changed_at = datetime.utcnow()
+
+    def record_failure(self, router_id, error=None):
+        with self._lock:
+            health = self._get(router_id)
+            health.consecutive_failures += 1
+            health.last_failure_at = health.changed_at = datetime.utcnow()
+            health.last_error = str(error)[:255] if error else None
+            if health.state == "half_open" or health.consecutive_failures >= self.threshold:
+                if health.state != "open":
+                    print(f"⛔ Circuit opened for router #{router_id} after {health.consecutive_failures} failure(s)")
+                health.state = "open"
+                health.opened_at = time.monotonic()
+
+    def reset(self, router_id):
+        with self._lock:
+            self._health.pop(router_id, None)
+
+    def snapshot(self):
+        """{router_id: dict} for display."""
+        with self._lock:
+            return {
+                router_id: {
+                    "state": h.state,
+                    "consecutive_failures": h.consecutive_failures,
+                    "last_success_at": h.last_success_at,
+                    "last_failure_at": h.last_failure_at,
+                    "last_error": h.last_error,
+                    "avg_latency_ms": round(h.avg_latency_ms, 1) if h.avg_latency_ms is not None else None,
+                    "changed_at": h.changed_at,
+                }
+                for router_id, h in self._health.items()
+            }
+
+
+def _is_connection_error(exc):
+    """Errors that say the router is unreachable (not a rejected command)."""
+    if isinstance(exc, (TrapError, MultiTrapError)):
+        return False
+    return isinstance(exc, (OSError, LibRouterosError))
+
+
+def router_fingerprint(router):
+    """Connection settings that force a reconnect when they change."""
+    return (
         router.ip_address,
+        getattr(router, "port", 8728) or 8728,
         router.username,
         router.password,
-        getattr(router, "port", 8728)
     )
-    if not api:
-        return False
 
-    al = api.path("ip", "firewall", "address-list")
 
-    existing = list(al.select(
-        where=f'list="blocked_users" and address="{ip_address}"'
+class _RouterSlot:
+    """Idle connections + session limit for one router."""
+
+    def __init__(self, fingerprint, max_sessions):
+        self.fingerprint = fingerprint
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+        self.idle = []  # [(api, last_used_monotonic)]
+
+
+class RouterPool:
+    """
+    Authenticated librouteros connections kept per Router.id.
+    - at most `max_sessions` sessions per router at a time
+    - idle connections are pinged before reuse, and closed when stale
+    - a change of IP/port/credentials drops the old connections
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS_PER_ROUTER,
+                 healthcheck_after=IDLE_HEALTHCHECK_AFTER,
+                 max_idle=MAX_IDLE_SECONDS,
+                 acquire_timeout=ACQUIRE_TIMEOUT,
+                 breaker=None):
+        self.breaker = breaker or CircuitBreaker()
+        self.max_sessions = max_sessions
+        self.healthcheck_after = healthcheck_after
+        self.max_idle = max_idle
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._slots = {}  # router_id -> _RouterSlot
+
+    def _slot_for(self, router):
+        fingerprint = router_fingerprint(router)
+        stale = []
+        with self._lock:
+            slot = self._slots.get(router.id)
+            if slot is None or slot.fingerprint != fingerprint:
+                if slot is not None:
+                    stale = [api for api, _ in slot.idle]
+                    slot.idle = []
+                slot = _RouterSlot(fingerprint, self.max_sessions)
+                self._slots[router.id] = slot
+        for api in stale:
+            _close_quietly(api)
+        return slot
+
+    def _pop_idle(self, router_id, slot):
+        """Return a healthy idle connection for this slot, or None."""
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not slot.idle:
+                    return None
+                api, last_used = slot.idle.pop()
+
+            idle_for = now - last_used
+            if idle_for > self.max_idle:
+                _close_quietly(api)
+                continue
+            if idle_for > self.healthcheck_after:
+                started = time.monotonic()
+                try:
+                    tuple(api("/system/identity/print"))
+                except Exception:
+                    _close_quietly(api)
+                    continue
+                self.breaker.record_latency(router_id, time.monotonic() - started)
+            return api
+
+    def _release(self, router_id, slot, api, broken):
+        with self._lock:
+            current = self._slots.get(router_id) is slot
+            if api is not None and not broken and current:
+                slot.idle.append((api, time.monotonic()))
+                api = None
+        if api is not None:
+            _close_quietly(api)
+        slot.sessions.release()
+
+    @contextmanager
+    def session(self, router, timeout=10):
+        """
+        Borrow a connection for `router`.
+        Yields None when no session could be opened (same contract as
+        get_mikrotik_connection) or while the router's circuit is open.
+        Errors inside the block discard the connection.
+        """
+        if not self.breaker.allow(router.id):
+            print(f"⛔ Skipping {router.ip_address}: circuit open")
+            yield None
+            return
+
+        slot = self._slot_for(router)
+        if not slot.sessions.acquire(timeout=self.acquire_timeout):
+            print(f"⚠️ MikroTik pool busy for {router.ip_address}")
+            yield None
+            return
+
+        api = None
+        broken = False
+        try:
+            api = self._pop_idle(router.id, slot)
+            if api is None:
+                host, port, username, password = slot.fingerprint
+                started = time.monotonic()
+                api = get_mikrotik_connection(host, username, password, port, timeout)
+                if api is None:
+                    self.breaker.record_failure(router.id, "connect failed")
+                else:
+                    self.breaker.record_latency(router.id, time.monotonic() - started)
+            yield api
+            if api is not None:
+                self.breaker.record_success(router.id)
+        except BaseException as e:
+            # a !trap is read up to !done, so the connection is still usable
+            broken = not isinstance(e, (TrapError, MultiTrapError))
+            if _is_connection_error(e):
+                self.breaker.record_failure(router.id, e)
+            elif api is not None:
+                self.breaker.record_success(router.id)
+            raise
+        finally:
+            self._release(router.id, slot, api, broken)
+
+    def invalidate(self, router_id):
+        """Close idle connections for a router (edited/deleted) and reset its health."""
+        self.breaker.reset(router_id)
+        with self._lock:
+            slot = self._slots.pop(router_id, None)
+            stale = [api for api, _ in slot.idle] if slot else []
+            if slot:
+                slot.idle = []
+        for api in stale:
+            _close_quietly(api)
+
+    def evict_stale(self):
+        """Close connections idle for longer than max_idle."""
+        cutoff = time.monotonic() - self.max_idle
+        stale = []
+        with self._lock:
+            for slot in self._slots.values():
+                keep = []
+                for api, last_used in slot.idle:
+                    (stale if last_used < cutoff else keep).append((api, last_used))
+                slot.idle = keep
+        for api, _ in stale:
+            _close_quietly(api)
+        return len(stale)
+
+    def close_all(self):
+        with self._lock:
+            slots = list(self._slots.values())
+            self._slots = {}
+        for slot in slots:
+            for api, _ in slot.idle:
+                _close_quietly(api)
+            slot.idle = []
+
+
+pool = RouterPool()
+atexit.register(pool.close_all)
+
+
+def router_session(router, timeout=10):
+    """Shortcut: `with router_session(router) as api:` using the shared pool."""
+    return pool.session(router, timeout=timeout)
+
+
+def invalidate_router(router_id):
+    pool.invalidate(router_id)
+    forget_missing_services(router_id)
+
+
+def router_is_down(router_id):
+    """True while the router's circuit is open; callers can skip it instantly."""
+    return pool.breaker.is_open(router_id)
+
+
+def router_health():
+    """{router_id: {...}} health snapshot of this process (see router_health.py)."""
+    return pool.breaker.snapshot()
+
+
+# ==================== HOTSPOT / DHCP SESSION KICK ====================
+SESSION_TABLES = {
+    "hotspot": ("ip", "hotspot", "active"),
+    "dhcp": ("ip", "dhcp-server", "lease"),
+}
+# only dynamic leases: a static binding is what keeps a customer on their IP
+SESSION_FILTERS = {
+    "dhcp": {"dynamic": True},
+}
+
+_missing_services = {}  # (router_id, service) -> monotonic time it was found missing
+_missing_lock = threading.Lock()
+
+
+def _service_missing(router_id, service):
+    with _missing_lock:
+        seen = _missing_services.get((router_id, service))
+        if seen is None:
+            return False
+        if time.monotonic() - seen > MISSING_SERVICE_TTL:
+            del _missing_services[(router_id, service)]
+            return False
+        return True
+
+
+def _mark_service_missing(router_id, service):
+    with _missing_lock:
+        _missing_services[(router_id, service)] = time.monotonic()
+    print(f"ℹ️ Router #{router_id} has no {service} service; not probing it for {MISSING_SERVICE_TTL}s")
+
+
+def forget_missing_services(router_id):
+    with _missing_lock:
+        for service in SESSION_TABLES:
+            _missing_services.pop((router_id, service), None)
+
+
+def kick_sessions(api, router_id, ip_addresses):
+    """
+    Remove hotspot active sessions and dynamic DHCP leases for these IPs
+    (static leases are left alone).
+    Each table is read once per call and indexed by address (a single IP
+    uses a filtered print). Routers without the service are remembered
+    and skipped until MISSING_SERVICE_TTL expires.
+    Returns {service: removed_count}.
+    """
+    ips = set(ip_addresses)
+    removed = {}
+    if not ips:
+        return removed
+
+    for service, path in SESSION_TABLES.items():
+        if _service_missing(router_id, service):
+            continue
+
+        table = api.path(*path)
+        conditions = [Key(key) == value for key, value in SESSION_FILTERS.get(service, {}).items()]
+        if len(ips) == 1:
+            conditions.append(Key("address") == next(iter(ips)))
+        query = table.select(Key(".id"), Key("address"))
+        if conditions:
+            query = query.where(*conditions)
+
+        index = {}  # address -> [.id, ...]
+        try:
+            for row in query:
+                index.setdefault(row.get("address"), []).append(row[".id"])
+        except (TrapError, MultiTrapError):
+            _mark_service_missing(router_id, service)
+            continue
+
+        ids = [entry_id for ip_address in ips & index.keys() for entry_id in index[ip_address]]
+        # one remove per entry: a session that ended meanwhile doesn't fail the rest
+        replies = run_pipelined(api, [(f"{table}/remove", {".id": entry_id}) for entry_id in ids])
+        removed[service] = sum(1 for reply in replies if reply.ok)
+
+    return removed
+
+
+# ==================== PIPELINED COMMANDS ====================
+PipelineReply = namedtuple("PipelineReply", "ok ret error")
+
+
+def _parse_reply_words(words):
+    """Raw reply words -> (tag, attrs). RouterOS sends the tag as '.tag=N'."""
+    tag, attrs = None, {}
+    for word in words:
+        if word.startswith(".tag="):
+            tag = word[5:]
+        elif word.startswith("="):
+            key, _, value = word[1:].partition("=")
+            if key == ".tag":
+                tag = value
+            else:
+                attrs[key] = value
+    return tag, attrs
+
+
+def run_pipelined(api, commands, window=PIPELINE_WINDOW):
+    """
+    Send many commands on one session without waiting for each reply.
+    `commands` is a list of (command, {attr: value}). Every sentence gets
+    a .tag and replies are matched back by tag, so up to `window` commands
+    share one round trip instead of paying one each.
+    Returns one PipelineReply(ok, ret, error) per command, in order:
+    `ret` is the new .id for add, `error` the !trap message.
+    Connection errors are raised (the session is broken).
+    """
+    replies = [None] * len(commands)
+    pending = {}  # tag -> trap message (or None)
+    sent = 0
+    protocol = api.protocol
+
+    while sent < len(commands) or pending:
+        while sent < len(commands) and len(pending) < window:
+            command, attrs = commands[sent]
+            words = [compose_word(key, value) for key, value in attrs.items()]
+            protocol.writeSentence(command, *words, f".tag={sent}")
+            pending[str(sent)] = None
+            sent += 1
+
+        reply_word, words = protocol.readSentence()
+        tag, attrs = _parse_reply_words(words)
+        if tag not in pending:
+            continue
+
+        if reply_word == "!trap":
+            pending[tag] = pending[tag] or attrs.get("message", "trap")
+        elif reply_word == "!done":
+            error = pending.pop(tag)
+            replies[int(tag)] = PipelineReply(error is None, attrs.get("ret"), error)
+
+    return replies
+
+
+# ==================== ADDRESS-LIST HELPERS ====================
+def seconds_until_day_end(now=None):
+    """
+    Seconds left in the current day. Uses the same UTC day as
+    grace_pass_date so the router and the database expire grace together.
+    """
+    now = now or datetime.utcnow()
+    next_day = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return max(int((next_day - now).total_seconds()), 1)
+
+
+def routeros_duration(seconds):
+    """12345 -> '3h25m45s' (RouterOS time format)."""
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}h{minutes}m{secs}s"
+
+
+def _blocked_entries(api, ip_address):
+    al = api.path("ip", "firewall", "address-list")
+    rows = list(al.select(Key(".id")).where(
+        Key("list") == BLOCKED_LIST,
+        Key("address") == ip_address,
     ))
+    return al, rows
 
-    if not existing:
-        al.add(
-            list="blocked_users",
-            address=ip_address,
-            comment="blocked from app"
-        )
+
+def block_ip(ip_address, router):
+    with router_session(router) as api:
+        if not api:
+            return False
+
+        al, existing = _blocked_entries(api, ip_address)
+
+        if not existing:
+            al.add(
+                list=BLOCKED_LIST,
+                address=ip_address,
+                comment="blocked from app"
+            )
+            if KICK_ON_BLOCK:
+                kick_sessions(api, router.id, [ip_address])
+
+        # a block also ends any grace pass still running today
+        _write_grace_changes(al, _read_address_list(al, GRACE_LIST), (), [ip_address])
 
     print(f"🔒 Blocked {ip_address} on {router.ip_address}")
     return True
 
 
 def unblock_ip(ip_address, router):
-    api = get_mikrotik_connection(
-        router.ip_address,
-        router.username,
-        router.password,
-        getattr(router, "port", 8728)
-    )
-    if not api:
-        return False
+    with router_session(router) as api:
+        if not api:
+            return False
 
-    al = api.path("ip", "firewall", "address-list")
-
-    for row in al.select(
-        where=f'list="blocked_users" and address="{ip_address}"'
-    ):
-        al.remove(row[".id"])
+        al, rows = _blocked_entries(api, ip_address)
+        if rows:
+            al.remove(*[row[".id"] for row in rows])
 
     print(f"🔓 Unblocked {ip_address} on {router.ip_address}")
     return True
+
+
+def _read_address_list(al, list_name=BLOCKED_LIST):
+    """address -> [.id, ...] for every entry in one address list (one print)."""
+    current = {}
+    for row in al.select(Key(".id"), Key("address")).where(Key("list") == list_name):
+        current.setdefault(row.get("address"), []).append(row[".id"])
+    return current
+
+
+def _read_blocked_list(al):
+    return _read_address_list(al, BLOCKED_LIST)
+
+
+def _run_ip_commands(al, ip_commands):
+    """
+    Pipeline (ip, command, attrs) triples on one address-list path.
+    Returns (ok_ips, {ip: error}); an IP fails if any of its commands trapped.
+    """
+    replies = run_pipelined(al.api, [(f"{al}/{command}", attrs) for _, command, attrs in ip_commands])
+
+    errors = {}
+    for (ip_address, _, _), reply in zip(ip_commands, replies):
+        if not reply.ok:
+            errors.setdefault(ip_address, reply.error)
+
+    ok_ips = []
+    for ip_address, _, _ in ip_commands:
+        if ip_address not in errors and (not ok_ips or ok_ips[-1] != ip_address):
+            ok_ips.append(ip_address)
+    return ok_ips, errors
+
+
+def _write_blocked_changes(al, current, to_add, to_remove):
+    """
+    Pipelined adds and removes on blocked_users.
+    Returns (added, removed, {ip: error}).
+    """
+    added, add_errors = _run_ip_commands(al, [
+        (ip_address, "add", {"list": BLOCKED_LIST, "address": ip_address, "comment": "blocked from app"})
+        for ip_address in to_add
+    ])
+    removed, remove_errors = _run_ip_commands(al, [
+        (ip_address, "remove", {".id": entry_id})
+        for ip_address in to_remove for entry_id in current[ip_address]
+    ])
+    return added, removed, {**add_errors, **remove_errors}
+
+
+def _write_grace_changes(al, grace_current, grace_ips, revoke_ips):
+    """
+    Add grace_allowed entries that expire at the end of the day and
+    remove the ones being revoked (pipelined).
+    Returns (added, revoked, {ip: error}).
+    """
+    to_grant = sorted(set(grace_ips) - grace_current.keys())
+    to_revoke = sorted(set(revoke_ips) & grace_current.keys())
+
+    timeout = routeros_duration(seconds_until_day_end())
+    added, add_errors = _run_ip_commands(al, [
+        (ip_address, "add", {
+            "list": GRACE_LIST, "address": ip_address,
+            "timeout": timeout, "comment": "grace pass from app",
+        })
+        for ip_address in to_grant
+    ])
+    revoked, revoke_errors = _run_ip_commands(al, [
+        (ip_address, "remove", {".id": entry_id})
+        for ip_address in to_revoke for entry_id in grace_current[ip_address]
+    ])
+    return added, revoked, {**add_errors, **revoke_errors}
+
+
+def read_blocked_list(router):
+    """Set of addresses in blocked_users on this router, or None if unreachable."""
+    with router_session(router) as api:
+        if not api:
+            return None
+        return set(_read_blocked_list(api.path("ip", "firewall", "address-list")))
+
+
+def sync_blocked_list(router, desired_ips, grace_ips=()):
+    """
+    Make `blocked_users` on this router match `desired_ips`.
+    Reads the list once, then sends only the missing adds and the extra
+    removes on a single session.
+    `grace_ips` (a subset of desired_ips) get a grace_allowed entry for the
+    rest of the day; other desired IPs lose any grace entry they still have.
+    Writes are pipelined; IPs whose command trapped are left out of the
+    lists and reported in "errors" as {ip: message}.
+    Returns {"added", "removed", "grace_added", "grace_revoked", "errors"} or None if unreachable.
+    """
+    desired = set(desired_ips)
+    grace_ips = set(grace_ips)
+
+    with router_session(router) as api:
+        if not api:
+            return None
+
+        al = api.path("ip", "firewall", "address-list")
+
+        current = _read_blocked_list(al)
+
+        added, removed, errors = _write_blocked_changes(
+            al, current, sorted(desired - current.keys()), sorted(current.keys() - desired)
+        )
+
+        grace_added, grace_revoked, grace_errors = _write_grace_changes(
+            al, _read_address_list(al, GRACE_LIST), grace_ips, desired - grace_ips
+        )
+        errors.update(grace_errors)
+
+        if KICK_ON_BLOCK:
+            kick_sessions(api, router.id, set(added) - grace_ips)
+
+    print(f"🔁 Synced {BLOCKED_LIST} on {router.ip_address}: +{len(added)} / -{len(removed)}"
+          + (f" ({len(errors)} failed)" if errors else ""))
+    return {
+        "added": added, "removed": removed,
+        "grace_added": grace_added, "grace_revoked": grace_revoked,
+        "errors": errors,
+    }
+
+
+def apply_address_list_changes(router, block_ips=(), unblock_ips=(), grace_ips=()):
+    """
+    Block, unblock and grace many IPs on one router in a single session.
+    The blocked_users list is read once; already-correct IPs are skipped.
+    Grace IPs stay in blocked_users and get a grace_allowed entry that
+    expires at the end of the day; blocking an IP revokes its grace entry.
+    Writes are pipelined; IPs whose command trapped are left out of the
+    lists and reported in "errors" as {ip: message}.
+    Returns {"added", "removed", "grace_added", "grace_revoked", "errors"} or None if unreachable.
+    """
+    grace_ips = set(grace_ips)
+    block_ips = set(block_ips) - grace_ips
+    unblock_ips = set(unblock_ips) - block_ips - grace_ips
+    listed = block_ips | grace_ips
+
+    with router_session(router) as api:
+        if not api:
+            return None
+
+        al = api.path("ip", "firewall", "address-list")
+
+        current = _read_blocked_list(al)
+
+        added, removed, errors = _write_blocked_changes(
+            al, current, sorted(listed - current.keys()), sorted(unblock_ips & current.keys())
+        )
+
+        grace_added, grace_revoked = [], []
+        if listed:
+            grace_added, grace_revoked, grace_errors = _write_grace_changes(
+                al, _read_address_list(al, GRACE_LIST), grace_ips, block_ips
+            )
+            errors.update(grace_errors)
+
+        if KICK_ON_BLOCK:
+            kick_sessions(api, router.id, set(added) - grace_ips)
+
+    print(f"🔁 Applied changes on {router.ip_address}: +{len(added)} / -{len(removed)}"
+          + (f" ({len(errors)} failed)" if errors else ""))
+    return {
+        "added": added, "removed": removed,
+        "grace_added": grace_added, "grace_revoked": grace_revoked,
+        "errors": errors,
+    }
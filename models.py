@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Boolean, ForeignKey, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from connections import Base
 from datetime import datetime
@@ -53,10 +53,35 @@ class Router(Base):
         cascade="all, delete-orphan"
     )
 
+    jobs = relationship(
+        "RouterJob",
+        back_populates="router",
+        cascade="all, delete-orphan"
+    )
+
+    drift = relationship(
+        "RouterDrift",
+        back_populates="router",
+        cascade="all, delete-orphan"
+    )
+
+    health = relationship(
+        "RouterHealthState",
+        back_populates="router",
+        uselist=False,
+        cascade="all, delete-orphan"
+    )
+
 
 # ==================== CUSTOMER MODEL ====================
 class Customer(Base):
     __tablename__ = "customers"
+    __table_args__ = (
+        # portal lookups by IP; an IP is unique per router
+        Index("uq_customers_ip_router", "ip_address", "router_id", unique=True),
+        # dashboard / suspended lists, per router
+        Index("ix_customers_status_router", "status", "router_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=True)
@@ -66,7 +91,7 @@ class Customer(Base):
     location = Column(String(255), nullable=True)
     billing_amount = Column(Float, nullable=True)
 
-    start_date = Column(DateTime, nullable=True)
+    start_date = Column(DateTime, nullable=True, index=True)
     contract_date = Column(DateTime, nullable=True)
 
     # Legacy fields (keep)
@@ -83,7 +108,7 @@ class Customer(Base):
     activated_on = Column(DateTime, nullable=True)
     hold_until = Column(DateTime, nullable=True)
 
-    router_id = Column(Integer, ForeignKey("routers.id"), nullable=True)
+    router_id = Column(Integer, ForeignKey("routers.id"), nullable=True, index=True)
     router = relationship("Router", back_populates="customers")
 
     welcome_popup_last_shown = Column(Date, nullable=True)
@@ -106,6 +131,10 @@ class Customer(Base):
     grace_offer_popup_last_shown = Column(Date, nullable=True)  # day 31–33
     suspended_popup_last_shown = Column(Date, nullable=True)    # optional
 
+    # ✅ when the scheduler must look at this customer again
+    # (day 31, day 34, end of a grace pass, hold_until); NULL = nothing scheduled
+    next_transition_at = Column(DateTime, nullable=True, index=True)
+
 
 # ==================== CUSTOMER NETWORK MODEL ====================
 class CustomerNetwork(Base):
@@ -130,6 +159,10 @@ class CustomerNetwork(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # reports: paid_at ranges, split by method
+        Index("ix_payments_paid_at_method", "paid_at", "method"),
+    )
 
     id = Column(Integer, primary_key=True)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
@@ -142,4 +175,119 @@ class Payment(Base):
     paid_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     # relationship back to customer
-    customer = relationship("Customer", backref="payments")
\ No newline at end of file
+    customer = relationship("Customer", backref="payments")
+
+
+# ==================== ROUTER JOB (OUTBOX) ====================
+class RouterJob(Base):
+    """
+    Pending MikroTik change, written in the same transaction as the
+    customer status change and applied later by the outbox worker.
+    """
+    __tablename__ = "router_jobs"
+
+    id = Column(Integer, primary_key=True)
+    router_id = Column(Integer, ForeignKey("routers.id"), nullable=False, index=True)
+    ip_address = Column(String(50), nullable=False)
+    action = Column(String(20), nullable=False)                 # block / unblock / grace
+
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending / done / failed / superseded
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(255), nullable=True)
+
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    router = relationship("Router", back_populates="jobs")
+
+
+# ==================== ROUTER DRIFT ====================
+class RouterDrift(Base):
+    """
+    Latest mismatch between a router's blocked_users list and the database.
+    Rows for a router are replaced on every drift scan.
+    kind: missing  -> customer should be blocked but is not on the router
+          extra    -> customer is blocked on the router but should be online
+          unknown  -> blocked IP that matches no customer on this router
+    """
+    __tablename__ = "router_drift"
+
+    id = Column(Integer, primary_key=True)
+    router_id = Column(Integer, ForeignKey("routers.id"), nullable=False, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="SET NULL"), nullable=True)
+    ip_address = Column(String(50), nullable=False)
+    kind = Column(String(20), nullable=False)
+    detected_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    repaired = Column(Boolean, nullable=False, default=False)
+
+    router = relationship("Router", back_populates="drift")
+    customer = relationship("Customer")
+
+
+# ==================== ROUTER HEALTH ====================
+class RouterHealthState(Base):
+    """
+    Last published circuit-breaker state of a router (router_health.py).
+    Breakers live in the process that talks to the router (usually the
+    scheduler worker); this row is how the web processes see it.
+    """
+    __tablename__ = "router_health"
+
+    router_id = Column(Integer, ForeignKey("routers.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    state = Column(String(20), nullable=False, default="closed")    # closed / open / half_open
+    consecutive_failures = Column(Integer, nullable=False, default=0)
+    last_success_at = Column(DateTime, nullable=True)
+    last_failure_at = Column(DateTime, nullable=True)
+    last_error = Column(String(255), nullable=True)
+    avg_latency_ms = Column(Float, nullable=True)
+    reported_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    reported_by = Column(String(255), nullable=True)     # host:pid
+
+    router = relationship("Router", back_populates="health")
+
+
+# ==================== SCHEDULER LEASE ====================
+class SchedulerLease(Base):
+    """
+    Leader lease for background jobs: only the holder runs the scheduler
+    jobs. The holder renews expires_at on every heartbeat; once it lapses
+    another process takes over.
+    """
+    __tablename__ = "scheduler_lease"
+
+    name = Column(String(50), primary_key=True)
+    holder = Column(String(255), nullable=False)      # host:pid:random
+    acquired_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    heartbeat_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+
+# ==================== SCHEDULER RUNS ====================
+class SchedulerRun(Base):
+    """
+    Telemetry for one run of a status job
+    (process_due_transitions / daily_status_check).
+    """
+    __tablename__ = "scheduler_runs"
+
+    id = Column(Integer, primary_key=True)
+    job = Column(String(50), nullable=False, index=True)
+    started_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    rows_scanned = Column(Integer, nullable=False, default=0)
+    transitions = Column(JSON, nullable=True)        # {"active->suspended": 12, ...}
+    router_calls = Column(JSON, nullable=True)       # {router_id: {"router", "ok", "skipped", "seconds", "error"}}
+    router_failures = Column(Integer, nullable=False, default=0)
+    router_seconds = Column(Float, nullable=False, default=0)   # sum over routers
+    error = Column(Text, nullable=True)
+
+
+# ==================== SCHEMA MIGRATIONS ====================
+class SchemaMigration(Base):
+    """One row per applied migration (see migrate.py)."""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,310 @@
+"""
+Captive-portal routes: wifi_access and activate_grace.
+
+Registered on the admin app (app.py) as the "portal" blueprint, and also
+served on their own by create_portal_app(), so portal traffic can run in a
+separate worker pool:
+
+    gunicorn "wif_system.portal:create_portal_app()"
+
+The standalone app does not import app.py, so none of the admin routes,
+pandas, openpyxl or flask_apscheduler are loaded in portal workers.
+The decision helpers below are pure and shared with the ASGI version of
+these routes (portal_async.py).
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from flask import Blueprint, Flask, Response, redirect, render_template, request
+
+from billing_state import (
+    MANUAL_STATUSES, PHASE_ACTIVE, PHASE_GRACE_WINDOW, subscription_state, schedule_transition,
+)
+from connections import SessionLocal, get_db
+from enforcement import enqueue_enforcement
+from models import Customer
+from portal_cache import portal_cache, PortalDecision, invalidate_portal
+from portal_markers import marker_buffer
+from single_flight import SingleFlight
+
+portal = Blueprint("portal", __name__)
+
+
+def create_portal_app():
+    """Flask app with only the captive-portal routes."""
+    app = Flask(__name__)
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        SessionLocal.remove()
+
+    app.register_blueprint(portal)
+    return app
+
+
+def popup_due(last_shown, today):
+    return (last_shown is None) or (last_shown != today)
+
+
+DEFAULT_NEXT_URL = "https://google.com"
+
+PortalView = namedtuple(
+    "PortalView",
+    "name ip_address status short_message detailed_message show_popup popup_type popup_message "
+    "show_active_card start_date subscription_end days_left",
+)
+
+
+# ==================== SHARED DECISIONS (sync + async) ====================
+def decide_portal(customer, today, seen):
+    """
+    What the portal shows `customer` today, without side effects.
+    seen: popup/card markers shown but not written yet (they count as written).
+    Returns (view, markers): view.status is the status the rules give,
+    markers the popup/card fields to record as shown.
+    """
+    # ✅ shared billing rules (manual states are kept)
+    state = subscription_state(customer.start_date, customer.grace_pass_date, today, customer.status)
+    start_date = state.start_date
+    subscription_end = state.subscription_end
+    days_left = state.days_left
+
+    markers = {}
+
+    # popup vars
+    show_popup = False
+    popup_type = None
+    popup_message = None
+
+    # ✅ show active card once per billing cycle
+    show_active_card = False
+
+    short_message = ""
+    detailed_message = None
+
+    # ==================== DAY 1–30 (ACTIVE) ====================
+    if state.phase == PHASE_ACTIVE:
+        short_message = f"Your subscription runs from {start_date} to {subscription_end}."
+
+        # ✅ show ACTIVE card only once per cycle
+        if seen.get("active_card_cycle_start", customer.active_card_cycle_start) != start_date:
+            show_active_card = True
+            markers["active_card_cycle_start"] = start_date
+
+        # ✅ day 25–30 popup once per day
+        if state.pre_expiry and popup_due(seen.get("pre_expiry_popup_last_shown", customer.pre_expiry_popup_last_shown), today):
+            show_popup = True
+            popup_type = "pre_expiry"
+            popup_message = (
+                f"Your subscription will expire on <strong>{subscription_end}</strong> "
+                f"({days_left} day(s) left). Please make payment to continue uninterrupted service."
+            )
+            markers["pre_expiry_popup_last_shown"] = today
+
+    # ==================== DAY 31–33 (GRACE OFFER) ====================
+    elif state.phase == PHASE_GRACE_WINDOW:
+        if state.status == "grace":
+            short_message = "Grace activated for today. Please make payment to restore monthly service."
+        else:
+            short_message = "Your subscription has expired."
+
+            # ✅ show grace button popup once per day
+            if popup_due(seen.get("grace_offer_popup_last_shown", customer.grace_offer_popup_last_shown), today):
+                show_popup = True
+                popup_type = "grace_offer"
+                popup_message = (
+                    "Your subscription has expired.<br>"
+                    "Click <strong>GRACE</strong> to continue browsing for today."
+                )
+                markers["grace_offer_popup_last_shown"] = today
+
+    # ==================== DAY 34+ (SUSPENDED) ====================
+    else:
+        short_message = "You have utilised all your grace for the month. Please pay to continue enjoying the internet."
+        detailed_message = f"Hi {customer.name}, your account is suspended. Contact support for help."
+
+    view = PortalView(
+        name=customer.name,
+        ip_address=customer.ip_address,
+        status=state.status,
+        short_message=short_message,
+        detailed_message=detailed_message,
+        show_popup=show_popup,
+        popup_type=popup_type,
+        popup_message=popup_message,
+        show_active_card=show_active_card,
+        start_date=start_date,
+        subscription_end=subscription_end,
+        days_left=days_left,
+    )
+    return view, markers
+
+
+def locked_status(customer, today):
+    """Status the rules give for a row just re-read under its row lock."""
+    return subscription_state(customer.start_date, customer.grace_pass_date, today, customer.status).status
+
+
+def apply_status_change(db, customer, status, markers):
+    """Set the new status (+ markers) and queue its MikroTik job; the caller commits."""
+    customer.status = status
+    for field, value in markers.items():
+        setattr(customer, field, value)
+    enqueue_enforcement(db, customer)  # ✅ applied by the router worker, never on the request
+    schedule_transition(customer)
+
+
+def grace_decision(customer, today):
+    """(status, grace_pass_date) after the customer clicks GRACE."""
+    state = subscription_state(customer.start_date, customer.grace_pass_date, today, customer.status)
+    # ✅ Only allow grace Day 31–33; otherwise the normal rules apply (manual states stay)
+    if state.phase == PHASE_GRACE_WINDOW and customer.status not in MANUAL_STATUSES:
+        return "grace", today
+    return state.status, customer.grace_pass_date
+
+
+def is_passthrough(view):
+    # ✅ ACTIVE/GRACE and NO popup and NO active-card -> straight to next_url
+    return view.status in ("active", "grace") and (not view.show_popup) and (not view.show_active_card)
+
+
+def passthrough_url(next_url):
+    # ✅ avoid loop if next_url mistakenly points back to wifi_access
+    if next_url and "wifi_access" not in next_url:
+        return next_url
+    return None
+
+
+def portal_context(view, next_url):
+    return dict(
+        customer=view,
+        status=view.status,
+        short_message=view.short_message,
+        detailed_message=view.detailed_message,
+        show_popup=view.show_popup,
+        popup_type=view.popup_type,
+        popup_message=view.popup_message,
+        show_active_card=view.show_active_card,
+        start_date=view.start_date,
+        subscription_end=view.subscription_end,
+        days_left=view.days_left,
+        next_url=next_url,
+        current_year=datetime.utcnow().year,
+    )
+
+
+def redirect_page(next_url):
+    # ✅ IMPORTANT: captive portals sometimes ignore 302 redirects
+    # So we return a small HTML page that forces redirect.
+    return f"""
+    <!doctype html>
+    <html>
+    <head>
+      <meta charset="utf-8">
+      <meta http-equiv="refresh" content="0;url={next_url}">
+      <script>window.location.replace("{next_url}");</script>
+    </head>
+    <body>
+      Redirecting...
+      <a href="{next_url}">Continue</a>
+    </body>
+    </html>
+    """
+
+
+# ==================== ROUTES ====================
+@portal.route("/activate_grace/<ip_address>", methods=["GET", "POST"])
+def activate_grace(ip_address):
+    next_url = request.args.get("next") or DEFAULT_NEXT_URL
+
+    with get_db() as db:
+        customer = (
+            db.query(Customer)
+            .filter_by(ip_address=ip_address)
+            .first()
+        )
+        if not customer:
+            return "Customer not found", 404
+
+        today = datetime.utcnow().date()
+        old_status = customer.status
+        customer.status, customer.grace_pass_date = grace_decision(customer, today)
+
+        # ✅ MikroTik via outbox (no router I/O on the portal request)
+        if customer.status != old_status:
+            enqueue_enforcement(db, customer)
+        schedule_transition(customer)
+        db.commit()
+        invalidate_portal(ip_address)
+
+    return Response(redirect_page(next_url), mimetype="text/html")
+
+
+def _portal_passthrough(next_url):
+    url = passthrough_url(next_url)
+    return redirect(url) if url else ("", 204)
+
+
+# one decision per IP at a time in this process; concurrent probes share it
+portal_flights = SingleFlight()
+
+
+def portal_view(ip_address, today):
+    """
+    What the portal shows this IP today. Writes only a real status change
+    (now) and popup/card markers (deferred). None = unknown IP.
+    """
+    with get_db() as db:
+        customer = (
+            db.query(Customer)
+            .filter_by(ip_address=ip_address)
+            .first()
+        )
+        if not customer:
+            return None
+
+        # ✅ decide read-only; markers shown-but-not-yet-written count as written
+        cycle_start = customer.start_date  # markers belong to the cycle they were decided for
+        view, markers = decide_portal(customer, today, marker_buffer.pending(customer.id, cycle_start))
+
+        if view.status != customer.status:
+            # ✅ real status change: re-check under a row lock, so a burst
+            # spread over several workers writes it (and its MikroTik job) once
+            db.refresh(customer, with_for_update=True)
+            status = locked_status(customer, today)
+            if status != customer.status:
+                if customer.start_date != cycle_start:
+                    markers = {}  # paid / edited meanwhile: new cycle
+                apply_status_change(db, customer, status, markers)
+                db.commit()
+            else:
+                db.rollback()  # another worker got there first
+                if markers:
+                    marker_buffer.mark(customer.id, cycle_start, **markers)
+            view = view._replace(status=status)
+        elif markers:
+            # ✅ popup / card markers only: batched and written later
+            marker_buffer.mark(customer.id, cycle_start, **markers)
+
+        return view
+
+
+@portal.route("/wifi_access/<ip_address>")
+def wifi_access(ip_address):
+    # ✅ must be INSIDE the route
+    next_url = request.args.get("next") or DEFAULT_NEXT_URL
+    today = datetime.utcnow().date()
+
+    # ✅ repeat probe with nothing to show -> answer without touching the DB
+    if portal_cache.get(ip_address, today):
+        return _portal_passthrough(next_url)
+
+    view = portal_flights.do(ip_address, portal_view, ip_address, today)
+    if view is None:
+        return "Customer not found", 404
+
+    if is_passthrough(view):
+        portal_cache.put(ip_address, PortalDecision(view.status, view.start_date, view.subscription_end, today))
+        return _portal_passthrough(next_url)
+
+    return render_template("customer/wifi_home.html", **portal_context(view, next_url))
@@ -0,0 +1,166 @@
+"""
+ASGI (Starlette) version of the captive-portal routes for peak probe traffic:
+
+    uvicorn wif_system.portal_async:app --host 0.0.0.0 --port 8000 --workers 4
+
+Same URLs, template and decisions as the portal blueprint (portal.py
+decide_portal / grace_decision / apply_status_change). Only the I/O
+differs: an async driver (aiomysql) and AsyncSession. While one probe waits
+on MySQL, the worker keeps answering others instead of tying up a thread per
+request. Router changes go to the router_jobs outbox in the same commit and
+the scheduler worker applies them; nothing talks to a router on the request.
+
+Popup markers use the same deferred MarkerBuffer as the sync app; its
+flush thread writes through the sync engine, off the event loop.
+"""
+import contextlib
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+
+from billing_state import schedule_transition
+from connections import DATABASE_URL
+from enforcement import enqueue_enforcement
+from models import Customer
+from portal import (
+    DEFAULT_NEXT_URL, decide_portal, locked_status, apply_status_change, grace_decision,
+    is_passthrough, passthrough_url, portal_context, redirect_page,
+)
+from portal_cache import portal_cache, PortalDecision, invalidate_portal
+from portal_markers import marker_buffer
+from single_flight import AsyncSingleFlight
+
+# sync driver -> async driver for the same database
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",     # bench_portal.py's seeded database
+}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    echo=False,
+    pool_pre_ping=True,
+    pool_recycle=280,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+templates.env.globals["get_flashed_messages"] = lambda **kwargs: []  # base.html; no sessions here
+
+
+def _passthrough(next_url):
+    url = passthrough_url(next_url)
+    return RedirectResponse(url, status_code=302) if url else Response(status_code=204)
+
+
+async def _customer_by_ip(db, ip_address):
+    result = await db.execute(select(Customer).where(Customer.ip_address == ip_address).limit(1))
+    return result.scalars().first()
+
+
+# ==================== WIFI ACCESS ====================
+portal_flights = AsyncSingleFlight()
+
+
+async def portal_view(ip_address, today):
+    """Async twin of portal.portal_view()."""
+    async with AsyncSessionLocal() as db:
+        customer = await _customer_by_ip(db, ip_address)
+        if customer is None:
+            return None
+
+        cycle_start = customer.start_date  # markers belong to the cycle they were decided for
+        view, markers = decide_portal(customer, today, marker_buffer.pending(customer.id, cycle_start))
+
+        if view.status != customer.status:
+            # ✅ real status change: re-check under a row lock (other workers)
+            await db.refresh(customer, with_for_update=True)
+            status = locked_status(customer, today)
+            if status != customer.status:
+                if customer.start_date != cycle_start:
+                    markers = {}  # paid / edited meanwhile: new cycle
+                apply_status_change(db, customer, status, markers)
+                await db.commit()
+            else:
+                await db.rollback()
+                if markers:
+                    marker_buffer.mark(customer.id, cycle_start, **markers)
+            view = view._replace(status=status)
+        elif markers:
+            marker_buffer.mark(customer.id, cycle_start, **markers)
+
+        return view
+
+
+async def wifi_access(request):
+    ip_address = request.path_params["ip_address"]
+    next_url = request.query_params.get("next") or DEFAULT_NEXT_URL
+    today = datetime.utcnow().date()
+
+    if portal_cache.get(ip_address, today):
+        return _passthrough(next_url)
+
+    view = await portal_flights.do(ip_address, portal_view, ip_address, today)
+    if view is None:
+        return PlainTextResponse("Customer not found", status_code=404)
+
+    if is_passthrough(view):
+        portal_cache.put(ip_address, PortalDecision(view.status, view.start_date, view.subscription_end, today))
+        return _passthrough(next_url)
+
+    return templates.TemplateResponse(request, "customer/wifi_home.html", portal_context(view, next_url))
+
+
+# ==================== ACTIVATE GRACE ====================
+async def activate_grace(request):
+    ip_address = request.path_params["ip_address"]
+    next_url = request.query_params.get("next") or DEFAULT_NEXT_URL
+
+    async with AsyncSessionLocal() as db:
+        customer = await _customer_by_ip(db, ip_address)
+        if customer is None:
+            return PlainTextResponse("Customer not found", status_code=404)
+
+        today = datetime.utcnow().date()
+        old_status = customer.status
+        customer.status, customer.grace_pass_date = grace_decision(customer, today)
+
+        if customer.status != old_status:
+            enqueue_enforcement(db, customer)  # ✅ outbox row, same commit
+        schedule_transition(customer)
+        await db.commit()
+    invalidate_portal(ip_address)
+
+    return HTMLResponse(redirect_page(next_url))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    marker_buffer.flush()
+    await async_engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        # same endpoint names as the Flask blueprint (the template uses them)
+        Route("/wifi_access/{ip_address}", wifi_access, name="portal.wifi_access"),
+        Route("/activate_grace/{ip_address}", activate_grace, methods=["GET", "POST"], name="portal.activate_grace"),
+    ],
+    lifespan=lifespan,
+)
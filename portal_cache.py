@@ -0,0 +1,78 @@
+"""
+In-process cache of captive-portal decisions, keyed by customer IP.
+
+Only "pass-through" decisions are cached: the customer is active / on a
+grace pass and has no popup or active card due, so the portal just
+redirects. Repeat probes are then answered without touching MySQL.
+
+An entry lives at most PORTAL_CACHE_TTL seconds and never past the UTC
+day it was made for (popups and grace passes are per day). Routes that
+change a customer's status call invalidate_portal(ip). Each process has its
+own cache, so a change made in another worker shows up here within the TTL.
+Access itself is enforced by the router address lists, not the portal.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+PORTAL_CACHE_SIZE = 20000   # entries (LRU beyond that)
+PORTAL_CACHE_TTL = 60       # seconds
+
+PortalDecision = namedtuple("PortalDecision", "status start_date subscription_end day")
+
+
+class DecisionCache:
+    def __init__(self, maxsize=PORTAL_CACHE_SIZE, ttl=PORTAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ip -> (decision, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ip_address, today):
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is not None:
+                decision, expires_at = entry
+                if expires_at > time.monotonic() and decision.day == today:
+                    self._entries.move_to_end(ip_address)
+                    self.hits += 1
+                    return decision
+                del self._entries[ip_address]
+            self.misses += 1
+            return None
+
+    def put(self, ip_address, decision):
+        with self._lock:
+            self._entries[ip_address] = (decision, time.monotonic() + self.ttl)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *ip_addresses):
+        with self._lock:
+            for ip_address in ip_addresses:
+                if ip_address:
+                    self._entries.pop(ip_address, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+            }
+
+
+portal_cache = DecisionCache()
+
+
+def invalidate_portal(*ip_addresses):
+    portal_cache.invalidate(*ip_addresses)
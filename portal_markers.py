@@ -0,0 +1,139 @@
+"""
+Deferred writes for the captive portal's "already shown" markers.
+
+wifi_access shows the active card once per cycle and each popup once per
+day. Recording that used to cost a row write + commit on the probe itself.
+Now the portal calls marker_buffer.mark(); a background thread writes the
+buffered markers every FLUSH_SECONDS (sooner once FLUSH_BATCH customers
+are waiting), one executemany UPDATE per column.
+
+Until a flush lands, wifi_access overlays pending() on what it read, so the
+same process does not show a popup twice. Another worker may show it once
+more in that window, which is harmless.
+
+Every marker carries the start_date (cycle) it was decided for, and the
+flush only updates rows still on that cycle. mark_paid / edit_customer may
+run in another process (portal workers are separate gunicorn / uvicorn
+processes), so a stale buffered marker must not overwrite their reset.
+"""
+import atexit
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+
+from connections import SessionLocal
+from models import Customer
+
+FLUSH_SECONDS = 5
+FLUSH_BATCH = 500   # customers waiting -> flush early
+
+MARKER_FIELDS = (
+    "active_card_cycle_start",
+    "pre_expiry_popup_last_shown",
+    "grace_offer_popup_last_shown",
+)
+
+
+class MarkerBuffer:
+    def __init__(self, flush_seconds=FLUSH_SECONDS, flush_batch=FLUSH_BATCH):
+        self.flush_seconds = flush_seconds
+        self.flush_batch = flush_batch
+        self._pending = {}          # customer_id -> (cycle_start, {field: value})
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.last_flush = None
+
+    # ---------- portal side ----------
+    def mark(self, customer_id, cycle_start, **fields):
+        """Buffer markers decided for the customer's start_date `cycle_start`."""
+        unknown = set(fields) - set(MARKER_FIELDS)
+        if unknown:
+            raise ValueError(f"not a portal marker: {', '.join(sorted(unknown))}")
+        with self._lock:
+            entry = self._pending.get(customer_id)
+            if entry is None or entry[0] != cycle_start:
+                entry = self._pending[customer_id] = (cycle_start, {})  # older cycle's markers are void
+            entry[1].update(fields)
+            waiting = len(self._pending)
+        self._ensure_thread()
+        if waiting >= self.flush_batch:
+            self._wake.set()
+
+    def pending(self, customer_id, cycle_start):
+        """Unwritten markers for this cycle ({} if buffered for another one)."""
+        with self._lock:
+            entry = self._pending.get(customer_id)
+            if entry is None or entry[0] != cycle_start:
+                return {}
+            return dict(entry[1])
+
+    def discard(self, customer_id):
+        """Drop unwritten markers (e.g. mark_paid just reset them)."""
+        with self._lock:
+            self._pending.pop(customer_id, None)
+
+    # ---------- writer side ----------
+    def flush(self):
+        """Write everything buffered so far. Returns the number of customers written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            by_field = {}
+            for customer_id, (cycle_start, fields) in batch.items():
+                for field, value in fields.items():
+                    by_field.setdefault(field, []).append({"_id": customer_id, "_cycle": cycle_start, "value": value})
+
+            db = SessionLocal()
+            try:
+                table = Customer.__table__
+                for field, rows in by_field.items():
+                    # ✅ only while the row is still on the cycle the marker was decided for
+                    stmt = (
+                        update(table)
+                        .where(table.c.id == bindparam("_id"),
+                               table.c.start_date.is_not_distinct_from(bindparam("_cycle")))
+                        .values({field: bindparam("value")})
+                    )
+                    db.execute(stmt, rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                # put them back unless the portal marked something newer meanwhile
+                with self._lock:
+                    for customer_id, (cycle_start, fields) in batch.items():
+                        current = self._pending.setdefault(customer_id, (cycle_start, {}))
+                        if current[0] != cycle_start:
+                            continue
+                        for field, value in fields.items():
+                            current[1].setdefault(field, value)
+                print(f"⚠️ Portal marker flush failed ({len(batch)} customers): {e}")
+                return 0
+            finally:
+                db.close()
+
+            self.last_flush = datetime.utcnow()
+            return len(batch)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="portal-markers", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+marker_buffer = MarkerBuffer()
+atexit.register(marker_buffer.flush)
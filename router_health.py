@@ -0,0 +1,91 @@
+"""
+Router circuit-breaker state shared between processes (router_health table).
+
+Each process keeps its own breakers (mikrotik_helper.pool.breaker). Router
+work runs in the scheduler worker, while the routers page is served by the
+web workers, so the page reads the published rows instead of its own memory.
+
+    publish_router_health()          # every PUBLISH_SECONDS in start_scheduler,
+                                     # and after web routes that call a router
+    health = load_router_health(db)  # {router_id: {...}} for the routers page
+    router_retry_in(db, router_id)   # seconds the router is still marked down
+
+Only entries that changed since this process last published are written.
+"""
+import math
+import os
+import socket
+import threading
+from datetime import datetime
+
+from connections import SessionLocal
+from mikrotik_helper import router_health, pool
+from models import Router, RouterHealthState
+
+PUBLISH_SECONDS = 15
+
+_REPORTER = f"{socket.gethostname()}:{os.getpid()}"
+_published = {}     # router_id -> changed_at last written by this process
+_publish_lock = threading.Lock()
+
+_FIELDS = ("state", "consecutive_failures", "last_success_at", "last_failure_at", "last_error", "avg_latency_ms")
+
+
+def publish_router_health():
+    """Write this process's changed breaker entries; returns how many rows were written."""
+    with _publish_lock:
+        changed = {
+            router_id: health for router_id, health in router_health().items()
+            if health["changed_at"] and _published.get(router_id) != health["changed_at"]
+        }
+        if not changed:
+            return 0
+
+        db = SessionLocal()
+        try:
+            # a router deleted meanwhile would fail the foreign key
+            existing = {router_id for (router_id,) in db.query(Router.id).filter(Router.id.in_(list(changed)))}
+            now = datetime.utcnow()
+            for router_id in existing:
+                health = changed[router_id]
+                db.merge(RouterHealthState(
+                    router_id=router_id,
+                    reported_at=now,
+                    reported_by=_REPORTER,
+                    **{field: health[field] for field in _FIELDS},
+                ))
+            db.commit()
+            _published.update((router_id, health["changed_at"]) for router_id, health in changed.items())
+            return len(existing)
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Could not publish router health: {e}")
+            return 0
+        finally:
+            db.close()
+
+
+def load_router_health(db):
+    """{router_id: dict} of the last published state of every router."""
+    return {
+        row.router_id: {field: getattr(row, field) for field in _FIELDS + ("reported_at", "reported_by")}
+        for row in db.query(RouterHealthState)
+    }
+
+
+def router_retry_in(db, router_id):
+    """
+    Seconds until the router may be called again (0 = go ahead). This
+    process's breaker decides once it has history for the router; until
+    then the published row (usually the worker's breaker) does.
+    """
+    breaker = pool.breaker
+    if router_id in router_health():
+        return math.ceil(breaker.retry_in(router_id)) if breaker.is_open(router_id) else 0
+
+    row = db.get(RouterHealthState, router_id)
+    if row is None or row.state != "open" or row.last_failure_at is None:
+        return 0
+    # the publishing breaker opened the circuit at its last failure
+    remaining = breaker.open_seconds - (datetime.utcnow() - row.last_failure_at).total_seconds()
+    return max(0, math.ceil(remaining))
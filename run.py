@@ -1,4 +1,6 @@
 from waitress import serve
-from app import app  
+from app import app, start_scheduler
+
 if __name__ == "__main__":
+    start_scheduler()  # single-process server: also runs the background jobs
     serve(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,108 @@
+"""
+Scheduler run telemetry (scheduler_runs table).
+
+    with recorded_run("daily_status_check") as run:
+        run["rows_scanned"] = ...
+        run["changes"] = [StatusChange, ...]
+        run["routers"] = fan_out(...) results
+
+One row per run: start/end, rows scanned, transitions by type, per-router
+call timings and failures. A run that raises is recorded with its error.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from connections import SessionLocal
+from models import SchedulerRun
+
+KEEP_RUNS_DAYS = 30
+
+
+def _router_calls(routers):
+    return {
+        str(router_id): {
+            "router": outcome.get("router"),
+            "ok": outcome.get("ok"),
+            "skipped": bool(outcome.get("skipped")),
+            "seconds": outcome.get("seconds") or 0,
+            "error": outcome.get("error"),
+        }
+        for router_id, outcome in routers.items()
+    }
+
+
+def save_run(job, started_at, run, error=None):
+    """Write one scheduler_runs row (own session: the job's may be unusable)."""
+    calls = _router_calls(run.get("routers") or {})
+    transitions = Counter(
+        f"{change.old_status or 'none'}->{change.new_status}" for change in run.get("changes") or ()
+    )
+    db = SessionLocal()
+    try:
+        db.add(SchedulerRun(
+            job=job,
+            started_at=started_at,
+            finished_at=datetime.utcnow(),
+            rows_scanned=run.get("rows_scanned") or 0,
+            transitions=dict(transitions),
+            router_calls=calls,
+            router_failures=sum(1 for call in calls.values() if not call["ok"]),
+            router_seconds=round(sum(call["seconds"] for call in calls.values()), 3),
+            error=error,
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Could not record scheduler run ({job}): {e}")
+    finally:
+        db.close()
+
+
+@contextmanager
+def recorded_run(job):
+    """Record the run on exit unless the body set run["skip"] (nothing to do)."""
+    run = {"rows_scanned": 0, "changes": [], "routers": {}, "skip": False}
+    started_at = datetime.utcnow()
+    try:
+        yield run
+    except Exception as e:
+        save_run(job, started_at, run, error=str(e)[:2000])
+        raise
+    if not run["skip"]:
+        save_run(job, started_at, run)
+
+
+def prune_runs(db, keep_days=KEEP_RUNS_DAYS):
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    deleted = db.query(SchedulerRun).filter(SchedulerRun.started_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def recent_runs(db, limit=10):
+    return db.query(SchedulerRun).order_by(SchedulerRun.started_at.desc()).limit(limit).all()
+
+
+def slowest_routers(db, hours=24, limit=5):
+    """Per-router call count, average/max seconds and failures over recent runs."""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    stats = {}
+    rows = db.query(SchedulerRun.router_calls).filter(SchedulerRun.started_at >= since).all()
+    for (calls,) in rows:
+        for router_id, call in (calls or {}).items():
+            if call.get("skipped"):
+                continue
+            entry = stats.setdefault(router_id, {
+                "router": call.get("router"), "calls": 0, "failures": 0,
+                "total_seconds": 0.0, "max_seconds": 0.0,
+            })
+            entry["calls"] += 1
+            entry["failures"] += 0 if call.get("ok") else 1
+            entry["total_seconds"] += call.get("seconds") or 0
+            entry["max_seconds"] = max(entry["max_seconds"], call.get("seconds") or 0)
+
+    for entry in stats.values():
+        entry["avg_seconds"] = round(entry["total_seconds"] / entry["calls"], 3)
+        entry["total_seconds"] = round(entry["total_seconds"], 3)
+    return sorted(stats.values(), key=lambda entry: entry["total_seconds"], reverse=True)[:limit]
@@ -0,0 +1,78 @@
+"""
+Per-key request coalescing ("single flight") within one process.
+
+When several threads ask for the same key at once, the first one runs the
+function and the others wait for its result instead of repeating the
+work. Used by wifi_access: a phone joining Wi-Fi fires a burst of portal
+probes from one IP, and only one of them should read and write the row.
+SingleFlight is for threads, AsyncSingleFlight for one asyncio event loop.
+"""
+import asyncio
+import threading
+
+WAIT_SECONDS = 5    # followers give up waiting after this and run the call themselves
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, wait_seconds=WAIT_SECONDS):
+        self.wait_seconds = wait_seconds
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0     # calls answered from another thread's result
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.wait_seconds):
+                if call.error is not None:
+                    raise call.error
+                with self._lock:
+                    self.shared += 1
+                return call.result
+            # leader is stuck; do the work ourselves
+            return fn(*args, **kwargs)
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._tasks = {}
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield: a caller that disconnects does not cancel the others' result
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
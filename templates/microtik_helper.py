@@ -1,4 +1,21 @@
+import time
+
 from librouteros import connect
+from librouteros.exceptions import TrapError, MultiTrapError
+
+# Optional services whose sessions are dropped when a customer is blocked
+SESSION_PATHS = {
+    "hotspot": "/ip/hotspot/active",
+    "dhcp": "/ip/dhcp-server/lease",
+}
+# only dynamic leases: a static binding is what keeps a customer on their IP
+SESSION_FILTERS = {
+    "dhcp": {"dynamic": "true"},
+}
+MISSING_SERVICE_TTL = 3600  # seconds before probing a router for a missing service again
+KICK_ON_BLOCK = False       # opt-in: drop hotspot sessions / dynamic DHCP leases of newly blocked IPs
+
+_missing_services = {}  # (router key, service) -> time.monotonic() when found missing
 
 
 def get_mikrotik_connection(host, user, password, port=8728, timeout=10):
@@ -20,6 +37,68 @@ def get_mikrotik_connection(host, user, password, port=8728, timeout=10):
         return None
 
 
+def _find(api, path, **where):
+    """print with RouterOS ?query words, e.g. _find(api, "/ip/hotspot/active", address=ip)."""
+    words = tuple(f"?={key}={value}" for key, value in where.items())
+    return list(api.rawCmd(f"{path}/print", *words))
+
+
+def _remove(api, path, rows):
+    """One remove per entry; an entry already gone counts as removed."""
+    for row in rows:
+        try:
+            tuple(api(cmd=f"{path}/remove", **{".id": row[".id"]}))
+        except TrapError as e:
+            if "no such item" not in str(e):
+                raise
+
+
+def _router_key(router):
+    return getattr(router, "id", None) or (router.ip_address, getattr(router, "port", 8728))
+
+
+def _service_missing(router, service):
+    seen = _missing_services.get((_router_key(router), service))
+    if seen is None:
+        return False
+    if time.monotonic() - seen > MISSING_SERVICE_TTL:
+        _missing_services.pop((_router_key(router), service), None)
+        return False
+    return True
+
+
+def _kick_sessions(api, router, ip_addresses, services=("hotspot", "dhcp")):
+    """
+    Drop hotspot sessions / dynamic DHCP leases for these IPs (static
+    leases are left alone).
+    Each table is printed once (filtered for a single IP) and indexed by
+    address; a router without the service is remembered so it isn't probed
+    on every call. A failed remove is only logged: the block itself is done.
+    """
+    ips = set(ip_addresses)
+    if not ips:
+        return
+    for service in services:
+        if _service_missing(router, service):
+            continue
+        path = SESSION_PATHS[service]
+        filters = SESSION_FILTERS.get(service, {})
+        try:
+            if len(ips) == 1:
+                rows = _find(api, path, address=next(iter(ips)), **filters)
+            else:
+                words = tuple(f"?={key}={value}" for key, value in filters.items())
+                rows = list(api.rawCmd(f"{path}/print", "=.proplist=.id,address", *words))
+        except (TrapError, MultiTrapError):
+            # service not used on this router
+            _missing_services[(_router_key(router), service)] = time.monotonic()
+            continue
+        try:
+            _remove(api, path, [r for r in rows if r.get("address") in ips])
+        except (TrapError, MultiTrapError) as e:
+            print(f"⚠️ Could not drop {service} sessions on {router.ip_address}: {e}")
+
+
 def block_ip(ip_address, router):
     """
     Block customer by adding IP to address-list 'blocked_users'.
@@ -37,42 +116,20 @@ def block_ip(ip_address, router):
 
     try:
         # ✅ 1) Add IP to blocked_users if not already there
-        existing = list(api(
-            cmd="/ip/firewall/address-list/print",
-            query={"address": ip_address, "list": "blocked_users"}
-        ))
+        existing = _find(api, "/ip/firewall/address-list", address=ip_address, list="blocked_users")
 
         if not existing:
-            api(
+            tuple(api(
                 cmd="/ip/firewall/address-list/add",
                 address=ip_address,
                 list="blocked_users",
                 comment="Blocked by Flask"
-            )
-
-        # ✅ 2) OPTIONAL: Disconnect Hotspot session (only if hotspot exists)
-        try:
-            active_users = list(api(
-                cmd="/ip/hotspot/active/print",
-                query={"address": ip_address}
             ))
-            for u in active_users:
-                api(cmd="/ip/hotspot/active/remove", **{".id": u[".id"]})
-        except Exception:
-            # Hotspot not used on this router; ignore safely
-            pass
 
-        # ✅ 3) OPTIONAL: Remove DHCP lease (only if DHCP server exists)
-        try:
-            leases = list(api(
-                cmd="/ip/dhcp-server/lease/print",
-                query={"address": ip_address}
-            ))
-            for lease in leases:
-                api(cmd="/ip/dhcp-server/lease/remove", **{".id": lease[".id"]})
-        except Exception:
-            # DHCP server not used on this router; ignore safely
-            pass
+            # ✅ 2+3) OPTIONAL: Disconnect Hotspot session / remove dynamic DHCP lease
+            # (routers without hotspot/DHCP are remembered and skipped)
+            if KICK_ON_BLOCK:
+                _kick_sessions(api, router, [ip_address])
 
         print(f"🔒 Blocked {ip_address} on router {router.ip_address}")
         return True
@@ -81,6 +138,9 @@ def block_ip(ip_address, router):
         print(f"⚠️ Error blocking {ip_address} on {router.ip_address}: {e}")
         return False
 
+    finally:
+        api.close()
+
 
 def unblock_ip(ip_address, router):
     """
@@ -97,23 +157,11 @@ def unblock_ip(ip_address, router):
 
     try:
         # ✅ 1) Remove from blocked_users address list
-        rules = list(api(
-            cmd="/ip/firewall/address-list/print",
-            query={"address": ip_address, "list": "blocked_users"}
-        ))
-        for r in rules:
-            api(cmd="/ip/firewall/address-list/remove", **{".id": r[".id"]})
+        rules = _find(api, "/ip/firewall/address-list", address=ip_address, list="blocked_users")
+        _remove(api, "/ip/firewall/address-list", rules)
 
         # ✅ 2) OPTIONAL: Disconnect Hotspot session (only if hotspot exists)
-        try:
-            active_users = list(api(
-                cmd="/ip/hotspot/active/print",
-                query={"address": ip_address}
-            ))
-            for u in active_users:
-                api(cmd="/ip/hotspot/active/remove", **{".id": u[".id"]})
-        except Exception:
-            pass
+        _kick_sessions(api, router, [ip_address], services=("hotspot",))
 
         print(f"✅ Unblocked {ip_address} on router {router.ip_address}")
         return True
@@ -122,3 +170,51 @@ def unblock_ip(ip_address, router):
         print(f"⚠️ Error unblocking {ip_address} on {router.ip_address}: {e}")
         return False
 
+    finally:
+        api.close()
+
+
+def block_ips(ip_addresses, router):
+    """
+    Batch version of block_ip: one connection, one print of blocked_users,
+    one print each of hotspot active / DHCP leases, then direct removes.
+    """
+    ips = {ip.strip() for ip in ip_addresses if ip and ip.strip()}
+    if not ips:
+        return True
+
+    api = get_mikrotik_connection(
+        router.ip_address,
+        router.username,
+        router.password,
+        getattr(router, "port", 8728)
+    )
+    if not api:
+        return False
+
+    try:
+        listed = {
+            r.get("address")
+            for r in api.rawCmd("/ip/firewall/address-list/print", "=.proplist=address", "?=list=blocked_users")
+        }
+        added = sorted(ips - listed)
+        for ip_address in added:
+            tuple(api(
+                cmd="/ip/firewall/address-list/add",
+                address=ip_address,
+                list="blocked_users",
+                comment="Blocked by Flask"
+            ))
+
+        if KICK_ON_BLOCK:
+            _kick_sessions(api, router, added)
+
+        print(f"🔒 Blocked {len(ips)} IP(s) on router {router.ip_address}")
+        return True
+
+    except Exception as e:
+        print(f"⚠️ Error blocking {len(ips)} IP(s) on {router.ip_address}: {e}")
+        return False
+
+    finally:
+        api.close()
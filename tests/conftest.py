@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# never let a test reach the MySQL database from connections.py
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='wif_tests_'), 'wif.sqlite')}"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+"""
+Admin routes through the Flask test client, on the SQLite database from conftest.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import mikrotik_helper as M
+from app import app
+from connections import Base, SessionLocal, engine
+from fake_routeros import FakeRouterOS
+from models import Branch, Customer, Router, RouterHealthState
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    yield session
+    SessionLocal.remove()
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def admin(db):
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session["user_id"] = 1
+        flask_session["role"] = "admin"
+    return client
+
+
+def add_router(db, ip_address="10.0.0.1", port=8728):
+    branch = Branch(name="Nairobi")
+    db.add(branch)
+    db.flush()
+    router = Router(branch_id=branch.id, ip_address=ip_address, port=port, username="u", password="p")
+    db.add(router)
+    db.flush()
+    return router
+
+
+def flashes(client):
+    with client.session_transaction() as flask_session:
+        return [message for _, message in flask_session.get("_flashes", [])]
+
+
+def add_customer(db, **fields):
+    router = add_router(db)
+    customer = Customer(router_id=router.id, **fields)
+    db.add(customer)
+    db.commit()
+    return customer
+
+
+# ==================== DASHBOARD ====================
+def test_admin_dashboard_counts(db, admin):
+    add_customer(db, name="Jane", ip_address="10.1.1.1", status="active", start_date=datetime.utcnow())
+
+    response = admin.get("/admin_dashboard")
+
+    assert response.status_code == 200
+    assert "Expiring in 5 days or less: <b>0</b>" in response.get_data(as_text=True)
+
+
+# ==================== GRACE POPUP ====================
+@pytest.mark.parametrize("grace_days", [None, 0, 2])
+def test_grace_popup_get_renders_and_writes_nothing(db, admin, grace_days):
+    customer = add_customer(db, name="Jane", ip_address="10.1.1.1", status="suspended")
+    # an explicit UPDATE: the column default would turn grace_days=None into 0 on insert
+    db.query(Customer).filter_by(id=customer.id).update({Customer.grace_days: grace_days})
+    db.commit()
+
+    response = admin.get("/grace_popup/10.1.1.1")
+
+    assert response.status_code == 200
+    assert ("Current grace period: <strong>2 days</strong>" in response.get_data(as_text=True)) == (grace_days == 2)
+    db.expire_all()
+    assert db.get(Customer, customer.id).grace_days == grace_days
+
+
+# ==================== TEST ROUTER ====================
+@pytest.fixture
+def dead_router(db):
+    """A router row whose port has nothing listening."""
+    fake = FakeRouterOS().start()
+    fake.stop()
+    router = add_router(db, ip_address=fake.host, port=fake.port)
+    db.commit()
+    yield router
+    M.invalidate_router(router.id)
+
+
+def publish_open_circuit(db, router, failed_seconds_ago):
+    db.add(RouterHealthState(
+        router_id=router.id, state="open", consecutive_failures=M.BREAKER_FAILURE_THRESHOLD,
+        last_failure_at=datetime.utcnow() - timedelta(seconds=failed_seconds_ago),
+        reported_by="worker:1",
+    ))
+    db.commit()
+
+
+def test_test_router_uses_the_published_open_circuit(db, admin, dead_router):
+    publish_open_circuit(db, dead_router, failed_seconds_ago=10)
+
+    admin.get(f"/test_router/{dead_router.id}")
+
+    [message] = flashes(admin)
+    assert "is marked down after repeated failures" in message
+    assert dead_router.id not in M.router_health()   # no connection was attempted
+
+
+def test_test_router_probes_once_the_published_open_period_is_over(db, admin, dead_router):
+    publish_open_circuit(db, dead_router, failed_seconds_ago=M.BREAKER_OPEN_SECONDS + 1)
+
+    admin.get(f"/test_router/{dead_router.id}")
+
+    [message] = flashes(admin)
+    assert "Failed to connect" in message
+    assert M.router_health()[dead_router.id]["consecutive_failures"] == 1
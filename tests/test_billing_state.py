@@ -0,0 +1,71 @@
+"""
+billing_outlook's SQL buckets against the per-customer rules (subscription_state).
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from billing_state import (
+    CYCLE_DAYS, MANUAL_STATUSES, billing_outlook, schedule_transition, subscription_state,
+)
+from connections import Base
+from models import Customer
+
+NOW = datetime(2026, 10, 17, 9, 30)
+TODAY = NOW.date()
+STATUSES = ("active", "grace", "suspended", "manually_suspended", "on_hold", "pending_router", None)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'outlook.sqlite'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def expected_outlook(customers, soon_days=5):
+    outlook = {"total": len(customers), "expiring_soon": 0, "grace_window": 0, "expired": 0}
+    for customer in customers:
+        if customer.status in MANUAL_STATUSES:
+            continue
+        state = subscription_state(customer.start_date, customer.grace_pass_date, TODAY)
+        outlook["expiring_soon"] += state.phase == "active" and state.days_left <= soon_days
+        outlook["grace_window"] += state.phase == "grace_window"
+        outlook["expired"] += state.phase == "expired"
+    return outlook
+
+
+def test_outlook_matches_the_rules_for_every_cycle_day(db):
+    customers = []
+    # every day of the cycle and beyond, at midnight and late in the day, with each status
+    for days_ago in list(range(0, CYCLE_DAYS + 6)) + [None]:
+        for hour in (0, 23):
+            for status in STATUSES:
+                start = None if days_ago is None else datetime(TODAY.year, TODAY.month, TODAY.day, hour) - timedelta(days=days_ago)
+                customers.append(Customer(start_date=start, status=status or "null", grace_pass_date=TODAY))
+    db.add_all(customers)
+    # an explicit UPDATE: the column default would turn status=None into "active" on insert
+    db.query(Customer).filter_by(status="null").update({Customer.status: None})
+    db.commit()
+
+    outlook = billing_outlook(db, today=TODAY, now=NOW)
+
+    assert {key: outlook[key] for key in ("total", "expiring_soon", "grace_window", "expired")} \
+        == expected_outlook(db.query(Customer).all())
+    assert outlook["by_status"] == {status: len(customers) // len(STATUSES) for status in STATUSES}
+
+
+def test_out_of_sync_counts_customers_due_for_the_scheduler(db):
+    in_line = Customer(status="active", start_date=NOW - timedelta(days=3))
+    out_of_line = Customer(status="active", start_date=NOW - timedelta(days=40))
+    for customer in (in_line, out_of_line):
+        schedule_transition(customer, NOW)
+    db.add_all([in_line, out_of_line])
+    db.commit()
+
+    assert billing_outlook(db, now=NOW)["out_of_sync"] == 1
@@ -0,0 +1,170 @@
+"""
+customer_import against a SQLite session: pre-validation (UniquenessIndex),
+the savepoint row-by-row fallback and the bulk-insert id paths.
+"""
+import csv
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import customer_import as CI
+from connections import Base
+from models import Branch, Customer, CustomerNetwork, Router
+
+HEADER = ["Account No", "Customer Name", "Phone", "IP Address", "Billing Amount",
+          "Start Date", "Branch Name", "Router IP", "Cable No"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'import.sqlite'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    nairobi = Branch(name="Nairobi")
+    session.add(nairobi)
+    session.flush()
+    session.add_all([
+        Router(branch_id=nairobi.id, ip_address="10.0.0.1", username="u", password="p"),
+        Router(branch_id=nairobi.id, ip_address="10.0.0.2", username="u", password="p"),
+    ])
+    session.commit()
+
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def sheet(tmp_path):
+    def write(rows):
+        path = tmp_path / "customers.csv"
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+        return str(path)
+    return write
+
+
+def row(account_no, name, ip_address, router_ip="10.0.0.1", phone=None):
+    return [account_no, name, phone or f"07{name}", ip_address, "1500", "2026-10-01",
+            "Nairobi", router_ip, f"C-{name}"]
+
+
+def add_customer(db, **fields):
+    router_id = db.query(Router.id).filter_by(ip_address="10.0.0.1").scalar()
+    db.add(Customer(router_id=router_id, status="active", **fields))
+    db.commit()
+
+
+def names(db):
+    return sorted(name for (name,) in db.query(Customer.name) if name)
+
+
+# ==================== PRE-VALIDATION ====================
+def test_duplicate_account_no_inside_the_sheet_is_skipped(db, sheet):
+    result = CI.import_customers_file(db, sheet([
+        row("A1", "first", "10.1.1.1"),
+        row("A1", "second", "10.1.1.2"),
+        row("A3", "third", "10.1.1.3"),
+    ]), "csv")
+
+    assert (result["imported"], result["skipped"]) == (2, 1)
+    assert names(db) == ["first", "third"]
+    assert result["errors"] == ["Row 3: Account No 'A1' already used by row 2, skipped"]
+
+
+def test_duplicate_against_the_database_is_skipped(db, sheet):
+    add_customer(db, name="existing", account_no="EXIST1", ip_address="10.9.9.9")
+
+    result = CI.import_customers_file(db, sheet([
+        row("EXIST1", "dup account", "10.1.1.1"),
+        row("A2", "dup ip", "10.9.9.9"),
+        row("A3", "new", "10.1.1.3"),
+    ]), "csv")
+
+    assert (result["imported"], result["skipped"]) == (1, 2)
+    assert names(db) == ["existing", "new"]
+    assert result["errors"] == [
+        "Row 2: Account No 'EXIST1' already used by an existing customer, skipped",
+        "Row 3: IP '10.9.9.9' already used on this router by an existing customer, skipped",
+    ]
+
+
+def test_account_no_differing_only_in_case_is_a_duplicate(db, sheet):
+    add_customer(db, name="existing", account_no="ACC9", ip_address="10.9.9.9")
+
+    result = CI.import_customers_file(db, sheet([
+        row("acc9", "lower", "10.1.1.1"),
+        row("B1", "upper", "10.1.1.2"),
+        row("b1", "lower again", "10.1.1.3"),
+    ]), "csv")
+
+    assert result["imported"] == 1
+    assert names(db) == ["existing", "upper"]
+
+
+def test_ip_is_unique_per_router_only(db, sheet):
+    result = CI.import_customers_file(db, sheet([
+        row("A1", "router one", "10.1.1.1", router_ip="10.0.0.1"),
+        row("A2", "same router", "10.1.1.1", router_ip="10.0.0.1"),
+        row("A3", "other router", "10.1.1.1", router_ip="10.0.0.2"),
+        row("A4", "no router", "10.1.1.1", router_ip=""),
+    ]), "csv")
+
+    assert (result["imported"], result["skipped"]) == (3, 1)
+    assert names(db) == ["no router", "other router", "router one"]
+    assert result["errors"] == ["Row 3: IP '10.1.1.1' already used on this router by row 2, skipped"]
+
+
+def test_repeated_phone_is_reported_but_imported(db, sheet):
+    add_customer(db, name="existing", account_no="E1", ip_address="10.9.9.9", phone="0700")
+
+    result = CI.import_customers_file(db, sheet([
+        row("A1", "shares phone", "10.1.1.1", phone="0700"),
+    ]), "csv")
+
+    assert result["imported"] == 1
+    assert result["errors"] == ["Row 2: Phone '0700' also used by an existing customer (imported anyway)"]
+
+
+# ==================== SAVEPOINT FALLBACK ====================
+def test_integrity_error_falls_back_to_row_by_row(db, sheet, monkeypatch):
+    add_customer(db, name="existing", account_no="EXIST1", ip_address="10.9.9.9")
+    # rows the index cannot see (e.g. added by another admin during the import)
+    monkeypatch.setattr(CI.UniquenessIndex, "claim", lambda self, row_no, customer, errors: True)
+
+    result = CI.import_customers_file(db, sheet([
+        row("A1", "good one", "10.1.1.1"),
+        row("EXIST1", "dup account", "10.1.1.2"),
+        row("A3", "good two", "10.1.1.3"),
+        row("A4", "next chunk", "10.1.1.4"),
+    ]), "csv", chunk_size=3)
+
+    assert (result["imported"], result["skipped"], result["chunks"]) == (3, 1, 2)
+    assert names(db) == ["existing", "good one", "good two", "next chunk"]
+    assert result["errors"] == [
+        "Row 3: skipped, rejected by the database (duplicate Account No or IP on the same router)"
+    ]
+    assert db.query(CustomerNetwork).count() == 3
+
+
+# ==================== BULK INSERT IDS ====================
+@pytest.mark.parametrize("returning", [True, False], ids=["returning", "account_no_readback"])
+def test_network_rows_match_their_customers(db, sheet, monkeypatch, returning):
+    # MySQL has no executemany RETURNING: ids come back by account_no,
+    # rows without one are inserted singly
+    monkeypatch.setattr(
+        db.get_bind().dialect, "insert_executemany_returning_sort_by_parameter_order", returning
+    )
+    rows = [row(f"A{i}" if i % 3 else "", f"n{i}", f"10.2.0.{i}") for i in range(1, 11)]
+
+    result = CI.import_customers_file(db, sheet(rows), "csv", chunk_size=4)
+
+    assert result["imported"] == 10
+    pairs = db.query(Customer.name, CustomerNetwork.cable_no).join(
+        CustomerNetwork, CustomerNetwork.customer_id == Customer.id
+    ).all()
+    assert sorted(pairs) == sorted((f"n{i}", f"C-n{i}") for i in range(1, 11))
@@ -0,0 +1,89 @@
+"""
+enforcement.scan_drift against fake_routeros and a SQLite session.
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import enforcement as E
+import mikrotik_helper as M
+from connections import Base
+from fake_routeros import FakeRouterOS
+from models import Branch, Customer, Router, RouterDrift
+
+ADDRESS_LIST = "/ip/firewall/address-list"
+
+
+@pytest.fixture
+def fake():
+    with FakeRouterOS() as server:
+        yield server
+
+
+@pytest.fixture
+def db(tmp_path, fake):
+    engine = create_engine(f"sqlite:///{tmp_path / 'drift.sqlite'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    branch = Branch(name="Nairobi")
+    session.add(branch)
+    session.flush()
+    router = Router(branch_id=branch.id, ip_address=fake.host, port=fake.port,
+                    username=fake.username, password=fake.password)
+    session.add(router)
+    session.commit()
+
+    yield session
+    M.invalidate_router(router.id)
+    session.close()
+    engine.dispose()
+
+
+def add_customers(db, *customers):
+    router_id = db.query(Router.id).scalar()
+    for ip_address, status, grace_pass_date in customers:
+        db.add(Customer(router_id=router_id, ip_address=ip_address, status=status,
+                        grace_pass_date=grace_pass_date))
+    db.commit()
+    return db.query(Router).one()
+
+
+# ==================== DRIFT REPAIR ====================
+def test_repair_relists_grace_customer_without_revoking_the_pass(fake, db):
+    today = datetime.utcnow().date()
+    router = add_customers(
+        db,
+        ("10.0.0.1", "active", None),
+        ("10.0.0.2", "suspended", None),
+        ("10.0.0.3", "grace", today),
+    )
+    M.sync_blocked_list(router, {"10.0.0.2", "10.0.0.3"}, {"10.0.0.3"})
+    # the grace customer's blocked_users entry goes missing on the router
+    fake.tables[ADDRESS_LIST] = [
+        row for row in fake.tables[ADDRESS_LIST]
+        if not (row["list"] == "blocked_users" and row["address"] == "10.0.0.3")
+    ]
+
+    summary = E.scan_drift(db, auto_repair=True)
+
+    assert summary[router.id]["missing"] == 1 and summary[router.id]["repaired"]
+    assert fake.addresses() == {"10.0.0.2", "10.0.0.3"}
+    assert fake.addresses("grace_allowed") == {"10.0.0.3"}
+    assert db.query(RouterDrift.ip_address, RouterDrift.repaired).all() == [("10.0.0.3", True)]
+
+
+def test_repair_blocks_missing_ip_and_unblocks_extra(fake, db):
+    router = add_customers(
+        db,
+        ("10.0.0.1", "active", None),
+        ("10.0.0.2", "suspended", None),
+    )
+    M.block_ip("10.0.0.1", router)
+
+    summary = E.scan_drift(db, auto_repair=True)
+
+    assert (summary[router.id]["missing"], summary[router.id]["extra"]) == (1, 1)
+    assert fake.addresses() == {"10.0.0.2"}
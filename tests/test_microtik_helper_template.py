@@ -0,0 +1,54 @@
+"""
+templates/microtik_helper.py (the older per-call helper) against fake_routeros.
+"""
+import pytest
+
+from fake_routeros import FakeRouterOS, _load_template_helper
+
+LEASES = "/ip/dhcp-server/lease"
+
+
+@pytest.fixture
+def fake():
+    with FakeRouterOS() as server:
+        yield server
+
+
+@pytest.fixture
+def helper():
+    return _load_template_helper()
+
+
+def test_block_leaves_leases_alone_by_default(fake, helper):
+    fake.add_rows(LEASES, [{"address": "10.0.0.5", "dynamic": "true"}])
+
+    assert helper.block_ip("10.0.0.5", fake.router())
+    assert helper.block_ips(["10.0.0.5", "10.0.0.6"], fake.router())
+
+    assert fake.addresses() == {"10.0.0.5", "10.0.0.6"}
+    assert len(fake.tables[LEASES]) == 1
+
+
+@pytest.mark.parametrize("block", ["block_ip", "block_ips"])
+def test_kick_on_block_keeps_static_leases(fake, helper, monkeypatch, block):
+    monkeypatch.setattr(helper, "KICK_ON_BLOCK", True)
+    fake.add_rows(LEASES, [
+        {"address": "10.0.0.5", "dynamic": "false"},
+        {"address": "10.0.0.5", "dynamic": "true"},
+    ])
+
+    if block == "block_ip":
+        assert helper.block_ip("10.0.0.5", fake.router())
+    else:
+        assert helper.block_ips(["10.0.0.5", "10.0.0.6"], fake.router())
+
+    assert [(row["address"], row["dynamic"]) for row in fake.tables[LEASES]] == [("10.0.0.5", "false")]
+
+
+def test_block_ips_succeeds_when_a_lease_is_already_gone(fake, helper, monkeypatch):
+    monkeypatch.setattr(helper, "KICK_ON_BLOCK", True)
+    fake.add_rows(LEASES, [{"address": "10.0.0.5", "dynamic": "true"}])
+    fake.fail_commands[f"{LEASES}/remove"] = "no such item"
+
+    assert helper.block_ips(["10.0.0.5", "10.0.0.6"], fake.router())
+    assert fake.addresses() == {"10.0.0.5", "10.0.0.6"}
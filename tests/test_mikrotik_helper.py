@@ -0,0 +1,179 @@
+"""
+mikrotik_helper against fake_routeros (a local RouterOS API server).
+"""
+import itertools
+
+import pytest
+
+import mikrotik_helper as M
+from fake_routeros import FakeRouterOS
+
+BLOCKED = "/ip/firewall/address-list"
+LEASES = "/ip/dhcp-server/lease"
+HOTSPOT_PRINT = "/ip/hotspot/active/print"
+
+_router_ids = itertools.count(1000)
+
+
+def _router(fake):
+    """Fresh router id per test: the pool, breaker and missing-service memory are module-wide."""
+    return fake.router(id=next(_router_ids))
+
+
+@pytest.fixture
+def fake():
+    with FakeRouterOS() as server:
+        yield server
+
+
+@pytest.fixture
+def router(fake):
+    router = _router(fake)
+    yield router
+    M.invalidate_router(router.id)
+
+
+# ==================== BLOCK / UNBLOCK ====================
+def test_block_and_unblock(fake, router):
+    assert M.block_ip("10.0.0.5", router)
+    assert M.block_ip("10.0.0.5", router)   # already blocked: no second entry
+    assert fake.addresses() == {"10.0.0.5"}
+    assert len(fake.tables[BLOCKED]) == 1
+
+    assert M.unblock_ip("10.0.0.5", router)
+    assert fake.addresses() == set()
+
+
+def test_block_leaves_leases_alone_by_default(fake, router):
+    fake.add_rows(LEASES, [{"address": "10.0.0.5", "dynamic": "true"}])
+
+    M.block_ip("10.0.0.5", router)
+
+    assert len(fake.tables[LEASES]) == 1
+
+
+def test_kick_sessions_keeps_static_leases(fake, router):
+    fake.add_rows(LEASES, [
+        {"address": "10.0.0.5", "dynamic": "false"},
+        {"address": "10.0.0.5", "dynamic": "true"},
+        {"address": "10.0.0.6", "dynamic": "true"},
+    ])
+
+    with M.router_session(router) as api:
+        removed = M.kick_sessions(api, router.id, ["10.0.0.5", "10.0.0.6"])
+
+    assert removed["dhcp"] == 2
+    assert [(row["address"], row["dynamic"]) for row in fake.tables[LEASES]] == [("10.0.0.5", "false")]
+
+
+def test_sync_blocked_list_adds_and_removes(fake, router):
+    M.block_ip("10.0.0.1", router)
+    M.block_ip("10.0.0.2", router)
+
+    M.sync_blocked_list(router, {"10.0.0.2", "10.0.0.3"})
+
+    assert fake.addresses() == {"10.0.0.2", "10.0.0.3"}
+
+
+# ==================== PIPELINED COMMANDS ====================
+def test_run_pipelined_reports_each_trap_in_order(fake, router):
+    commands = [
+        (f"{BLOCKED}/add", {"list": "blocked_users", "address": "10.0.0.1"}),
+        (f"{BLOCKED}/remove", {".id": "*FFFF"}),
+        (f"{BLOCKED}/add", {"list": "blocked_users", "address": "10.0.0.1"}),
+        (f"{BLOCKED}/add", {"list": "blocked_users", "address": "10.0.0.2"}),
+    ]
+
+    with M.router_session(router) as api:
+        replies = M.run_pipelined(api, commands, window=2)
+
+    assert [reply.ok for reply in replies] == [True, False, False, True]
+    assert replies[0].ret and replies[3].ret
+    assert replies[1].error == "no such item"
+    assert "already have such entry" in replies[2].error
+    assert fake.addresses() == {"10.0.0.1", "10.0.0.2"}
+
+
+def test_trap_keeps_the_session_usable(fake, router):
+    fake.fail_commands[f"{BLOCKED}/add"] = "injected failure"
+
+    with M.router_session(router) as api:
+        replies = M.run_pipelined(api, [(f"{BLOCKED}/add", {"list": "blocked_users", "address": "10.0.0.9"})])
+        assert replies == [M.PipelineReply(False, None, "injected failure")]
+        assert list(api(cmd="/system/identity/print"))   # same connection still answers
+
+    assert M.router_health()[router.id]["state"] == "closed"
+
+
+# ==================== CIRCUIT BREAKER ====================
+def test_breaker_opens_then_half_open_probe_closes_it(monkeypatch):
+    fake = FakeRouterOS().start()
+    router = _router(fake)
+    fake.stop()     # nothing listening: connects are refused
+
+    try:
+        for _ in range(M.BREAKER_FAILURE_THRESHOLD):
+            with M.router_session(router, timeout=1) as api:
+                assert api is None
+        assert M.router_health()[router.id]["state"] == "open"
+        assert M.router_is_down(router.id)
+
+        # while open, calls fail fast without connecting
+        with M.router_session(router, timeout=1) as api:
+            assert api is None
+        assert M.router_health()[router.id]["consecutive_failures"] == M.BREAKER_FAILURE_THRESHOLD
+
+        # open period over + router back: one probe goes through and closes the circuit
+        monkeypatch.setattr(M.pool.breaker, "open_seconds", 0)
+        with FakeRouterOS(port=router.port):
+            with M.router_session(router, timeout=1) as api:
+                assert api is not None
+                assert M.router_health()[router.id]["state"] == "half_open"
+        assert M.router_health()[router.id]["state"] == "closed"
+        assert not M.router_is_down(router.id)
+    finally:
+        M.invalidate_router(router.id)
+
+
+def test_failed_half_open_probe_reopens_the_circuit(monkeypatch):
+    fake = FakeRouterOS().start()
+    router = _router(fake)
+    fake.stop()
+
+    try:
+        for _ in range(M.BREAKER_FAILURE_THRESHOLD):
+            with M.router_session(router, timeout=1):
+                pass
+        monkeypatch.setattr(M.pool.breaker, "open_seconds", 0)
+
+        # the probe is let through, fails to connect and re-opens the circuit
+        with M.router_session(router, timeout=1) as api:
+            assert api is None
+
+        health = M.router_health()[router.id]
+        assert health["state"] == "open"
+        assert health["consecutive_failures"] == M.BREAKER_FAILURE_THRESHOLD + 1
+    finally:
+        M.invalidate_router(router.id)
+
+
+# ==================== MISSING SERVICES ====================
+def test_missing_service_is_remembered():
+    with FakeRouterOS(disabled={"hotspot"}) as fake:
+        router = _router(fake)
+        fake.add_rows(LEASES, [{"address": "10.0.0.5", "dynamic": "true"}])
+        try:
+            with M.router_session(router) as api:
+                first = M.kick_sessions(api, router.id, ["10.0.0.5"])
+                second = M.kick_sessions(api, router.id, ["10.0.0.6"])
+
+            assert "hotspot" not in first and first["dhcp"] == 1
+            assert "hotspot" not in second
+            assert fake.command_count(HOTSPOT_PRINT) == 1   # not probed again
+
+            M.forget_missing_services(router.id)
+            with M.router_session(router) as api:
+                M.kick_sessions(api, router.id, ["10.0.0.7"])
+            assert fake.command_count(HOTSPOT_PRINT) == 2
+        finally:
+            M.invalidate_router(router.id)
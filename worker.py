@@ -0,0 +1,25 @@
+"""
+Background worker: runs the APScheduler jobs (status transitions, router
+job outbox, drift scan) outside the web processes.
+
+    python worker.py
+
+Web workers (gunicorn / waitress) only serve requests. Running more than
+one worker is safe: the scheduler_lease row elects a single leader and the
+others take over if it stops heartbeating.
+"""
+import time
+
+from app import app, scheduler, start_scheduler
+from leader import lease
+
+if __name__ == "__main__":
+    with app.app_context():
+        start_scheduler()
+        print(f"⏱️ Scheduler worker started ({lease.holder})")
+        try:
+            while True:
+                time.sleep(60)
+        except (KeyboardInterrupt, SystemExit):
+            scheduler.shutdown(wait=False)
+            lease.release()